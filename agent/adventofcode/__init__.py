@@ -12,13 +12,19 @@ from agent.adventofcode.extract_examples import (
     AoCProblemExtractedExamples,
     extract_examples_from_problem_html,
 )
+from agent.adventofcode.extract_examples_with_context import (
+    ExtractedExamplesWithContext,
+    extract_examples_with_context,
+)
 from agent.adventofcode.generate_code.generate_implementation import (
     generate_implementation,
 )
 from agent.adventofcode.generate_code.GeneratedImplementation import (
     GeneratedImplementation,
 )
+from agent.adventofcode.problem_digest import get_cached_problem_digest, get_problem_digest
 from agent.adventofcode.problem_part import ProblemPart
+from agent.adventofcode.profile_input import InputProfile, profile_input
 from agent.adventofcode.scrape_problems import scrape_aoc
 from agent.adventofcode.write_and_commit_changes import (
     FileToCommit,
@@ -29,15 +35,21 @@ __all__ = [
     "AoCProblem",
     "AoCProblemExtractedExamples",
     "ExamplesContext",
+    "ExtractedExamplesWithContext",
     "FileToCommit",
     "GeneratedImplementation",
+    "InputProfile",
     "ProblemPart",
     "TestResults",
     "execute_generated_solution",
     "execute_tests",
     "contextualize_examples",
     "extract_examples_from_problem_html",
+    "extract_examples_with_context",
     "generate_implementation",
+    "get_cached_problem_digest",
+    "get_problem_digest",
+    "profile_input",
     "scrape_aoc",
     "write_and_commit_changes",
 ]
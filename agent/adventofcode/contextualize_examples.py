@@ -36,13 +36,13 @@ async def contextualize_examples(
     problem_html: str, examples: AoCProblemExtractedExamples, solve_part_2: bool
 ) -> ExamplesContext:
     system_prompt_text = f"""
-You are a skilled technical reader tasked with analyzing coding problems presented within HTML, and sample input/output examples for the coding problem.
+You are a skilled technical reader tasked with analyzing coding problems presented as a Markdown digest, and sample input/output examples for the coding problem.
 
 Your goal is to provide succinct and helpful information on the examples that provides context on what exactly the examples demonstrate from the perspective of enabling someone to write unit tests of an implementation solving the coding problem.
 
 In the spirit of "TDD" (test-driven-development) we're doing this so that we can write unit tests *before* writing the implementation, so, when you're contextualizing the examples, come up with a suggested name for a function that the implementation should follow.
 
-Ignore all HTML tags and focus solely on the input/output data. Do not attempt to solve the problem; only contextualize the examples.
+Focus solely on the input/output data. Do not attempt to solve the problem; only contextualize the examples.
 
 {"""
  !!!!MOST IMPORTANT!!!!: 
@@ -61,13 +61,14 @@ You MUST respond with the specified JSON format.
             subtask_name="contextualize-examples",
             system_prompt=system_prompt_text,
             prompt=f"""
-### Problem HTML:
+### Problem Statement (Markdown digest):
 {problem_html}
 
 ### Input/Output Examples:
 {examples.model_dump_json(indent=2)}
 """,
             response_type=ExamplesContext,
+            cascade_models=[GeminiModel.GEMINI_1_5_FLASH],
         )
     ).unwrap()
 
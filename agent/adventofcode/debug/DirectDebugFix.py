@@ -0,0 +1,20 @@
+from pydantic import BaseModel, Field
+
+from agent.adventofcode.debug.RefactoringPlan import RefactoringPlan
+from agent.adventofcode.debug.TheorizedSolution import TheorizedSolution, pop_default
+from agent.adventofcode.generate_code.CodeEdits import CodeEdit
+
+
+class DirectDebugFix(BaseModel):
+    theorized_solution: TheorizedSolution
+    impl_refactoring_plan: RefactoringPlan
+    optional_unit_test_edits: list[CodeEdit] | None = Field(
+        description="SET THIS FIELD IF YOU THEORIZED A FIX TO THE UNIT TESTS (tests.py). The search/replace edits that FIX tests.py.",  # noqa: E501
+        default=None,
+        json_schema_extra=pop_default,
+    )
+    optional_implementation_edits: list[CodeEdit] | None = Field(
+        description="SET THIS FIELD IF YOU THEORIZED A FIX TO THE IMPLEMENTATION (solution.py). The search/replace edits that FIX solution.py, following your refactoring plan.",  # noqa: E501
+        default=None,
+        json_schema_extra=pop_default,
+    )
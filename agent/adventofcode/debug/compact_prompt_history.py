@@ -0,0 +1,94 @@
+import json
+
+from agent.llm.estimate_tokens import estimate_tokens
+from agent.llm.gemini.prompt import ModelMessage, UserMessage
+
+# Roughly enough for the original prompt, the latest code, and a couple of the most recent
+# debugging turns.
+DEFAULT_PROMPT_HISTORY_TOKEN_BUDGET = 12_000
+
+_OMITTED_ATTEMPTS_HEADER = "### Earlier Debugging Attempts (omitted for brevity):"
+_MAX_OMITTED_ATTEMPT_NOTES = 10
+_MAX_OMITTED_ATTEMPT_NOTE_LEN = 200
+
+
+def compact_prompt_history(
+    prompt_history: list[UserMessage | ModelMessage],
+    token_budget: int = DEFAULT_PROMPT_HISTORY_TOKEN_BUDGET,
+) -> list[UserMessage | ModelMessage]:
+    """Keep the debugging prompt history from growing with every iteration.
+
+    The history always looks like [original prompt, code, feedback, code, feedback, ..., code]. The
+    original prompt and the latest code are always kept, along with as many of the most recent
+    (feedback, code) turns as fit in the token budget. Dropped turns are summarized in a short note
+    appended to the original prompt, so the LLM still knows what it has already tried.
+    """
+    if len(prompt_history) <= 2:
+        return prompt_history
+    assert isinstance(prompt_history[0], UserMessage) and isinstance(
+        prompt_history[-1], ModelMessage
+    ), "Expected the history to start with the original prompt and end with the latest code."
+
+    original_prompt, latest_code = prompt_history[0], prompt_history[-1]
+    # Pair up each intermediate turn with the feedback that followed it.
+    intermediate_turns = [
+        (prompt_history[i], prompt_history[i + 1]) for i in range(1, len(prompt_history) - 1, 2)
+    ]
+
+    tokens = _estimate_msg_tokens(original_prompt) + _estimate_msg_tokens(latest_code)
+    num_kept_turns = 0
+    for turn in reversed(intermediate_turns):
+        tokens += sum(_estimate_msg_tokens(msg) for msg in turn)
+        if tokens > token_budget:
+            break
+        num_kept_turns += 1
+    if num_kept_turns == len(intermediate_turns):
+        return prompt_history
+
+    dropped_turns = intermediate_turns[: len(intermediate_turns) - num_kept_turns]
+    kept_turns = intermediate_turns[len(intermediate_turns) - num_kept_turns :]
+    return [
+        _with_omitted_attempt_notes(
+            original_prompt,
+            [
+                _summarize_feedback(feedback)
+                for _, feedback in dropped_turns
+                if isinstance(feedback, UserMessage)
+            ],
+        ),
+        *(msg for turn in kept_turns for msg in turn),
+        latest_code,
+    ]
+
+
+def _estimate_msg_tokens(msg: UserMessage | ModelMessage) -> int:
+    return estimate_tokens(msg.msg if isinstance(msg, UserMessage) else json.dumps(msg.msg))
+
+
+def _summarize_feedback(feedback: UserMessage) -> str:
+    # Debugging feedback leads with the error message, and its first line is usually the gist.
+    lines = [line.strip() for line in feedback.msg.splitlines() if line.strip()]
+    if "### Error Message:" in lines:
+        lines = lines[lines.index("### Error Message:") + 1 :]
+    note = lines[0] if lines else "(empty feedback)"
+    if len(note) > _MAX_OMITTED_ATTEMPT_NOTE_LEN:
+        note = note[:_MAX_OMITTED_ATTEMPT_NOTE_LEN] + "..."
+    return note
+
+
+def _with_omitted_attempt_notes(original_prompt: UserMessage, notes: list[str]) -> UserMessage:
+    # The original prompt may have already been compacted before, in which case just add to the
+    # existing notes.
+    prompt_text, _, existing_notes = original_prompt.msg.partition(
+        f"\n\n{_OMITTED_ATTEMPTS_HEADER}"
+    )
+    all_notes = [
+        *(line.removeprefix("- ") for line in existing_notes.strip().splitlines()),
+        *(f"Attempt failed with: {note}" for note in notes),
+    ]
+    # Only bother to keep the most recent notes, since they're most relevant.
+    all_notes = all_notes[-_MAX_OMITTED_ATTEMPT_NOTES:]
+    return UserMessage(
+        msg=f"{prompt_text}\n\n{_OMITTED_ATTEMPTS_HEADER}\n"
+        + "\n".join(f"- {note}" for note in all_notes)
+    )
@@ -1,8 +1,20 @@
+from pydantic import BaseModel
 from result import Err, Ok, Result
 from agent.adventofcode.contextualize_examples import ExamplesContext
+from agent.adventofcode.debug.DebuggingPrompt import DebuggingPrompt
+from agent.adventofcode.debug.DirectDebugFix import DirectDebugFix
 from agent.adventofcode.debug.RefactoringPlan import RefactoringPlan
 from agent.adventofcode.debug.TheorizedSolution import TheorizedSolution
 from agent.adventofcode.extract_examples import AoCProblemExtractedExamples
+from agent.adventofcode.generate_code.CodeEdits import CodeEdits, apply_code_edits
+from agent.adventofcode.generate_code.generate_implementation import (
+    GenerateImplementationOutput,
+    get_debugged_implementation_output,
+)
+from agent.adventofcode.generate_code.generate_unit_tests import (
+    GenerateUnitTestsOutput,
+    get_debugged_unit_tests_output,
+)
 from agent.adventofcode.generate_code.GeneratedImplementation import (
     GeneratedImplementation,
 )
@@ -16,7 +28,7 @@ You are also skilled at proposing CORRECT and ACTIONABLE theories on exactly how
 
 In the spirit of "TDD" (test-driven-development) another engineer has run unit tests (tests.py) over their code implementation (solution.py), and you will help them to determine what's going wrong and how to fix it. 
 
-Just for context, you will also be given the coding problem that they're trying to solve. Ignore all HTML tags in the problem statement and focus on how you will implement a valid solution to the problem.
+Just for context, you will also be given the coding problem that they're trying to solve, as a Markdown digest of the problem statement. Focus on how you will implement a valid solution to the problem.
 
 IMPORTANT!! Focus on a SINGLE concrete suggestion in your response. If there are multiple problems, don't try to solve everything all at once.
 
@@ -32,31 +44,13 @@ async def theorize_solution(
     generated_impl_src: GeneratedImplementation,
     error_msg: str,
 ) -> TheorizedSolution:
-    theorize_solution_prompt = f"""
-### Problem HTML:
-{problem_html}
-
-### Unit Tests (tests.py):
-```python
-{unit_tests_src.generated_unit_test_file_content}
-```
-
-## Unit Tests Context (this is what the unit tests SHOULD be doing):
-{examples_context.model_dump_json(indent=2)}
-
-### Tested Implementation (solution.py):
-```python
-{generated_impl_src.generated_implementation_file_content}
-```
-
-## Implementation rules:
-IMPORTANT: Your implementation MUST include an implementation of the function for which unit tests have already been implemented.
-IMPORTANT: The overall solution MUST be implemented as a function named `solution` that takes no args, reads the problem input from stdin, and returns the result (not printing anything to stdout).
-IMPORTANT: The solution() function MUST RETURN THE RESULT VALUE. Do not just print the result to stdout.
-
-### Unit Tests Error Message:
-{error_msg}
-"""
+    theorize_solution_prompt = _get_theorize_solution_prompt(
+        problem_html=problem_html,
+        examples_context=examples_context,
+        unit_tests_src=unit_tests_src,
+        generated_impl_src=generated_impl_src,
+        error_msg=error_msg,
+    )
 
     # Ensure that the theorized solution generates at least one actionable code change.
     attempts = 0
@@ -94,6 +88,40 @@ IMPORTANT: The solution() function MUST RETURN THE RESULT VALUE. Do not just pri
     return theorized_solution.ok_value
 
 
+def _get_theorize_solution_prompt(
+    problem_html: str,
+    examples_context: ExamplesContext,
+    unit_tests_src: GeneratedUnitTests,
+    generated_impl_src: GeneratedImplementation,
+    error_msg: str,
+) -> str:
+    return f"""
+### Problem Statement (Markdown digest):
+{problem_html}
+
+### Unit Tests (tests.py):
+```python
+{unit_tests_src.generated_unit_test_file_content}
+```
+
+## Unit Tests Context (this is what the unit tests SHOULD be doing):
+{examples_context.model_dump_json(indent=2)}
+
+### Tested Implementation (solution.py):
+```python
+{generated_impl_src.generated_implementation_file_content}
+```
+
+## Implementation rules:
+IMPORTANT: Your implementation MUST include an implementation of the function for which unit tests have already been implemented.
+IMPORTANT: The overall solution MUST be implemented as a function named `solution` that takes no args, reads the problem input from stdin, and returns the result (not printing anything to stdout).
+IMPORTANT: The solution() function MUST RETURN THE RESULT VALUE. Do not just print the result to stdout.
+
+### Unit Tests Error Message:
+{error_msg}
+"""
+
+
 PLANNING_SYSTEM_PROMPT_TEXT = """
 You are an expert software engineer, proficient at evaluating coding puzzles and debugging Python 3.12 code that's attempting to solve it.
 
@@ -146,6 +174,7 @@ async def get_refactoring_plan(
 {theorized_implementation_fix}
 """,  # noqa: E501
             response_type=RefactoringPlan,
+            cascade_models=[GeminiModel.GEMINI_1_5_FLASH],
         )
     ).unwrap()
 
@@ -156,3 +185,132 @@ async def get_refactoring_plan(
         )
 
     return refactoring_plan
+
+
+DIRECT_FIX_SYSTEM_PROMPT_TEXT = f"""
+{THEORIZING_SYSTEM_PROMPT_TEXT}
+You are ALSO responsible for actually fixing the code yourself. So, in a SINGLE response:
+    1. Theorize the problem and the fix.
+    2. If the implementation (solution.py) needs to change, come up with a plan to fix it where each step is INCREDIBLY EXPLICIT AND DETAILED.
+    3. Respond with search/replace edits that FIX each file. Only include edits for the files that your theorized fix actually changes.
+
+IMPORTANT: Change as little code as possible to address your theorized fix.
+IMPORTANT: Each search snippet MUST be copied EXACTLY from the given file and MUST appear EXACTLY ONCE in it.
+"""  # noqa: E501
+
+
+class DirectDebugFixOutput(BaseModel):
+    theorized_solution: TheorizedSolution
+    impl_refactoring_plan: RefactoringPlan | None
+    unit_tests: GenerateUnitTestsOutput
+    implementation: GenerateImplementationOutput
+
+
+async def get_direct_debug_fix(
+    problem_html: str,
+    examples_context: ExamplesContext,
+    unit_tests: GenerateUnitTestsOutput,
+    implementation: GenerateImplementationOutput,
+    error_msg: str,
+) -> DirectDebugFixOutput:
+    """Fast path for a debugging iteration that theorizes a solution, plans the refactoring, and
+    generates the fixed code all in a single LLM call, rather than going through theorize_solution()
+    then get_refactoring_plan() then the fix generation itself. Raises if the fix isn't usable, in
+    which case the caller should escalate to that slower three-stage chain."""
+
+    unit_tests_file_content = unit_tests.generated_unit_tests.generated_unit_test_file_content
+    impl_file_content = (
+        implementation.generated_implementation.generated_implementation_file_content
+    )
+
+    def _apply_direct_debug_fix(
+        direct_debug_fix: DirectDebugFix,
+    ) -> Result[tuple[str | None, str | None], str]:
+        theorized_solution = direct_debug_fix.theorized_solution
+        unit_test_edits = direct_debug_fix.optional_unit_test_edits
+        impl_edits = direct_debug_fix.optional_implementation_edits
+        if not (unit_test_edits or impl_edits):
+            return Err("The direct debug fix should fix at least one file.")
+        if bool(theorized_solution.optional_theorized_unit_test_fix) != bool(unit_test_edits):
+            return Err(
+                "The unit tests should be fixed if and only if a unit test fix is theorized."
+            )
+        if bool(theorized_solution.optional_theorized_implementation_fix) != bool(impl_edits):
+            return Err(
+                "The implementation should be fixed if and only if an implementation fix is theorized."  # noqa: E501
+            )
+
+        fixed_unit_tests: str | None = None
+        if unit_test_edits:
+            match apply_code_edits(
+                unit_tests_file_content, CodeEdits(edits=unit_test_edits), "tests.py"
+            ):
+                case Ok(fixed_unit_tests):
+                    pass
+                case Err(err_msg):
+                    return Err(err_msg)
+        fixed_impl: str | None = None
+        if impl_edits:
+            match apply_code_edits(impl_file_content, CodeEdits(edits=impl_edits), "solution.py"):
+                case Ok(fixed_impl):
+                    pass
+                case Err(err_msg):
+                    return Err(err_msg)
+        return Ok((fixed_unit_tests, fixed_impl))
+
+    direct_debug_fix = (
+        await prompt(
+            model=GeminiModel.GEMINI_2_0_FLASH_EXP,
+            subtask_name="direct-debug-fix",
+            system_prompt=DIRECT_FIX_SYSTEM_PROMPT_TEXT,
+            prompt=_get_theorize_solution_prompt(
+                problem_html=problem_html,
+                examples_context=examples_context,
+                unit_tests_src=unit_tests.generated_unit_tests,
+                generated_impl_src=implementation.generated_implementation,
+                error_msg=error_msg,
+            ),
+            response_type=DirectDebugFix,
+            extra_validation_fn=lambda fix: _apply_direct_debug_fix(fix).map(lambda _: None),
+        )
+    ).unwrap()
+    fixed_unit_tests, fixed_impl = _apply_direct_debug_fix(direct_debug_fix).unwrap()
+
+    theorized_solution = direct_debug_fix.theorized_solution
+    impl_refactoring_plan = (
+        direct_debug_fix.impl_refactoring_plan
+        if theorized_solution.optional_theorized_implementation_fix
+        else None
+    )
+    # Record the fixes in each file's prompt history just like the usual debugging chain would.
+    if fixed_unit_tests:
+        unit_tests = get_debugged_unit_tests_output(
+            debugging_prompt=DebuggingPrompt(
+                prior_msg_history=unit_tests.prompt_history,
+                error_msg=error_msg,
+                theorized_solution=theorized_solution,
+                impl_refactoring_plan=None,
+            ),
+            generated_unit_tests=GeneratedUnitTests(
+                generated_unit_test_file_content=fixed_unit_tests
+            ),
+        )
+    if fixed_impl:
+        implementation = get_debugged_implementation_output(
+            debugging_prompt=DebuggingPrompt(
+                prior_msg_history=implementation.prompt_history,
+                error_msg=error_msg,
+                theorized_solution=theorized_solution,
+                impl_refactoring_plan=impl_refactoring_plan,
+            ),
+            generated_implementation=GeneratedImplementation(
+                generated_implementation_file_content=fixed_impl
+            ),
+        )
+
+    return DirectDebugFixOutput(
+        theorized_solution=theorized_solution,
+        impl_refactoring_plan=impl_refactoring_plan,
+        unit_tests=unit_tests,
+        implementation=implementation,
+    )
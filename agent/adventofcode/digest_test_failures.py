@@ -0,0 +1,95 @@
+import os
+import re
+from typing import Any
+
+# Keep the whole digest comfortably small relative to the rest of the debugging prompts.
+_MAX_DIGEST_LEN = 6000
+_MAX_LITERAL_LEN = 200
+_MAX_LINE_LEN = 300
+_MAX_TRACEBACK_LINES = 60
+
+# Single or double quoted string literals (handling escapes) as pytest prints them.
+_STRING_LITERAL_RE = re.compile(r"""'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*\"""")
+
+
+def digest_test_failures(failed_tests: list[dict[str, Any]]) -> str:
+    """Summarize the failed tests from a pytest JSON report for use in a debugging prompt.
+
+    Failures that crash with the same exception at the same location are grouped together with a
+    single representative traceback, large literals (usually the printed problem inputs) are elided
+    with a size marker, and the total length is capped.
+    """
+    groups: dict[tuple[str, int, str], list[dict[str, Any]]] = {}
+    for failed_test in failed_tests:
+        groups.setdefault(_get_failure_group_key(failed_test), []).append(failed_test)
+
+    digest = ""
+    for n, ((path, lineno, exception), group) in enumerate(groups.items()):
+        test_names = ", ".join(_get_test_name(failed_test) for failed_test in group)
+        group_digest = f"""
+### {test_names} ({len(group)} failed) with {exception} at {path}:{lineno}
+{elide_large_literals(group[0]["call"]["longrepr"])}
+
+"""
+        if digest and len(digest) + len(group_digest) > _MAX_DIGEST_LEN:
+            digest += f"\n({len(groups) - n} more distinct failures omitted for brevity.)\n"
+            break
+        digest += group_digest
+
+    return _cap_len(digest)
+
+
+def digest_collection_error(longrepr: str) -> str:
+    return _cap_len(elide_large_literals(longrepr))
+
+
+def elide_large_literals(text: str) -> str:
+    def _elide_string_literal(match: re.Match[str]) -> str:
+        literal = match.group(0)
+        if len(literal) <= _MAX_LITERAL_LEN:
+            return literal
+        return f"{literal[:60]}...<{len(literal) - 80} chars elided>...{literal[-20:]}"
+
+    lines = [
+        _elide_line(_STRING_LITERAL_RE.sub(_elide_string_literal, line))
+        for line in text.splitlines()
+    ]
+    if len(lines) > _MAX_TRACEBACK_LINES:
+        # The tail of a traceback is where the actual error is, so keep more of it.
+        head, tail = _MAX_TRACEBACK_LINES // 3, _MAX_TRACEBACK_LINES - _MAX_TRACEBACK_LINES // 3
+        lines = [
+            *lines[:head],
+            f"...<{len(lines) - head - tail} lines elided>...",
+            *lines[-tail:],
+        ]
+    return "\n".join(lines)
+
+
+def _elide_line(line: str) -> str:
+    if len(line) <= _MAX_LINE_LEN:
+        return line
+    return f"{line[:200]}...<{len(line) - 250} chars elided>...{line[-50:]}"
+
+
+def _get_failure_group_key(failed_test: dict[str, Any]) -> tuple[str, int, str]:
+    call = failed_test.get("call", {})
+    crash = call.get("crash") or {}
+    # Crash messages look like "AssertionError: assert 1 == 2", so group by the exception type.
+    exception = crash.get("message", "").split(":", 1)[0].strip() or "UnknownError"
+    if not re.fullmatch(r"[\w.]+", exception):
+        exception = "UnknownError"
+    return crash.get("path", "unknown"), crash.get("lineno", 0), exception
+
+
+def _get_test_name(failed_test: dict[str, Any]) -> str:
+    test_file, *_, test_name = failed_test["nodeid"].split("::")
+    # Call out tests that don't come from tests.py, e.g. the part 1 regression tests.
+    if not test_file.endswith("/tests.py"):
+        test_name = f"{os.path.basename(test_file)}::{test_name}"
+    return f"{test_name} (line {failed_test['lineno']})"
+
+
+def _cap_len(text: str) -> str:
+    if len(text) <= _MAX_DIGEST_LEN:
+        return text
+    return f"{text[:_MAX_DIGEST_LEN]}\n...<{len(text) - _MAX_DIGEST_LEN} chars truncated>..."
@@ -1,9 +1,10 @@
 import io
 import json
+import os
 import subprocess
 import sys
 from importlib import import_module
-from typing import Any, Literal, cast
+from typing import Literal, cast
 
 import asyncclick as click
 import pytest
@@ -11,20 +12,36 @@ from pydantic import BaseModel
 from pytest_jsonreport.plugin import JSONReport
 from result import Err, Ok, Result
 
+from agent.adventofcode.digest_test_failures import (
+    digest_collection_error,
+    digest_test_failures,
+)
 from agent.adventofcode.problem_part import ProblemPart
 
+# When solving part 2 incrementally from part 1, the part 1 tests may be carried over as regression
+# tests in this file alongside tests.py.
+PART_1_REGRESSION_TESTS_FILENAME = "part1_regression_tests.py"
+
 
 @click.group()
 def cli_group():
     pass
 
 
+def get_default_part_solutions_dir(year: int, day: int, part: ProblemPart) -> str:
+    return f"advent_of_code/year{year}/day{day}/part{part}"
+
+
 def execute_generated_solution(
-    year: int, day: int, part: ProblemPart
+    year: int, day: int, part: ProblemPart, part_solutions_dir: str | None = None
 ) -> Result[str, subprocess.CalledProcessError]:
     """Execute the solution in a subprocess so that this process can make programmatic edits to the
     tests/implementations according to the agent's fixes and have the changes reflected in
-    subsequent test runs."""
+    subsequent test runs.
+
+    part_solutions_dir: The dir with the generated solution.py, under the dir with the problem's
+            input.txt. Defaults to this repo's advent_of_code/year*/day*/part*/ dir.
+    """
     result = subprocess.run(
         [
             "python",
@@ -34,34 +51,46 @@ def execute_generated_solution(
             f"--year={year}",
             f"--day={day}",
             f"--part={part}",
+            *([f"--part-solutions-dir={part_solutions_dir}"] if part_solutions_dir else []),
         ],
         capture_output=True,
         text=True,
         timeout=240,  # 4 minutes.
     )
-    try:
-        return Ok(result.stdout.strip())
-    except subprocess.CalledProcessError as e:
-        return Err(e)
+    if result.returncode != 0:
+        return Err(
+            subprocess.CalledProcessError(
+                result.returncode, result.args, output=result.stdout, stderr=result.stderr
+            )
+        )
+    return Ok(result.stdout.strip())
 
 
 @cli_group.command()
 @click.option("--year", required=True)
 @click.option("--day", required=True)
 @click.option("--part", type=click.Choice(["1", "2"]), default="1")
+@click.option("--part-solutions-dir", default=None)
 def execute_problem_solution(
     year: int,
     day: int,
     part: str,  # type: ignore - Need to redeclare with a cast after parsing into an int.
+    part_solutions_dir: str | None,
 ) -> None:
     part: ProblemPart = cast(ProblemPart, part)
+    part_solutions_dir = part_solutions_dir or get_default_part_solutions_dir(year, day, part)
 
-    with open(f"advent_of_code/year{year}/day{day}/input.txt") as f:
+    # The input is shared between both parts, so it's cached in the problem's top level dir.
+    with open(
+        os.path.join(os.path.dirname(os.path.normpath(part_solutions_dir)), "input.txt")
+    ) as f:
         # Patch stdin to return the contents of the input file without needing to actually have the
         # file contents piped into the program from the cli.
         sys.stdin = io.StringIO(f.read())
 
-    solution_module = import_module(f"advent_of_code.year{year}.day{day}.part{part}.solution")
+    # Import the solution the same way that the generated tests do, so that it works from any dir.
+    sys.path.insert(0, os.path.abspath(part_solutions_dir))
+    solution_module = import_module("solution")
 
     # Execute the actual implementation!
     print(str(solution_module.solution()))
@@ -77,10 +106,16 @@ class TestResults(BaseModel):
     result: Success | Failure
 
 
-def execute_tests(year: int, day: int, part: ProblemPart) -> TestResults:
+def execute_tests(
+    year: int, day: int, part: ProblemPart, part_solutions_dir: str | None = None
+) -> TestResults:
     """Execute the tests in a subprocess so that this process can make programmatic edits to the
     tests/implementations according to the agent's fixes and have the changes reflected in
-    subsequent test runs."""
+    subsequent test runs.
+
+    part_solutions_dir: The dir with the generated tests.py and solution.py. Defaults to this repo's
+            advent_of_code/year*/day*/part*/ dir.
+    """
     result = subprocess.run(
         [
             "python",
@@ -90,6 +125,7 @@ def execute_tests(year: int, day: int, part: ProblemPart) -> TestResults:
             f"--year={year}",
             f"--day={day}",
             f"--part={part}",
+            *([f"--part-solutions-dir={part_solutions_dir}"] if part_solutions_dir else []),
         ],
         capture_output=True,
         text=True,
@@ -100,12 +136,16 @@ def execute_tests(year: int, day: int, part: ProblemPart) -> TestResults:
         case 0:
             return TestResults(result=TestResults.Success())
         case 2:
-            # The tests themselves are broken.
-            test_file = f"advent_of_code/year{year}/day{day}/part{part}/tests.py"
+            # The tests themselves are broken. The node ids are relative to wherever pytest decided
+            # the rootdir is, so just look for the collector that failed.
             return TestResults(
                 result=TestResults.Failure(
-                    err_msg=next(
-                        x["longrepr"] for x in report_json["collectors"] if x["nodeid"] == test_file
+                    err_msg=digest_collection_error(
+                        next(
+                            x["longrepr"]
+                            for x in report_json["collectors"]
+                            if x["outcome"] == "failed"
+                        )
                     )
                 )
             )
@@ -116,10 +156,12 @@ def execute_tests(year: int, day: int, part: ProblemPart) -> TestResults:
                     err_msg=f"""Unit Test Results: {summary["failed"]} of {summary["total"]} Failed 
 
 {
-    "\n\n".join(
-        _fmt_unit_test_failure_msg(unit_test_failure) 
-        for unit_test_failure in report_json["tests"] 
-        if unit_test_failure["outcome"] == "failed"
+    digest_test_failures(
+        [
+            unit_test_failure
+            for unit_test_failure in report_json["tests"]
+            if unit_test_failure["outcome"] == "failed"
+        ]
     )
 }
 """  # noqa: E501
@@ -129,30 +171,30 @@ def execute_tests(year: int, day: int, part: ProblemPart) -> TestResults:
             raise ValueError(f"Encountered unexpected Pytest exit code: {exit_code}")
 
 
-def _fmt_unit_test_failure_msg(unit_test_failure: dict[str, Any]) -> str:
-    return f"""
-### {unit_test_failure["nodeid"].split("::")[-1]} at line {unit_test_failure["lineno"]}
-{unit_test_failure["call"]["longrepr"]}
-
-"""
-
-
 @cli_group.command()
 @click.option("--year", required=True)
 @click.option("--day", required=True)
 @click.option("--part", type=click.Choice(["1", "2"]), default="1")
+@click.option("--part-solutions-dir", default=None)
 def get_test_report(
     year: int,
     day: int,
     part: str,  # type: ignore - Need to redeclare with a cast after parsing into an int.
+    part_solutions_dir: str | None,
 ) -> None:
     part: ProblemPart = cast(ProblemPart, part)
+    part_solutions_dir = part_solutions_dir or get_default_part_solutions_dir(year, day, part)
 
     # I need to prevent Pytest from writing useless logs to stdout, I literally just want the JSON
     # report from the plugin.
     orig_stdout = sys.stdout
     sys.stdout = io.StringIO()  # Throw away any output.
 
+    # Part 2 may also carry over the part 1 tests as regression tests.
+    part_1_regression_tests_file = os.path.join(
+        part_solutions_dir, PART_1_REGRESSION_TESTS_FILENAME
+    )
+
     plugin = JSONReport()
     pytest.main(
         [
@@ -161,7 +203,12 @@ def get_test_report(
             # complicated AoC problem hang forever.
             "--timeout=60",
             "--json-report-file=none",
-            f"advent_of_code/year{year}/day{day}/part{part}/tests.py",
+            os.path.join(part_solutions_dir, "tests.py"),
+            *(
+                [part_1_regression_tests_file]
+                if os.path.isfile(part_1_regression_tests_file)
+                else []
+            ),
         ],
         plugins=[plugin],
     )
@@ -1,4 +1,5 @@
 import asyncio
+from collections import Counter
 from typing import cast
 
 import aiohttp
@@ -21,12 +22,37 @@ class AoCProblemExtractedExamples(BaseModel):
 
 
 async def extract_examples_from_problem_html(
+    problem_html: str, solve_part_2: bool, num_samples: int = 1
+) -> AoCProblemExtractedExamples:
+    """Extract the examples from the problem HTML.
+
+    A single bad extraction poisons every downstream step, so if num_samples > 1, that many
+    extractions are sampled concurrently and the final examples are decided by a vote across them.
+    """
+    if num_samples <= 1:
+        return await _extract_examples_sample(problem_html=problem_html, solve_part_2=solve_part_2)
+
+    samples = await asyncio.gather(
+        *(
+            _extract_examples_sample(problem_html=problem_html, solve_part_2=solve_part_2)
+            for _ in range(num_samples)
+        ),
+        return_exceptions=True,
+    )
+    successful_samples = [s for s in samples if isinstance(s, AoCProblemExtractedExamples)]
+    if not successful_samples:
+        # Every single sample failed, so just surface the first failure.
+        raise cast(BaseException, samples[0])
+    return vote_on_extracted_examples(successful_samples)
+
+
+async def _extract_examples_sample(
     problem_html: str, solve_part_2: bool
 ) -> AoCProblemExtractedExamples:
     system_prompt_text = f"""
-You are a skilled technical reader tasked with extracting input/output examples from coding problems presented within HTML. Your goal is to provide these examples in a format suitable for unit testing.
+You are a skilled technical reader tasked with extracting input/output examples from coding problems presented as a Markdown digest. Your goal is to provide these examples in a format suitable for unit testing.
 
-Don't get confused by HTML tags and focus solely on the input/output data. Do not attempt to solve the problem; only extract the examples.
+Don't get confused by the Markdown formatting and focus solely on the input/output data. Do not attempt to solve the problem; only extract the examples.
 
 Extract ONLY the example inputs and outputs in the JSON format specified.
 
@@ -48,6 +74,7 @@ IMPORTANT! You MUST return examples with a SINGLE input mapping to its SINGLE co
             system_prompt=system_prompt_text,
             prompt=problem_html,
             response_type=AoCProblemExtractedExamples,
+            cascade_models=[GeminiModel.GEMINI_1_5_FLASH],
         )
     ).unwrap()
 
@@ -73,14 +100,65 @@ IMPORTANT! You MUST return examples with a SINGLE input mapping to its SINGLE co
     return extracted_examples
 
 
+def normalized_example_pairs(
+    extracted_examples: AoCProblemExtractedExamples,
+) -> list[tuple[str, str]]:
+    """Normalize away the insignificant whitespace differences that show up between samples so that
+    identical examples actually compare equal."""
+    return [
+        (
+            "\n".join(line.rstrip() for line in example.input.strip("\n").splitlines()),
+            example.output.strip(),
+        )
+        for example in extracted_examples.examples
+    ]
+
+
+def vote_on_extracted_examples(
+    samples: list[AoCProblemExtractedExamples],
+) -> AoCProblemExtractedExamples:
+    """Keep the (input, output) pairs that a strict majority of the samples agree on. If there's no
+    consensus on anything, fall back to the union of all samples. Either way, if the samples
+    disagree on the output for the same input, the most popular output wins.
+
+    The votes are on the normalized examples, but the winners are returned exactly as the first
+    sample that had them extracted them, since some inputs depend on their trailing whitespace.
+    """
+    votes: Counter[tuple[str, str]] = Counter()
+    original_examples: dict[tuple[str, str], AoCProblemExtractedExamples.Example] = {}
+    for sample in samples:
+        # Each sample only gets one vote per example, even if it repeated itself.
+        votes.update(dict.fromkeys(normalized_example_pairs(sample), 1))
+        for pair, example in zip(normalized_example_pairs(sample), sample.examples):
+            original_examples.setdefault(pair, example)
+
+    majority = len(samples) // 2 + 1
+    voted_pairs = [pair for pair, count in votes.items() if count >= majority] or list(votes)
+
+    # Counter preserves insertion order, so examples stay in the order they were first extracted.
+    best_output_by_input: dict[str, str] = {}
+    for input, output in voted_pairs:
+        curr_best_output = best_output_by_input.get(input)
+        if curr_best_output is None or votes[(input, output)] > votes[(input, curr_best_output)]:
+            best_output_by_input[input] = output
+
+    return AoCProblemExtractedExamples(
+        examples=[
+            original_examples[(input, output)] for input, output in best_output_by_input.items()
+        ]
+    )
+
+
 @click.command()
 @click.option("--year", required=True)
 @click.option("--day", required=True)
 @click.option("--part", type=Choice(["1", "2"]), default="1")
+@click.option("--num-samples", type=int, default=1)
 async def _cmd(
     year: int,
     day: int,
     part: str,  # type: ignore - Need to redeclare with a cast after parsing into an int.
+    num_samples: int,
 ) -> None:
     configure_genai()
     async with aiohttp.ClientSession() as session:
@@ -90,6 +168,7 @@ async def _cmd(
                     session=session, year=year, day=day, part=cast(ProblemPart, int(part))
                 ),
                 solve_part_2=part == "2",
+                num_samples=num_samples,
             )
         )
 
@@ -0,0 +1,148 @@
+import asyncio
+from typing import cast
+
+import aiohttp
+import asyncclick as click
+from asyncclick import Choice
+from pydantic import BaseModel
+from result import Err, Ok, Result
+
+from agent.adventofcode.contextualize_examples import ExamplesContext, contextualize_examples
+from agent.adventofcode.extract_examples import (
+    AoCProblemExtractedExamples,
+    extract_examples_from_problem_html,
+    normalized_example_pairs,
+    vote_on_extracted_examples,
+)
+from agent.adventofcode.scrape_problems import ProblemPart, scrape_aoc
+from agent.llm.gemini.configure_genai import configure_genai
+from agent.llm.gemini.models import GeminiModel
+from agent.llm.gemini.prompt import prompt
+
+
+class ExtractedExamplesWithContext(BaseModel):
+    extracted_examples: AoCProblemExtractedExamples
+    examples_context: ExamplesContext
+
+
+async def extract_examples_with_context(
+    problem_html: str, solve_part_2: bool, num_samples: int = 1
+) -> ExtractedExamplesWithContext:
+    """Extract the examples AND contextualize them in a single LLM call, so that the problem HTML
+    only needs to be sent once at the start of every attempt. If the fused response doesn't pass
+    validation, this falls back to the original (serial) two-call path.
+
+    If num_samples > 1, that many fused responses are sampled concurrently and the examples are
+    decided by a vote across them (see `vote_on_extracted_examples`).
+    """
+    system_prompt_text = f"""
+You are a skilled technical reader tasked with analyzing coding problems presented as a Markdown digest. You have two jobs:
+
+1. Extract the input/output examples from the coding problem in a format suitable for unit testing.
+2. Provide succinct and helpful context on what exactly those examples demonstrate from the perspective of enabling someone to write unit tests of an implementation solving the coding problem.
+
+In the spirit of "TDD" (test-driven-development) we're doing this so that we can write unit tests *before* writing the implementation, so, when you're contextualizing the examples, come up with a suggested name for a function that the implementation should follow.
+
+Don't get confused by the Markdown formatting and focus solely on the input/output data. Do not attempt to solve the problem; only extract and contextualize the examples.
+
+{"""
+ !!!!MOST IMPORTANT!!!!:
+    - You are tasked with solving PART 2 of a multi-part problem that BUILDS ON TOP OF PART 1.
+    - The problem parts 1 and 2 are denoted by the following HTML comments: "<!-- Part 1 -->", and "<!-- Part 2 -->".
+    - You MUST FOCUS on part 2.
+    - Keep in mind that part 2 is a modification/variation on part 1 so pay attention to how part 2 specifies modifications on part 1.
+    - Part 2 MAY EITHER specify completely new example inputs and outputs OR build on top of examples given in part 1 - IN EITHER CASE EXTRACT AND CONTEXTUALIZE EXAMPLES THAT APPLY TO PART 2!
+
+ """ if solve_part_2 else ""}
+IMPORTANT! You MUST return examples with a SINGLE input mapping to its SINGLE corresponding output.
+You MUST respond with the specified JSON format.
+"""  # noqa: E501
+
+    samples = await asyncio.gather(
+        *(
+            prompt(
+                model=GeminiModel.GEMINI_1_5_PRO,
+                subtask_name="extract-examples-with-context",
+                system_prompt=system_prompt_text,
+                prompt=problem_html,
+                response_type=ExtractedExamplesWithContext,
+                extra_validation_fn=_validate_extracted_examples_with_context,
+                cascade_models=[GeminiModel.GEMINI_1_5_FLASH],
+            )
+            for _ in range(max(num_samples, 1))
+        )
+    )
+    successful_samples = [sample.ok_value for sample in samples if isinstance(sample, Ok)]
+    if successful_samples:
+        return _vote_on_samples(successful_samples)
+
+    print(
+        "Fused example extraction failed, falling back to two LLM calls: "
+        + "; ".join(sample.err_value.msg for sample in samples if isinstance(sample, Err))
+    )
+    extracted_examples = await extract_examples_from_problem_html(
+        problem_html=problem_html, solve_part_2=solve_part_2, num_samples=num_samples
+    )
+    return ExtractedExamplesWithContext(
+        extracted_examples=extracted_examples,
+        examples_context=await contextualize_examples(
+            problem_html=problem_html, examples=extracted_examples, solve_part_2=solve_part_2
+        ),
+    )
+
+
+def _vote_on_samples(samples: list[ExtractedExamplesWithContext]) -> ExtractedExamplesWithContext:
+    voted_examples = vote_on_extracted_examples([s.extracted_examples for s in samples])
+    voted_pairs = set(normalized_example_pairs(voted_examples))
+    # The context only needs to describe the voted examples, so borrow it from whichever sample
+    # agrees with the vote the most.
+    most_agreeable_sample = max(
+        samples,
+        key=lambda s: len(voted_pairs.intersection(normalized_example_pairs(s.extracted_examples))),
+    )
+    return ExtractedExamplesWithContext(
+        extracted_examples=voted_examples,
+        examples_context=most_agreeable_sample.examples_context,
+    )
+
+
+def _validate_extracted_examples_with_context(
+    extracted_examples_with_context: ExtractedExamplesWithContext,
+) -> Result[None, str]:
+    if len(extracted_examples_with_context.extracted_examples.examples) == 0:
+        return Err("No examples extracted.")
+    tested_function_name = (
+        extracted_examples_with_context.examples_context.tested_function_details.name
+    )
+    if not tested_function_name.isidentifier():
+        return Err(f"Suggested tested function name is not valid Python: {tested_function_name}")
+    return Ok(None)
+
+
+@click.command()
+@click.option("--year", required=True)
+@click.option("--day", required=True)
+@click.option("--part", type=Choice(["1", "2"]), default="1")
+@click.option("--num-samples", type=int, default=1)
+async def _cmd(
+    year: int,
+    day: int,
+    part: str,  # type: ignore - Need to redeclare with a cast after parsing into an int.
+    num_samples: int,
+) -> None:
+    configure_genai()
+    async with aiohttp.ClientSession() as session:
+        problem_html = await scrape_aoc(
+            session=session, year=year, day=day, part=cast(ProblemPart, int(part))
+        )
+    print(
+        (
+            await extract_examples_with_context(
+                problem_html=problem_html, solve_part_2=part == "2", num_samples=num_samples
+            )
+        ).model_dump_json(indent=2)
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(_cmd())
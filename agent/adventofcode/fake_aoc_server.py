@@ -0,0 +1,146 @@
+import asyncio
+import math
+import os
+import random
+import time
+from dataclasses import dataclass
+
+import asyncclick as click
+from aiohttp import web
+
+# These are the response bodies that submit_solution.py keys off of, copied from the real site.
+_RIGHT_ANSWER_HTML = '<article><p>That\'s the right answer!  You are one gold star closer to finding the Chief Historian. [<a href="/{year}/day/{day}">Continue to Part Two</a>]</p></article>'  # noqa: E501
+_WRONG_ANSWER_HTML = '<article><p>That\'s not the right answer.  If you\'re stuck, make sure you\'re using the full input data; there are also some general tips on the <a href="/{year}/about">about page</a>, or you can ask for hints on the <a href="https://www.reddit.com/r/adventofcode/" target="_blank">subreddit</a>.  Please wait one minute before trying again. [<a href="/{year}/day/{day}">Return to Day {day}</a>]</p></article>'  # noqa: E501
+_ANSWERED_TOO_RECENTLY_HTML = '<article><p>You gave an answer too recently; you have to wait after submitting an answer before trying again.  You have {wait_seconds}s left to wait. [<a href="/{year}/day/{day}">Return to Day {day}</a>]</p></article>'  # noqa: E501
+_NOT_LOGGED_IN_INPUT_TEXT = (
+    "Puzzle inputs differ by user.  Please log in to get your puzzle input.\n"
+)
+
+
+@dataclass(frozen=True)
+class FakeAoCServerConfig:
+    # Laid out the same as this repo's advent_of_code/ dir, i.e.
+    # year{year}/day{day}/{problem.html,input.txt,part{part}/solution.txt}
+    fixtures_dir: str
+    # The latency of every response is lognormally distributed around this median.
+    median_latency_seconds: float = 0.2
+    latency_sigma: float = 0.5
+    # The real site makes you wait a minute after each wrong answer.
+    wrong_answer_timeout_seconds: int = 60
+
+
+class _FakeAoCServer:
+    def __init__(self, config: FakeAoCServerConfig) -> None:
+        self._config = config
+        # (year, day) -> The time until which answers will be rejected as too recent.
+        self._answer_timeouts: dict[tuple[int, int], float] = {}
+
+    def get_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/{year:\\d+}/day/{day:\\d+}", self._problem)
+        app.router.add_get("/{year:\\d+}/day/{day:\\d+}/input", self._input)
+        app.router.add_post("/{year:\\d+}/day/{day:\\d+}/answer", self._answer)
+        return app
+
+    async def _problem(self, request: web.Request) -> web.Response:
+        await self._sleep_latency()
+        year, day = _get_year_and_day(request)
+        return web.Response(
+            text=self._read_fixture(year, day, "problem.html"), content_type="text/html"
+        )
+
+    async def _input(self, request: web.Request) -> web.Response:
+        await self._sleep_latency()
+        if "Cookie" not in request.headers:
+            return web.Response(text=_NOT_LOGGED_IN_INPUT_TEXT, status=400)
+        year, day = _get_year_and_day(request)
+        return web.Response(text=self._read_fixture(year, day, "input.txt"))
+
+    async def _answer(self, request: web.Request) -> web.Response:
+        await self._sleep_latency()
+        year, day = _get_year_and_day(request)
+        data = await request.post()
+        solution = self._read_fixture(year, day, f"part{data['level']}", "solution.txt")
+
+        if (wait_seconds := self._answer_timeouts.get((year, day), 0) - time.time()) > 0:
+            article = _ANSWERED_TOO_RECENTLY_HTML.format(
+                year=year, day=day, wait_seconds=math.ceil(wait_seconds)
+            )
+        elif str(data["answer"]).strip() == solution.strip():
+            article = _RIGHT_ANSWER_HTML.format(year=year, day=day)
+        else:
+            self._answer_timeouts[(year, day)] = (
+                time.time() + self._config.wrong_answer_timeout_seconds
+            )
+            article = _WRONG_ANSWER_HTML.format(year=year, day=day)
+        return web.Response(
+            text=f"<!DOCTYPE html>\n<html><body><main>\n{article}\n</main></body></html>",
+            content_type="text/html",
+        )
+
+    def _read_fixture(self, year: int, day: int, *path: str) -> str:
+        fixture_path = os.path.join(self._config.fixtures_dir, f"year{year}", f"day{day}", *path)
+        if not os.path.isfile(fixture_path):
+            raise web.HTTPNotFound(text="404 Not Found")
+        with open(fixture_path, "r") as f:
+            return f.read()
+
+    async def _sleep_latency(self) -> None:
+        await asyncio.sleep(
+            random.lognormvariate(
+                math.log(self._config.median_latency_seconds), self._config.latency_sigma
+            )
+        )
+
+
+def _get_year_and_day(request: web.Request) -> tuple[int, int]:
+    return int(request.match_info["year"]), int(request.match_info["day"])
+
+
+def get_fake_aoc_server_app(config: FakeAoCServerConfig) -> web.Application:
+    return _FakeAoCServer(config).get_app()
+
+
+@click.command()
+@click.option("--host", default="localhost")
+@click.option("--port", default=8090, type=int)
+@click.option(
+    "--fixtures-dir",
+    default="advent_of_code",
+    type=click.Path(exists=True, file_okay=False),
+    help="Archived problem.html, input.txt and part{1,2}/solution.txt files to serve.",
+)
+@click.option("--median-latency-seconds", default=0.2, type=float)
+@click.option("--latency-sigma", default=0.5, type=float)
+@click.option("--wrong-answer-timeout-seconds", default=60, type=int)
+async def _cmd(
+    host: str,
+    port: int,
+    fixtures_dir: str,
+    median_latency_seconds: float,
+    latency_sigma: float,
+    wrong_answer_timeout_seconds: int,
+) -> None:
+    """Serve a local stand-in for adventofcode.com so that scraping and submitting can be exercised
+    without hitting the real site. Point the agent at it with AOC_BASE_URL=http://host:port."""
+    runner = web.AppRunner(
+        get_fake_aoc_server_app(
+            FakeAoCServerConfig(
+                fixtures_dir=fixtures_dir,
+                median_latency_seconds=median_latency_seconds,
+                latency_sigma=latency_sigma,
+                wrong_answer_timeout_seconds=wrong_answer_timeout_seconds,
+            )
+        )
+    )
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving the fake AoC server on http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cmd())
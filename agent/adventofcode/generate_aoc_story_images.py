@@ -8,7 +8,7 @@ from agent.adventofcode.scrape_problems import scrape_aoc
 from agent.llm.gemini.configure_genai import configure_genai
 from agent.llm.gemini.models import GeminiModel
 from agent.llm.gemini.prompt import prompt, text_prompt
-from agent.llm.openai.generate_image import download_image, generate_image_to_url
+from agent.llm.openai.generate_image import generate_image
 
 
 class ProblemStorySummary(BaseModel):
@@ -22,7 +22,7 @@ class ProblemStorySummary(BaseModel):
 
 
 EXTRACT_PROBLEM_STORY_SUMMARY_PROMPT = """
-You will be given an HTML specification of a coding puzzle framed as a NARRATIVE story about elves and maybe other festive characters.
+You will be given a Markdown digest of the specification of a coding puzzle framed as a NARRATIVE story about elves and maybe other festive characters.
 
 Extract the following information from the given problem description:
 
@@ -137,8 +137,7 @@ async def main(
     image_generation_prompt = await format_image_generation_prompt(problem_story_summary)
     print(image_generation_prompt)
 
-    url = await generate_image_to_url(image_generation_prompt)
-    await download_image(url, save_path)
+    await generate_image(image_generation_prompt, save_path)
 
 
 if __name__ == "__main__":
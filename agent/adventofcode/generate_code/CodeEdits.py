@@ -0,0 +1,85 @@
+from typing import Any
+
+from pydantic import BaseModel, Field
+from result import Err, Ok, Result
+
+
+class CodeEdit(BaseModel):
+    search: str = Field(
+        description="A snippet of the CURRENT file to be replaced, copied EXACTLY character for character (including whitespace and indentation). It MUST appear EXACTLY ONCE in the file, so include enough surrounding lines to make it unique."  # noqa: E501
+    )
+    replace: str = Field(
+        description="The text that the search snippet should be replaced with. May be empty to delete the snippet."  # noqa: E501
+    )
+
+
+class CodeEdits(BaseModel):
+    edits: list[CodeEdit] = Field(
+        description="The search/replace edits to apply to the file, in order. Each edit is applied to the result of the previous edits."  # noqa: E501
+    )
+
+
+def get_code_edits_instructions(filename: str) -> str:
+    return f"""
+IMPORTANT: DO NOT respond with the entire contents of {filename}. Instead, respond ONLY with a list of search/replace edits to apply to the latest version of {filename}.
+IMPORTANT: Each search snippet MUST be copied EXACTLY from the latest version of {filename} and MUST appear EXACTLY ONCE in it.
+IMPORTANT: Keep each edit as small as possible, but make sure that the file is valid Python after all edits are applied.
+"""  # noqa: E501
+
+
+def apply_code_edits(file_content: str, code_edits: CodeEdits, filename: str) -> Result[str, str]:
+    """Apply the edits to the file content, making sure that every edit applies unambiguously and
+    that the result is actually a changed, syntactically valid Python file. When this fails, the
+    caller should just fall back to regenerating the whole file."""
+    if not code_edits.edits:
+        return Err("No edits given.")
+
+    edited_file_content = file_content
+    for n, edit in enumerate(code_edits.edits):
+        if not edit.search:
+            return Err(f"Edit {n} has an empty search snippet.")
+        match edited_file_content.count(edit.search):
+            case 1:
+                edited_file_content = edited_file_content.replace(edit.search, edit.replace)
+            case 0:
+                return Err(f"Edit {n}'s search snippet was not found in {filename}:\n{edit.search}")
+            case count:
+                return Err(
+                    f"Edit {n}'s search snippet is ambiguous, it was found {count} times in {filename}:\n{edit.search}"  # noqa: E501
+                )
+
+    if edited_file_content == file_content:
+        return Err(f"The edits didn't actually change {filename}.")
+    try:
+        compile(edited_file_content, filename, "exec")
+    except SyntaxError as e:
+        return Err(f"{filename} isn't valid Python after applying the edits: {e}")
+    return Ok(edited_file_content)
+
+
+def validate_partial_code_edits(
+    file_content: str, partial_code_edits: Any, filename: str
+) -> Result[None, str]:
+    """Check code edits that are still being streamed in, failing as soon as it's certain that
+    apply_code_edits(...) would fail because a search snippet can't possibly match."""
+    if not isinstance(partial_code_edits, dict) or not isinstance(
+        partial_edits := partial_code_edits.get("edits"), list
+    ):
+        return Ok(None)  # Too early to tell, the schema check will catch anything else.
+
+    edited_file_content = file_content
+    for n, edit in enumerate(partial_edits):
+        search = edit.get("search") if isinstance(edit, dict) else None
+        if not isinstance(search, str):
+            continue
+        if n < len(partial_edits) - 1:
+            # All but the last edit are complete, so they must already apply unambiguously.
+            if edited_file_content.count(search) != 1:
+                return Err(
+                    f"Edit {n}'s search snippet doesn't match exactly once in {filename}:\n{search}"
+                )
+            edited_file_content = edited_file_content.replace(search, str(edit.get("replace", "")))
+        elif search not in edited_file_content:
+            # Even a partially streamed search snippet must already be somewhere in the file.
+            return Err(f"Edit {n}'s search snippet was not found in {filename}:\n{search}")
+    return Ok(None)
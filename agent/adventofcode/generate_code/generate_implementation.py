@@ -1,3 +1,4 @@
+import ast
 import asyncio
 from typing import cast
 
@@ -10,12 +11,20 @@ from agent.adventofcode.contextualize_examples import (
     ExamplesContext,
     contextualize_examples,
 )
+from agent.adventofcode.debug.compact_prompt_history import compact_prompt_history
 from agent.adventofcode.debug.DebuggingPrompt import DebuggingPrompt
 from agent.adventofcode.extract_examples import extract_examples_from_problem_html
+from agent.adventofcode.generate_code.CodeEdits import (
+    CodeEdits,
+    apply_code_edits,
+    get_code_edits_instructions,
+    validate_partial_code_edits,
+)
 from agent.adventofcode.generate_code.GeneratedImplementation import (
     GeneratedImplementation,
 )
 from agent.adventofcode.problem_part import ProblemPart
+from agent.adventofcode.profile_input import InputProfile
 from agent.adventofcode.scrape_problems import scrape_aoc
 from agent.llm.anthropic.prompt import prompt as anthropic_prompt
 from agent.llm.anthropic.models import AnthropicModel
@@ -36,12 +45,25 @@ class GenerateImplementationOutput(PromptHistory, BaseModel):
 def _get_initial_attempt_system_prompt_text(
     solve_part_2: bool,
     part_1_generated_implementation: GenerateImplementationOutput | None,
+    # A speculative draft is generated before the unit tests have been written, so the prompt can't
+    # claim otherwise.
+    speculative: bool = False,
 ) -> str:
-    GENERATED_CODE_RULES = """
+    TESTED_FUNCTION_RULE = (
+        "IMPORTANT: Your implementation MUST implement the core logic in a function that takes the parsed problem input as args, so that it can be unit tested."  # noqa: E501
+        if speculative
+        else "IMPORTANT: Your implementation MUST include an implementation of the function for which unit tests have already been implemented."  # noqa: E501
+    )
+    TDD_TEXT = (
+        "Unit tests will be written from the examples in the problem statement, so, make sure that your solution will handle those examples."  # noqa: E501
+        if speculative
+        else 'In the spirit of "TDD" (test-driven-development) unit tests have already been written before the implementation itself, so, make sure that your solution will pass the given sampled test cases.'  # noqa: E501
+    )
+    GENERATED_CODE_RULES = f"""
 You MUST respond with a single complete Python 3.12 program with full type annotations. 
 IMPORTANT: ONLY use imports from Python's stdlib. DO NOT use any third party libraries whatsoever in your implementation.
 IMPORTANT: Your implementation MUST ONLY do I/O to read the problem input from stdin. You MUST NOT open any files.
-IMPORTANT: Your implementation MUST include an implementation of the function for which unit tests have already been implemented.
+{TESTED_FUNCTION_RULE}
 IMPORTANT: The solution() function MUST take no args and read the input from stdin.
 IMPORTANT: The solution() function MUST RETURN THE RESULT VALUE. Do not print anything to stdout.
 """
@@ -49,13 +71,13 @@ IMPORTANT: The solution() function MUST RETURN THE RESULT VALUE. Do not print an
     INITIAL_ATTEMPT_SYSTEM_PROMPT_TEXT = f"""
 You are a skilled software engineer, proficient at evaluating coding problems and writing simple and correct solutions using Python 3.12.
 
-Ignore all HTML tags in the problem statement and focus on how you will implement a valid solution to the problem.
+The problem statement is given as a Markdown digest of the problem's web page. Focus on how you will implement a valid solution to the problem.
 
-In the spirit of "TDD" (test-driven-development) unit tests have already been written before the implementation itself, so, make sure that your solution will pass the given sampled test cases.
+{TDD_TEXT}
 
 Your goal is to provide a succinct and correct solution to the given coding problem that will handle the given examples and any other edge cases that tests are not explicitly given for.
 
-Remember to ignore all HTML tags and carefully attempt to solve the problem.
+Remember to carefully attempt to solve the problem.
 
 {GENERATED_CODE_RULES}
 {f"""
@@ -76,63 +98,51 @@ if part_1_generated_implementation else ""}
 
 async def generate_implementation(
     problem_html: str,
-    examples_context: ExamplesContext,
+    # If None, this generates a speculative draft implementation from the problem HTML alone, which
+    # must be reconciled with the examples context later via reconcile_speculative_implementation().
+    examples_context: ExamplesContext | None,
     solve_part_2: bool,
     part_1_generated_implementation: GenerateImplementationOutput | None = None,
     debugging_prompt: DebuggingPrompt | None = None,
+    input_profile: InputProfile | None = None,
+    # If set, this implementation (e.g. committed by a previous run) is recorded as the response to
+    # the initial prompt instead of generating a new one.
+    resumed_implementation: GeneratedImplementation | None = None,
 ) -> GenerateImplementationOutput:
     generate_implementation_prompt = _get_generate_implementation_prompt(
         problem_html=problem_html,
         examples_context=examples_context,
         debugging_prompt=debugging_prompt,
+        input_profile=input_profile,
     )
     # The initial prompt will use the more capable Clause Sonnet 3.5 model, but subsequent debugging
     # requests will use Gemini 1.5 Pro.
     INITIAL_ATTEMPT_SYSTEM_PROMPT_TEXT = _get_initial_attempt_system_prompt_text(
         solve_part_2=solve_part_2,
         part_1_generated_implementation=part_1_generated_implementation,
+        speculative=examples_context is None,
     )
 
     generated_implementation: GeneratedImplementation
-    if debugging_prompt:
-
-        def _validate_implementation_is_updated(
-            curr_generated_implementation: GeneratedImplementation,
-        ) -> Result[None, str]:
-            if _implementation_is_updated(curr_generated_implementation, debugging_prompt):
-                return Ok(None)
-            else:
-                return Err(
-                    "The implementation was not actually updated based on the debugging prompt."
+    if resumed_implementation:
+        assert debugging_prompt is None, "Can only resume an initial implementation."
+        generated_implementation = resumed_implementation
+    elif debugging_prompt:
+        # Output tokens are the slowest part of generation, so first just ask for targeted edits to
+        # the previous implementation rather than having the LLM re-emit the entire file. Only if
+        # the edits don't cleanly apply does this fall back to regenerating the whole file.
+        match await _get_edited_implementation(
+            system_prompt=INITIAL_ATTEMPT_SYSTEM_PROMPT_TEXT, debugging_prompt=debugging_prompt
+        ):
+            case Ok(generated_implementation):
+                pass
+            case Err(err_msg):
+                print(f"Failed to edit the implementation, regenerating it instead: {err_msg}")
+                generated_implementation = await _get_regenerated_implementation(
+                    system_prompt=INITIAL_ATTEMPT_SYSTEM_PROMPT_TEXT,
+                    generate_implementation_prompt=generate_implementation_prompt,
+                    debugging_prompt=debugging_prompt,
                 )
-
-        attempts = 0
-        MAX_RETRIES = 3
-        while True:
-            attempts += 1
-            match await gemini_prompt(
-                # model=GeminiModel.GEMINI_1_5_PRO,
-                # model=GeminiModel.GEMINI_EXP_1206,
-                model=GeminiModel.GEMINI_2_0_FLASH_EXP,
-                subtask_name="generate-implementation",
-                system_prompt=INITIAL_ATTEMPT_SYSTEM_PROMPT_TEXT,
-                prompt=generate_implementation_prompt,
-                response_type=GeneratedImplementation,
-                extra_validation_fn=_validate_implementation_is_updated,
-            ):
-                case Ok(generated_implementation):
-                    generated_implementation = generated_implementation
-                    break
-                case Err(_):
-                    if attempts >= MAX_RETRIES:
-                        # TODO(steving) DROP THIS... but for now, allow a duplicated generation
-                        generated_implementation = _get_prev_generated_impl(debugging_prompt)
-                        break
-                        # raise ValueError(
-                        #     f"Failed to get LLM to generate a NEW implementation after {MAX_RETRIES} retries."  # noqa: E501
-                        # )
-                    else:
-                        continue  # Just being explicit here that this is when we loop.
     else:
         assert isinstance(generate_implementation_prompt[0], UserMessage), "Lazy coding"
         generated_implementation = (
@@ -142,6 +152,8 @@ async def generate_implementation(
                 system_prompt=INITIAL_ATTEMPT_SYSTEM_PROMPT_TEXT,
                 prompt=generate_implementation_prompt[0].msg,
                 response_type=GeneratedImplementation,
+                # The (large) problem statement is the same across every attempt at this part.
+                cacheable_prompt_prefix=_get_problem_statement_prompt_section(problem_html),
             )
         ).unwrap()
 
@@ -154,6 +166,85 @@ async def generate_implementation(
     )
 
 
+async def _get_edited_implementation(
+    system_prompt: str, debugging_prompt: DebuggingPrompt
+) -> Result[GeneratedImplementation, str]:
+    prev_impl_file_content = _get_prev_generated_impl(
+        debugging_prompt
+    ).generated_implementation_file_content
+
+    def _validate_code_edits(code_edits: CodeEdits) -> Result[None, str]:
+        return apply_code_edits(prev_impl_file_content, code_edits, "solution.py").map(
+            lambda _: None
+        )
+
+    match await gemini_prompt(
+        model=GeminiModel.GEMINI_2_0_FLASH_EXP,
+        subtask_name="edit-implementation",
+        system_prompt=system_prompt,
+        prompt=_get_debugging_prompt(debugging_prompt, code_edits_mode=True),
+        response_type=CodeEdits,
+        extra_validation_fn=_validate_code_edits,
+        # Bail on edits as soon as a search snippet can't possibly match.
+        stream=True,
+        partial_validation_fn=lambda partial_code_edits: validate_partial_code_edits(
+            prev_impl_file_content, partial_code_edits, "solution.py"
+        ),
+    ):
+        case Ok(code_edits):
+            return apply_code_edits(prev_impl_file_content, code_edits, "solution.py").map(
+                lambda edited_file_content: GeneratedImplementation(
+                    generated_implementation_file_content=edited_file_content
+                )
+            )
+        case Err(err):
+            return Err(err.msg)
+
+
+async def _get_regenerated_implementation(
+    system_prompt: str,
+    generate_implementation_prompt: list[UserMessage | ModelMessage],
+    debugging_prompt: DebuggingPrompt,
+) -> GeneratedImplementation:
+    def _validate_implementation_is_updated(
+        curr_generated_implementation: GeneratedImplementation,
+    ) -> Result[None, str]:
+        if _implementation_is_updated(curr_generated_implementation, debugging_prompt):
+            return Ok(None)
+        else:
+            return Err(
+                "The implementation was not actually updated based on the debugging prompt."
+            )
+
+    attempts = 0
+    MAX_RETRIES = 3
+    while True:
+        attempts += 1
+        match await gemini_prompt(
+            # The model router may swap this out based on how the models have fared historically.
+            model=GeminiModel.GEMINI_2_0_FLASH_EXP,
+            subtask_name="generate-implementation",
+            system_prompt=system_prompt,
+            prompt=generate_implementation_prompt,
+            response_type=GeneratedImplementation,
+            extra_validation_fn=_validate_implementation_is_updated,
+            # Whether the implementation is updated is only known once it's complete, but this
+            # still bails on malformed responses as soon as they go wrong.
+            stream=True,
+        ):
+            case Ok(generated_implementation):
+                return generated_implementation
+            case Err(_):
+                if attempts >= MAX_RETRIES:
+                    # TODO(steving) DROP THIS... but for now, allow a duplicated generation
+                    return _get_prev_generated_impl(debugging_prompt)
+                    # raise ValueError(
+                    #     f"Failed to get LLM to generate a NEW implementation after {MAX_RETRIES} retries."  # noqa: E501
+                    # )
+                else:
+                    continue  # Just being explicit here that this is when we loop.
+
+
 def _get_prev_generated_impl(debugging_prompt: DebuggingPrompt) -> GeneratedImplementation:
     return GeneratedImplementation.model_validate(
         # The last ModelMessage in the prompt history is the previous implementation.
@@ -183,19 +274,52 @@ def _implementation_is_updated(
 
 def _get_generate_implementation_prompt(
     problem_html: str,
-    examples_context: ExamplesContext,
+    examples_context: ExamplesContext | None,
     debugging_prompt: DebuggingPrompt | None = None,
+    input_profile: InputProfile | None = None,
 ) -> list[UserMessage | ModelMessage]:
     prompt: list[UserMessage | ModelMessage]
 
     if debugging_prompt:
-        assert (
-            debugging_prompt.impl_refactoring_plan is not None
-        ), "Refactoring plan is required for debugging prompt"
+        prompt = _get_debugging_prompt(debugging_prompt)
+    else:
         prompt = [
-            *debugging_prompt.prior_msg_history,
             UserMessage(
-                msg=f"""
+                msg=f"""{_get_problem_statement_prompt_section(problem_html)}{f"""
+### Existing Unit Tests:
+{examples_context.model_dump_json(indent=2)}
+""" if examples_context else ""}{f"""
+### Real Puzzle Input Scale:
+Your solution will be run against a real puzzle input that is MUCH larger than the examples. Here's its profile:
+{input_profile.get_scale_hints()}
+
+IMPORTANT: Choose an algorithm that will run efficiently at this scale. Avoid brute force if it won't finish in a few seconds.
+""" if input_profile else ""}"""  # noqa: E501
+            )
+        ]
+
+    return prompt
+
+
+def _get_problem_statement_prompt_section(problem_html: str) -> str:
+    return f"""
+### Problem Statement (Markdown digest):
+{problem_html}
+"""
+
+
+def _get_debugging_prompt(
+    debugging_prompt: DebuggingPrompt, code_edits_mode: bool = False
+) -> list[UserMessage | ModelMessage]:
+    assert (
+        debugging_prompt.impl_refactoring_plan is not None
+    ), "Refactoring plan is required for debugging prompt"
+    return [
+        # Keep the cost of each debugging iteration roughly constant rather than growing with
+        # every prior turn.
+        *compact_prompt_history(debugging_prompt.prior_msg_history),
+        UserMessage(
+            msg=f"""
 The solution you previously generated was not completely correct, an issue was encountered when trying to run it.
 Follow the error message below to correct any issues in the generated solution.
 
@@ -209,23 +333,198 @@ IMPORTANT: Follow the given refactoring plan EXACTLY to fix the problem.
 
 ### Refactoring Plan:
 {"\n".join(f"Step {n}: {step}" for n, step in enumerate(debugging_prompt.impl_refactoring_plan.plan))}
+{get_code_edits_instructions("solution.py") if code_edits_mode else ""}"""  # noqa: E501
+        ),
+    ]
+
+
+def get_debugged_implementation_output(
+    debugging_prompt: DebuggingPrompt, generated_implementation: GeneratedImplementation
+) -> GenerateImplementationOutput:
+    """Record an implementation fix that was generated elsewhere (e.g. by the direct debug fix fast
+    path) in the prompt history as if it were generated in response to the usual debugging prompt,
+    so that later debugging iterations can carry on from it as normal."""
+    return GenerateImplementationOutput(
+        prompt_history=[
+            *_get_debugging_prompt(debugging_prompt),
+            ModelMessage(msg=generated_implementation.model_dump()),
+        ],
+        generated_implementation=generated_implementation,
+    )
+
+
+async def reconcile_speculative_implementation(
+    speculative_implementation: GenerateImplementationOutput,
+    problem_html: str,
+    examples_context: ExamplesContext,
+    solve_part_2: bool,
+    part_1_generated_implementation: GenerateImplementationOutput | None = None,
+    input_profile: InputProfile | None = None,
+) -> GenerateImplementationOutput:
+    """Reconcile a speculative draft implementation (generated without the examples context) with
+    the examples context that the unit tests will be generated from.
+
+    The draft is kept as-is if it already implements the suggested tested function, otherwise the
+    LLM is asked to patch it. If even that fails, this falls back to generating the implementation
+    from scratch with the examples context.
+    """
+    tested_function_details = examples_context.tested_function_details
+    if implements_tested_function(
+        speculative_implementation.generated_implementation, tested_function_details
+    ):
+        return speculative_implementation
+
+    def _validate_implements_tested_function(
+        generated_implementation: GeneratedImplementation,
+    ) -> Result[None, str]:
+        if implements_tested_function(generated_implementation, tested_function_details):
+            return Ok(None)
+        return Err(
+            f"The implementation doesn't implement the tested function `{tested_function_details.name}`."  # noqa: E501
+        )
+
+    reconcile_prompt = [
+        *speculative_implementation.prompt_history,
+        UserMessage(
+            msg=f"""
+Unit tests have now been written for the solution you previously generated. This is the context that the unit tests were written from:
+{examples_context.model_dump_json(indent=2)}
+
+IMPORTANT: Your solution does not yet implement the tested function with the expected signature. Update your solution so that it implements `{tested_function_details.name}({", ".join(tested_function_details.input_type_annotations)}) -> {tested_function_details.output_type_annotation}` and so that the solution() function makes use of it.
+IMPORTANT: Change as little code as possible.
 """  # noqa: E501
-            ),
-        ]
-    else:
-        prompt = [
-            UserMessage(
-                msg=f"""
-### Problem Statement HTML:
+        ),
+    ]
+    match await gemini_prompt(
+        model=GeminiModel.GEMINI_2_0_FLASH_EXP,
+        subtask_name="reconcile-speculative-implementation",
+        system_prompt=_get_initial_attempt_system_prompt_text(
+            solve_part_2=solve_part_2,
+            part_1_generated_implementation=part_1_generated_implementation,
+        ),
+        prompt=reconcile_prompt,
+        response_type=GeneratedImplementation,
+        extra_validation_fn=_validate_implements_tested_function,
+    ):
+        case Ok(generated_implementation):
+            return GenerateImplementationOutput(
+                prompt_history=[
+                    *reconcile_prompt,
+                    ModelMessage(msg=generated_implementation.model_dump()),
+                ],
+                generated_implementation=generated_implementation,
+            )
+        case Err(err):
+            print(f"Failed to reconcile speculative implementation, regenerating: {err.msg}")
+            return await generate_implementation(
+                problem_html=problem_html,
+                examples_context=examples_context,
+                solve_part_2=solve_part_2,
+                part_1_generated_implementation=part_1_generated_implementation,
+                input_profile=input_profile,
+            )
+
+
+async def generate_incremental_part_2_implementation(
+    problem_html: str,
+    examples_context: ExamplesContext,
+    part_1_generated_implementation: GenerateImplementationOutput,
+    input_profile: InputProfile | None = None,
+) -> GenerateImplementationOutput:
+    """Rather than generating part 2 from scratch, ask for edits to the passing part 1 solution.py
+    so that everything that part 2 doesn't change (most importantly, the input parsing) carries over
+    as-is. Falls back to generating the whole part 2 implementation if the edits don't apply."""
+    part_1_impl_file_content = (
+        part_1_generated_implementation.generated_implementation.generated_implementation_file_content
+    )
+    tested_function_details = examples_context.tested_function_details
+    incremental_prompt = f"""
+### Problem Statement:
 {problem_html}
 
 ### Existing Unit Tests:
 {examples_context.model_dump_json(indent=2)}
-"""
+
+### Working Part 1 Implementation (solution.py):
+```python
+{part_1_impl_file_content}
+```
+
+The implementation above already correctly solves PART 1. Modify it to solve PART 2 instead.
+IMPORTANT: Keep the input parsing and any other logic that part 2 doesn't change EXACTLY as-is. Only change what part 2's new semantics actually require.
+IMPORTANT: Your implementation MUST implement `{tested_function_details.name}({", ".join(tested_function_details.input_type_annotations)}) -> {tested_function_details.output_type_annotation}` and the solution() function MUST return the answer to PART 2.
+IMPORTANT: Leave the part 1 functions in place (unless they're literally replaced by the part 2 functions of the same name) so that the part 1 tests keep passing.
+{f"""
+### Real Puzzle Input Scale:
+{input_profile.get_scale_hints()}
+""" if input_profile else ""}"""  # noqa: E501
+
+    code_edits_res = await anthropic_prompt(
+        model=AnthropicModel.CLAUDE_SONNET_3_5_OCT_2024,
+        subtask_name="generate-incremental-part-2-implementation",
+        system_prompt=_get_initial_attempt_system_prompt_text(
+            solve_part_2=True, part_1_generated_implementation=None
+        ),
+        # Only ask for edits in this request, the history should record the whole resulting file.
+        prompt=incremental_prompt + get_code_edits_instructions("solution.py"),
+        response_type=CodeEdits,
+        stream=True,
+        partial_validation_fn=lambda partial_code_edits: validate_partial_code_edits(
+            part_1_impl_file_content, partial_code_edits, "solution.py"
+        ),
+    )
+    match code_edits_res.map_err(lambda err: err.msg).and_then(
+        lambda code_edits: apply_code_edits(part_1_impl_file_content, code_edits, "solution.py")
+    ):
+        case Ok(part_2_impl_file_content):
+            generated_implementation = GeneratedImplementation(
+                generated_implementation_file_content=part_2_impl_file_content
             )
-        ]
+            if implements_tested_function(generated_implementation, tested_function_details):
+                return GenerateImplementationOutput(
+                    prompt_history=[
+                        UserMessage(msg=incremental_prompt),
+                        ModelMessage(msg=generated_implementation.model_dump()),
+                    ],
+                    generated_implementation=generated_implementation,
+                )
+            print("Incremental part 2 implementation doesn't implement the tested function.")
+        case Err(err_msg):
+            print(f"Failed to edit the part 1 implementation: {err_msg}")
 
-    return prompt
+    print("Falling back to generating the part 2 implementation from scratch.")
+    return await generate_implementation(
+        problem_html=problem_html,
+        examples_context=examples_context,
+        solve_part_2=True,
+        part_1_generated_implementation=part_1_generated_implementation,
+        input_profile=input_profile,
+    )
+
+
+def implements_tested_function(
+    generated_impl: GeneratedImplementation,
+    tested_function_details: ExamplesContext.SuggestedTestedFunctionDetails,
+) -> bool:
+    try:
+        module = ast.parse(generated_impl.generated_implementation_file_content)
+    except SyntaxError:
+        return False
+
+    for node in module.body:
+        if (
+            isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            and node.name == tested_function_details.name
+        ):
+            # The tests will call the function positionally, so as long as the expected number of
+            # args fits between the required and total number of positional params, it's callable.
+            positional_params = [*node.args.posonlyargs, *node.args.args]
+            num_required_params = len(positional_params) - len(node.args.defaults)
+            num_expected_args = len(tested_function_details.input_type_annotations)
+            return num_required_params <= num_expected_args <= len(positional_params) or (
+                node.args.vararg is not None and num_required_params <= num_expected_args
+            )
+    return False
 
 
 @click.command()
@@ -5,16 +5,24 @@ import aiohttp
 import asyncclick as click
 from asyncclick import Choice
 from pydantic import BaseModel
+from result import Err, Ok, Result
 
 from agent.adventofcode.contextualize_examples import (
     ExamplesContext,
     contextualize_examples,
 )
+from agent.adventofcode.debug.compact_prompt_history import compact_prompt_history
 from agent.adventofcode.debug.DebuggingPrompt import DebuggingPrompt
 from agent.adventofcode.extract_examples import (
     AoCProblemExtractedExamples,
     extract_examples_from_problem_html,
 )
+from agent.adventofcode.generate_code.CodeEdits import (
+    CodeEdits,
+    apply_code_edits,
+    get_code_edits_instructions,
+    validate_partial_code_edits,
+)
 from agent.adventofcode.generate_code.GeneratedUnitTests import GeneratedUnitTests
 from agent.adventofcode.scrape_problems import ProblemPart, scrape_aoc
 from agent.llm.anthropic.models import AnthropicModel
@@ -37,6 +45,9 @@ async def generate_unit_tests(
     examples: AoCProblemExtractedExamples,
     examples_context: ExamplesContext,
     debugging_prompt: DebuggingPrompt | None = None,
+    # If set, these unit tests (e.g. committed by a previous run) are recorded as the response to
+    # the initial prompt instead of generating new ones.
+    resumed_unit_tests: GeneratedUnitTests | None = None,
 ) -> GenerateUnitTestsOutput:
     system_prompt_text = """
 You are a skilled software test engineer skilled at writing Python 3.12, Pytest based unit tests based on sample input/output examples for a tested function described by its signature given as JSON.
@@ -61,16 +72,28 @@ IMPORTANT: Only generate unit tests for the given POSITIVE examples of valid inp
     )
     # The initial prompt will use the more capable Clause Sonnet 3.5 model, but subsequent debugging
     # requests will use Gemini 1.5 Pro.
-    if debugging_prompt:
-        generated_unit_tests = (
-            await gemini_prompt(
-                model=GeminiModel.GEMINI_1_5_PRO,
-                subtask_name="generate-unit-tests",
-                system_prompt=system_prompt_text,
-                prompt=generate_unit_tests_prompt,
-                response_type=GeneratedUnitTests,
-            )
-        ).unwrap()
+    if resumed_unit_tests:
+        assert debugging_prompt is None, "Can only resume initial unit tests."
+        generated_unit_tests = resumed_unit_tests
+    elif debugging_prompt:
+        # First just ask for targeted edits to the previous unit tests rather than having the LLM
+        # re-emit the entire file, falling back to regenerating the whole file if they don't apply.
+        match await _get_edited_unit_tests(
+            system_prompt=system_prompt_text, debugging_prompt=debugging_prompt
+        ):
+            case Ok(generated_unit_tests):
+                pass
+            case Err(err_msg):
+                print(f"Failed to edit the unit tests, regenerating them instead: {err_msg}")
+                generated_unit_tests = (
+                    await gemini_prompt(
+                        model=GeminiModel.GEMINI_1_5_PRO,
+                        subtask_name="generate-unit-tests",
+                        system_prompt=system_prompt_text,
+                        prompt=generate_unit_tests_prompt,
+                        response_type=GeneratedUnitTests,
+                    )
+                ).unwrap()
     else:
         assert isinstance(generate_unit_tests_prompt[0], UserMessage), "Lazy coding"
         generated_unit_tests = (
@@ -92,6 +115,46 @@ IMPORTANT: Only generate unit tests for the given POSITIVE examples of valid inp
     )
 
 
+async def _get_edited_unit_tests(
+    system_prompt: str, debugging_prompt: DebuggingPrompt
+) -> Result[GeneratedUnitTests, str]:
+    prev_unit_tests_file_content = GeneratedUnitTests.model_validate(
+        # The last ModelMessage in the prompt history is the previous unit tests.
+        next(
+            part
+            for part in reversed(debugging_prompt.prior_msg_history)
+            if isinstance(part, ModelMessage)
+        ).msg
+    ).generated_unit_test_file_content
+
+    def _validate_code_edits(code_edits: CodeEdits) -> Result[None, str]:
+        return apply_code_edits(prev_unit_tests_file_content, code_edits, "tests.py").map(
+            lambda _: None
+        )
+
+    match await gemini_prompt(
+        model=GeminiModel.GEMINI_2_0_FLASH_EXP,
+        subtask_name="edit-unit-tests",
+        system_prompt=system_prompt,
+        prompt=_get_debugging_prompt(debugging_prompt, code_edits_mode=True),
+        response_type=CodeEdits,
+        extra_validation_fn=_validate_code_edits,
+        # Bail on edits as soon as a search snippet can't possibly match.
+        stream=True,
+        partial_validation_fn=lambda partial_code_edits: validate_partial_code_edits(
+            prev_unit_tests_file_content, partial_code_edits, "tests.py"
+        ),
+    ):
+        case Ok(code_edits):
+            return apply_code_edits(prev_unit_tests_file_content, code_edits, "tests.py").map(
+                lambda edited_file_content: GeneratedUnitTests(
+                    generated_unit_test_file_content=edited_file_content
+                )
+            )
+        case Err(err):
+            return Err(err.msg)
+
+
 def _get_generate_unit_tests_prompt(
     examples: AoCProblemExtractedExamples,
     examples_context: ExamplesContext,
@@ -100,10 +163,32 @@ def _get_generate_unit_tests_prompt(
     prompt: list[UserMessage | ModelMessage]
 
     if debugging_prompt:
+        prompt = _get_debugging_prompt(debugging_prompt)
+    else:
         prompt = [
-            *debugging_prompt.prior_msg_history,
             UserMessage(
                 msg=f"""
+### Input/Output Examples:
+{examples.model_dump_json(indent=2)}
+
+### Examples Context:
+{examples_context.model_dump_json(indent=2)}
+"""
+            )
+        ]
+
+    return prompt
+
+
+def _get_debugging_prompt(
+    debugging_prompt: DebuggingPrompt, code_edits_mode: bool = False
+) -> list[UserMessage | ModelMessage]:
+    return [
+        # Keep the cost of each debugging iteration roughly constant rather than growing with
+        # every prior turn.
+        *compact_prompt_history(debugging_prompt.prior_msg_history),
+        UserMessage(
+            msg=f"""
 The unit tests you previously generated were not completely correct, an issue was encountered when trying to run them.
 Follow the error message below to correct any issues in the generated unit tests.
 
@@ -117,23 +202,24 @@ IMPORTANT: Change as little code as possible to address the recommended fix.
 
 ### Suggested Fix:
 {debugging_prompt.theorized_solution.optional_theorized_unit_test_fix}
-"""  # noqa: E501
-            ),
-        ]
-    else:
-        prompt = [
-            UserMessage(
-                msg=f"""
-### Input/Output Examples:
-{examples.model_dump_json(indent=2)}
+{get_code_edits_instructions("tests.py") if code_edits_mode else ""}"""  # noqa: E501
+        ),
+    ]
 
-### Examples Context:
-{examples_context.model_dump_json(indent=2)}
-"""
-            )
-        ]
 
-    return prompt
+def get_debugged_unit_tests_output(
+    debugging_prompt: DebuggingPrompt, generated_unit_tests: GeneratedUnitTests
+) -> GenerateUnitTestsOutput:
+    """Record a unit test fix that was generated elsewhere (e.g. by the direct debug fix fast path)
+    in the prompt history as if it were generated in response to the usual debugging prompt, so
+    that later debugging iterations can carry on from it as normal."""
+    return GenerateUnitTestsOutput(
+        prompt_history=[
+            *_get_debugging_prompt(debugging_prompt),
+            ModelMessage(msg=generated_unit_tests.model_dump()),
+        ],
+        generated_unit_tests=generated_unit_tests,
+    )
 
 
 @click.command()
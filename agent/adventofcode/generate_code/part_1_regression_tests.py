@@ -0,0 +1,61 @@
+from agent.adventofcode.extract_examples import normalized_example_pairs
+from agent.adventofcode.extract_examples_with_context import ExtractedExamplesWithContext
+from agent.adventofcode.generate_code.generate_implementation import implements_tested_function
+from agent.adventofcode.generate_code.GeneratedImplementation import GeneratedImplementation
+from agent.adventofcode.generate_code.GeneratedUnitTests import GeneratedUnitTests
+
+_NO_PART_1_REGRESSION_TESTS_FILE_CONTENT = """\
+# The part 1 tests don't apply to the part 2 implementation: {reason}
+"""
+
+
+def get_no_part_1_regression_tests_file_content(reason: str) -> str:
+    return _NO_PART_1_REGRESSION_TESTS_FILE_CONTENT.format(reason=reason)
+
+
+def get_part_1_regression_tests_file_content(
+    # Unknown if part 1 was already solved by a previous run.
+    part_1_examples_with_context: ExtractedExamplesWithContext | None,
+    part_1_unit_tests: GeneratedUnitTests,
+    part_2_examples_with_context: ExtractedExamplesWithContext,
+    part_2_implementation: GeneratedImplementation,
+) -> str:
+    """The passing part 1 tests make for free regression tests of the part 2 implementation when it
+    was derived from part 1, as long as the part 1 tested function is still there unchanged. That's
+    only the case if part 2 tests a differently named function, and it's only worth it if the
+    examples overlap (i.e. both parts exercise the same parsing of the same inputs).
+
+    This always returns file content, explaining why the tests don't apply if they don't, so that
+    the file never goes stale across attempts.
+    """
+    if part_1_examples_with_context is None:
+        return get_no_part_1_regression_tests_file_content("the part 1 examples are unknown.")
+
+    part_1_tested_function_details = (
+        part_1_examples_with_context.examples_context.tested_function_details
+    )
+    part_2_tested_function_name = (
+        part_2_examples_with_context.examples_context.tested_function_details.name
+    )
+    part_1_inputs = {
+        example_input
+        for example_input, _ in normalized_example_pairs(
+            part_1_examples_with_context.extracted_examples
+        )
+    }
+    part_2_inputs = {
+        example_input
+        for example_input, _ in normalized_example_pairs(
+            part_2_examples_with_context.extracted_examples
+        )
+    }
+
+    if part_1_tested_function_details.name == part_2_tested_function_name:
+        reason = f"part 2 redefines `{part_2_tested_function_name}`."
+    elif not part_1_inputs & part_2_inputs:
+        reason = "the part 1 and part 2 examples don't overlap."
+    elif not implements_tested_function(part_2_implementation, part_1_tested_function_details):
+        reason = f"`{part_1_tested_function_details.name}` is no longer implemented."
+    else:
+        return part_1_unit_tests.generated_unit_test_file_content
+    return get_no_part_1_regression_tests_file_content(reason)
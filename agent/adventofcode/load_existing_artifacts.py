@@ -0,0 +1,45 @@
+import os
+
+from pydantic import BaseModel
+
+from agent.adventofcode.generate_code.GeneratedImplementation import GeneratedImplementation
+from agent.adventofcode.generate_code.GeneratedUnitTests import GeneratedUnitTests
+
+
+class ExistingArtifacts(BaseModel):
+    unit_tests: GeneratedUnitTests | None
+    implementation: GeneratedImplementation | None
+    # Only gets cached once AoC has accepted the answer, see submit().
+    cached_solution: str | None
+
+
+def load_existing_artifacts(part_solutions_dir: str) -> ExistingArtifacts:
+    """Load whatever a previous run already committed to the part's solutions dir, so that a rerun
+    can pick up where it left off rather than starting from scratch."""
+    unit_test_file_content = _read_file_if_exists(os.path.join(part_solutions_dir, "tests.py"))
+    implementation_file_content = _read_file_if_exists(
+        os.path.join(part_solutions_dir, "solution.py")
+    )
+    cached_solution = _read_file_if_exists(os.path.join(part_solutions_dir, "solution.txt"))
+    return ExistingArtifacts(
+        unit_tests=(
+            GeneratedUnitTests(generated_unit_test_file_content=unit_test_file_content)
+            if unit_test_file_content
+            else None
+        ),
+        implementation=(
+            GeneratedImplementation(
+                generated_implementation_file_content=implementation_file_content
+            )
+            if implementation_file_content
+            else None
+        ),
+        cached_solution=cached_solution.strip() if cached_solution else None,
+    )
+
+
+def _read_file_if_exists(path: str) -> str | None:
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return f.read()
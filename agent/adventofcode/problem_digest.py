@@ -0,0 +1,120 @@
+import asyncio
+import os
+from typing import cast
+
+import aiohttp
+import asyncclick as click
+from asyncclick import Choice
+from bs4 import BeautifulSoup, Comment, NavigableString, Tag
+
+from agent.adventofcode.problem_part import ProblemPart
+from agent.adventofcode.scrape_problems import scrape_aoc
+from agent.llm.estimate_tokens import estimate_tokens
+
+
+# Bump this whenever the digest changes, so that the digests cached by earlier runs get regenerated.
+_PROBLEM_DIGEST_VERSION = 1
+
+
+def get_problem_digest(problem_html: str) -> str:
+    """Convert the problem HTML into a much more compact Markdown digest to send in prompts instead.
+
+    The text within <pre> blocks is preserved EXACTLY since that's where the examples live, and the
+    "<!-- Part 1 -->"/"<!-- Part 2 -->" markers are kept since the prompts refer to them.
+    """
+    soup = BeautifulSoup(problem_html, "html.parser")
+    blocks: list[str] = []
+    _append_blocks(soup, blocks)
+    return "\n\n".join(block for block in blocks if block) + "\n"
+
+
+def _append_blocks(node: Tag, blocks: list[str]) -> None:
+    for child in node.children:
+        if isinstance(child, Comment):
+            blocks.append(f"<!-- {child.strip()} -->")
+        elif isinstance(child, NavigableString):
+            # Stray text between block level elements, e.g. the "Part 1 solved" note.
+            blocks.append(" ".join(child.split()))
+        elif isinstance(child, Tag):
+            match child.name:
+                case "h1" | "h2" | "h3":
+                    blocks.append(f"## {_get_inline_text(child).strip('- ')}")
+                case "pre":
+                    # The examples MUST come through character for character.
+                    pre_text = child.get_text().rstrip("\n")
+                    blocks.append(f"```\n{pre_text}\n```")
+                case "ul" | "ol":
+                    blocks.append(
+                        "\n".join(
+                            f"- {_get_inline_text(li)}"
+                            for li in child.find_all("li", recursive=False)
+                        )
+                    )
+                case "p":
+                    blocks.append(_get_inline_text(child))
+                case "script" | "style":
+                    pass
+                case _:
+                    _append_blocks(child, blocks)
+
+
+def _get_inline_text(node: Tag) -> str:
+    parts: list[str] = []
+    for child in node.children:
+        if isinstance(child, Comment):
+            continue
+        elif isinstance(child, NavigableString):
+            parts.append(str(child))
+        elif isinstance(child, Tag):
+            match child.name:
+                case "code":
+                    # Inline code may be emphasized, but the backticks are enough to set it apart.
+                    parts.append(f"`{child.get_text()}`")
+                case "em":
+                    parts.append(f"**{_get_inline_text(child)}**")
+                case _:
+                    parts.append(_get_inline_text(child))
+    return " ".join("".join(parts).split())
+
+
+def get_cached_problem_digest(problem_html: str, part_solutions_dir: str) -> str:
+    # Check if the digest already exists alongside the cached problem.html.
+    problem_digest_file_path = os.path.join(
+        part_solutions_dir, f"problem_digest.v{_PROBLEM_DIGEST_VERSION}.md"
+    )
+    if os.path.isfile(problem_digest_file_path):
+        with open(problem_digest_file_path, "r") as f:
+            return f.read()
+
+    problem_digest = get_problem_digest(problem_html)
+    html_tokens = estimate_tokens(problem_html)
+    digest_tokens = estimate_tokens(problem_digest)
+    print(
+        f"Problem digest saves ~{html_tokens - digest_tokens} tokens per prompt "
+        f"(~{html_tokens} -> ~{digest_tokens}, {1 - digest_tokens / html_tokens:.0%} smaller)."
+    )
+    with open(problem_digest_file_path, "w") as f:
+        f.write(problem_digest)
+    return problem_digest
+
+
+@click.command()
+@click.option("--year", required=True)
+@click.option("--day", required=True)
+@click.option("--part", type=Choice(["1", "2"]), default="1")
+async def _cmd(
+    year: int,
+    day: int,
+    part: str,  # type: ignore - Need to redeclare with a cast after parsing into an int.
+) -> None:
+    async with aiohttp.ClientSession() as session:
+        problem_html = await scrape_aoc(
+            session=session, year=year, day=day, part=cast(ProblemPart, int(part))
+        )
+    problem_digest = get_problem_digest(problem_html)
+    print(problem_digest)
+    print(f"~{estimate_tokens(problem_html)} -> ~{estimate_tokens(problem_digest)} tokens")
+
+
+if __name__ == "__main__":
+    asyncio.run(_cmd())
@@ -0,0 +1,79 @@
+import re
+
+from pydantic import BaseModel
+
+_INT_RE = re.compile(r"-?\d+")
+
+
+class InputProfile(BaseModel):
+    num_lines: int
+    num_chars: int
+    max_line_len: int
+    # Blank line separated sections, e.g. rules followed by updates.
+    num_sections: int
+    # Set if the input (or its largest section) looks like a character grid.
+    grid_rows: int | None
+    grid_cols: int | None
+    num_ints: int
+    max_abs_int: int | None
+    max_tokens_per_line: int
+
+    def get_scale_hints(self) -> str:
+        hints = [
+            f"- {self.num_lines} lines ({self.num_chars} chars), the longest being {self.max_line_len} chars.",  # noqa: E501
+            f"- Up to {self.max_tokens_per_line} whitespace separated tokens per line.",
+        ]
+        if self.num_sections > 1:
+            hints.append(f"- {self.num_sections} blank line separated sections.")
+        if self.grid_rows is not None and self.grid_cols is not None:
+            hints.append(
+                f"- A {self.grid_rows}x{self.grid_cols} character grid ({self.grid_rows * self.grid_cols} cells)."  # noqa: E501
+            )
+        if self.max_abs_int is not None:
+            hints.append(
+                f"- {self.num_ints} integers, with magnitudes up to {self.max_abs_int} (~10^{len(str(self.max_abs_int)) - 1})."  # noqa: E501
+            )
+        return "\n".join(hints)
+
+
+def profile_input(problem_input: str) -> InputProfile:
+    """Cheaply profile the real puzzle input so that the LLM knows what scale its solution has to
+    handle, rather than just the tiny examples given in the problem statement."""
+    lines = problem_input.rstrip("\n").splitlines()
+    sections = [
+        section.splitlines()
+        for section in re.split(r"\n\s*\n", problem_input.strip("\n"))
+        if section
+    ]
+
+    grid_rows, grid_cols = None, None
+    non_grid_sections = sections
+    if sections:
+        largest_section = max(sections, key=len)
+        # A grid is a block of several equal length lines without any whitespace in them.
+        if (
+            len(largest_section) > 1
+            and len({len(line) for line in largest_section}) == 1
+            and not any(re.search(r"\s", line) for line in largest_section)
+        ):
+            grid_rows, grid_cols = len(largest_section), len(largest_section[0])
+            # Digit grids would otherwise look like a column of huge integers.
+            non_grid_sections = [section for section in sections if section is not largest_section]
+    ints = [
+        abs(int(i))
+        for section in non_grid_sections
+        for line in section
+        for i in _INT_RE.findall(line)
+    ]
+
+    return InputProfile(
+        num_lines=len(lines),
+        num_chars=len(problem_input),
+        max_line_len=max((len(line) for line in lines), default=0),
+        num_sections=len(sections),
+        grid_rows=grid_rows,
+        grid_cols=grid_cols,
+        num_ints=len(ints),
+        max_abs_int=max(ints, default=None),
+        max_tokens_per_line=max((len(line.split()) for line in lines), default=0),
+    )
@@ -6,6 +6,7 @@ import asyncclick as click
 from asyncclick import Choice
 from bs4 import BeautifulSoup
 
+from agent import settings
 from agent.adventofcode._HEADERS import _HEADERS
 from agent.adventofcode.problem_part import ProblemPart
 import os
@@ -21,8 +22,9 @@ async def fetch_input(
             return f.read()
 
     # Otherwise, fetch the input from the Advent of Code servers.
-    url = f"https://adventofcode.com/{year}/day/{day}/input"
+    url = f"{settings.AOC_BASE_URL}/{year}/day/{day}/input"
     async with session.get(url, headers=_HEADERS) as response:
+        response.raise_for_status()  # Don't cache an error page as the input.
         input = await response.text()
         # Cache the input so we don't need to read it again later on.
         with open(input_file_path, "w") as f:
@@ -41,8 +43,9 @@ async def fetch_problem(
                 return f.read()
 
     # Otherwise, fetch the input from the Advent of Code servers.
-    url = f"https://adventofcode.com/{year}/day/{day}"
+    url = f"{settings.AOC_BASE_URL}/{year}/day/{day}"
     async with session.get(url, headers=_HEADERS) as response:
+        response.raise_for_status()  # Don't cache an error page as the problem.
         problem_html = await response.text()
         if solutions_dir:
             # Cache the input so we don't need to read it again later on.
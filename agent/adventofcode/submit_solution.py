@@ -4,6 +4,7 @@ import asyncclick as click
 import aiohttp
 import os
 
+from agent import settings
 from agent.adventofcode.problem_part import ProblemPart
 from agent.adventofcode._HEADERS import _HEADERS
 
@@ -28,7 +29,7 @@ async def submit(
                 click.echo("Wrong answer 😢")
                 return False
 
-    url = f"https://adventofcode.com/{year}/day/{day}/answer"
+    url = f"{settings.AOC_BASE_URL}/{year}/day/{day}/answer"
 
     data = {"level": str(part), "answer": answer}
 
@@ -5,3 +5,4 @@ ANTHROPIC_PROVIDER_NAME = "Anthropic"
 
 class AnthropicModel(StrEnum):
     CLAUDE_SONNET_3_5_OCT_2024 = "claude-3-5-sonnet-20241022"
+    CLAUDE_HAIKU_3_5_OCT_2024 = "claude-3-5-haiku-20241022"
@@ -1,16 +1,69 @@
+import dataclasses
+import functools
+import json
+from datetime import datetime
+from typing import Any, Callable
+
 import anthropic
+from anthropic.types.beta.prompt_caching import (
+    PromptCachingBetaCacheControlEphemeralParam,
+    PromptCachingBetaMessageParam,
+    PromptCachingBetaTextBlockParam,
+    PromptCachingBetaToolParam,
+)
 from pydantic import BaseModel
 from result import Err, Ok, Result
 
 from agent import settings
 from agent.llm.anthropic.models import ANTHROPIC_PROVIDER_NAME, AnthropicModel
-from agent.llm.usage.LLMUsage import LLMError, LLMUsage, Model, log_llm_usage
+from agent.llm.cascade import cascade_llm_requests
+from agent.llm.estimate_tokens import estimate_tokens
+from agent.llm.hedge import hedge_llm_requests
+from agent.llm.incremental_json import IncrementalJSONError, IncrementalJSONParser
+from agent.llm.rate_limit import get_llm_error_from_exception, rate_limit_llm_requests
+from agent.llm.router import route_llm_requests
+from agent.llm.usage.LLMResponseCache import cache_llm_response
+from agent.llm.usage.LLMUsage import (
+    LLMError,
+    LLMUsage,
+    Model,
+    enforce_llm_budget,
+    log_llm_usage,
+)
+
+
+_CLIENT = anthropic.AsyncAnthropic(
+    api_key=settings.ANTHROPIC_API_KEY,
+    base_url=settings.FAKE_LLM_SERVER_URL,
+    # Retries are left to @rate_limit_llm_requests so that they respect the shared rate limits.
+    max_retries=0,
+)
 
+# Prompt caching is cumulative over tools -> system -> messages, so each breakpoint caches
+# everything before it. Anthropic silently skips caching prefixes shorter than the model's minimum
+# cacheable length.
+_EPHEMERAL_CACHE_CONTROL = PromptCachingBetaCacheControlEphemeralParam(type="ephemeral")
 
-_CLIENT = anthropic.AsyncAnthropic(api_key=settings.ANTHROPIC_API_KEY)
+_JSON_RESPONSE_TYPE_TOOL_NAME = "json_response_type_tool"
 
+# Most responses fit comfortably within this. The few that don't (e.g. whole regenerated files) get
+# retried or continued with up to the model's full output limit, see _is_output_truncated(...).
+_DEFAULT_MAX_TOKENS = 2000
+_MAX_OUTPUT_TOKENS = {
+    AnthropicModel.CLAUDE_SONNET_3_5_OCT_2024: 8192,
+    AnthropicModel.CLAUDE_HAIKU_3_5_OCT_2024: 8192,
+}
+# Each continuation already gets the full output limit, so anything longer is surely a runaway.
+_MAX_TEXT_CONTINUATIONS = 3
 
+
+@route_llm_requests
+@cascade_llm_requests
+@hedge_llm_requests
 @log_llm_usage(provider=ANTHROPIC_PROVIDER_NAME, model=Model.DYNAMIC_MODEL_CHOICE)
+@cache_llm_response(provider=ANTHROPIC_PROVIDER_NAME)
+@enforce_llm_budget
+@rate_limit_llm_requests
 async def prompt[ResponseType: BaseModel](
     *,
     model: AnthropicModel,
@@ -18,44 +71,89 @@ async def prompt[ResponseType: BaseModel](
     system_prompt: str,
     prompt: str | list[anthropic.types.MessageParam],
     response_type: type[ResponseType],
+    extra_validation_fn: Callable[[ResponseType], Result[None, str]] | None = None,
+    # A stable leading part of `prompt` (e.g. the problem statement) to cache on top of the system
+    # prompt and the response schema, which are always cached.
+    cacheable_prompt_prefix: str | None = None,
+    # Stream the response, aborting as soon as it's certain to fail validation rather than paying
+    # for the whole generation. The partial validation fn gets the partially parsed JSON response.
+    stream: bool = False,
+    partial_validation_fn: Callable[[Any], Result[None, str]] | None = None,
+    # Cheaper models to try first, escalating to `model` only if they fail. Handled entirely by
+    # @cascade_llm_requests, see agent/llm/cascade.py.
+    cascade_models: list[AnthropicModel] | None = None,
 ) -> LLMUsage[ResponseType]:
-    JSON_RESPONSE_TYPE_TOOL_NAME = "json_response_type_tool"
-    try:
-        raw_response = await _CLIENT.messages.create(
-            model=model.value,
-            max_tokens=2000,
-            system=system_prompt,
-            tools=[
-                anthropic.types.ToolParam(
-                    name=JSON_RESPONSE_TYPE_TOOL_NAME,
-                    description=response_type.model_json_schema().get(
-                        "description",
-                        "The json response format that your response MUST follow.",
+    async def _prompt_with_max_tokens(max_tokens: int) -> LLMUsage[ResponseType]:
+        if stream:
+            return await _stream_prompt(
+                model=model,
+                system_prompt=system_prompt,
+                prompt=prompt,
+                response_type=response_type,
+                cacheable_prompt_prefix=cacheable_prompt_prefix,
+                partial_validation_fn=partial_validation_fn,
+                max_tokens=max_tokens,
+            )
+        return await _prompt(
+            model=model,
+            system_prompt=system_prompt,
+            prompt=prompt,
+            response_type=response_type,
+            cacheable_prompt_prefix=cacheable_prompt_prefix,
+            max_tokens=max_tokens,
+        )
+
+    response = await _prompt_with_max_tokens(_DEFAULT_MAX_TOKENS)
+    # A tool call can't be continued from where it was cut off, so just redo it with enough room.
+    if _is_output_truncated(response) and _MAX_OUTPUT_TOKENS[model] > _DEFAULT_MAX_TOKENS:
+        print(f"Retrying truncated response with max_tokens={_MAX_OUTPUT_TOKENS[model]}.")
+        response = response.add_followup(await _prompt_with_max_tokens(_MAX_OUTPUT_TOKENS[model]))
+
+    # Validate the response.
+    if extra_validation_fn and isinstance(response.response, Ok):
+        match extra_validation_fn(response.response.ok_value):
+            case Err(err_msg):
+                response = dataclasses.replace(
+                    response,
+                    response=Err(
+                        LLMError(
+                            err_type=LLMError.ErrType.LOGICAL_VALIDATION_FAILED, msg=str(err_msg)
+                        )
                     ),
-                    input_schema=response_type.model_json_schema(),
                 )
-            ],
-            tool_choice={"type": "tool", "name": JSON_RESPONSE_TYPE_TOOL_NAME},
-            messages=[
-                anthropic.types.MessageParam(
-                    role="user",
-                    content=[anthropic.types.TextBlockParam(type="text", text=prompt)],
-                )
-            ]
-            if isinstance(prompt, str)
-            else prompt,
+    return response
+
+
+async def _prompt[ResponseType: BaseModel](
+    model: AnthropicModel,
+    system_prompt: str,
+    prompt: str | list[anthropic.types.MessageParam],
+    response_type: type[ResponseType],
+    cacheable_prompt_prefix: str | None,
+    max_tokens: int,
+) -> LLMUsage[ResponseType]:
+    try:
+        raw_response = await _CLIENT.beta.prompt_caching.messages.create(
+            model=model.value,
+            max_tokens=max_tokens,
+            system=_get_cacheable_system_prompt(system_prompt),
+            tools=[_get_response_type_tool(response_type)],
+            tool_choice={"type": "tool", "name": _JSON_RESPONSE_TYPE_TOOL_NAME},
+            messages=_get_messages(prompt, cacheable_prompt_prefix),
         )
     except Exception as e:
         return LLMUsage(
             input_tokens=0,
             output_tokens=0,
-            response=Err(LLMError(err_type=LLMError.ErrType.NO_RESPONSE, msg=str(e))),
+            response=Err(get_llm_error_from_exception(LLMError.ErrType.NO_RESPONSE, e)),
         )
 
     response: Result[ResponseType, LLMError]
     input_tokens = raw_response.usage.input_tokens
     output_tokens = raw_response.usage.output_tokens
-    if isinstance(raw_response.content[0], anthropic.types.ToolUseBlock):
+    if raw_response.stop_reason == "max_tokens":
+        response = Err(_get_output_truncated_error(max_tokens, truncated_output=None))
+    elif isinstance(raw_response.content[0], anthropic.types.ToolUseBlock):
         try:
             response = Ok(response_type.model_validate(raw_response.content[0].input))
         except Exception as e:
@@ -70,42 +168,187 @@ async def prompt[ResponseType: BaseModel](
             )
         )
 
-    return LLMUsage(input_tokens=input_tokens, output_tokens=output_tokens, response=response)
+    return LLMUsage(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        response=response,
+        cache_read_input_tokens=raw_response.usage.cache_read_input_tokens or 0,
+        cache_write_input_tokens=raw_response.usage.cache_creation_input_tokens or 0,
+    )
+
+
+async def _stream_prompt[ResponseType: BaseModel](
+    model: AnthropicModel,
+    system_prompt: str,
+    prompt: str | list[anthropic.types.MessageParam],
+    response_type: type[ResponseType],
+    cacheable_prompt_prefix: str | None,
+    partial_validation_fn: Callable[[Any], Result[None, str]] | None,
+    max_tokens: int,
+) -> LLMUsage[ResponseType]:
+    response_type_tool = _get_response_type_tool(response_type)
+    parser = IncrementalJSONParser(response_type_tool["input_schema"])
+    tool_input_json = ""
+    first_token_timestamp: datetime | None = None
+    usage: dict[str, int] = {}
+    stop_reason: str | None = None
+
+    def _get_usage(response: Result[ResponseType, LLMError]) -> LLMUsage[ResponseType]:
+        return LLMUsage(
+            input_tokens=usage.get("input_tokens", 0),
+            # The output token count only comes at the very end, so estimate it if aborted early.
+            output_tokens=usage.get("output_tokens", estimate_tokens(tool_input_json)),
+            response=response,
+            cache_read_input_tokens=usage.get("cache_read_input_tokens", 0),
+            cache_write_input_tokens=usage.get("cache_creation_input_tokens", 0),
+            first_token_timestamp=first_token_timestamp,
+        )
+
+    def _get_err(err_type: LLMError.ErrType, msg: str) -> LLMUsage[ResponseType]:
+        return _get_usage(Err(LLMError(err_type=err_type, msg=msg)))
 
+    try:
+        stream = await _CLIENT.beta.prompt_caching.messages.create(
+            model=model.value,
+            max_tokens=max_tokens,
+            system=_get_cacheable_system_prompt(system_prompt),
+            tools=[response_type_tool],
+            tool_choice={"type": "tool", "name": _JSON_RESPONSE_TYPE_TOOL_NAME},
+            messages=_get_messages(prompt, cacheable_prompt_prefix),
+            stream=True,
+        )
+    except Exception as e:
+        return _get_usage(Err(get_llm_error_from_exception(LLMError.ErrType.NO_RESPONSE, e)))
 
+    try:
+        async for event in stream:
+            match event.type:
+                case "message_start":
+                    # The output token count here is just a placeholder until the message_delta.
+                    usage.update(
+                        {
+                            k: v or 0
+                            for k, v in event.message.usage.model_dump().items()
+                            if k != "output_tokens"
+                        }
+                    )
+                case "message_delta":
+                    usage["output_tokens"] = event.usage.output_tokens
+                    stop_reason = event.delta.stop_reason
+                case "content_block_delta" if event.delta.type == "input_json_delta":
+                    first_token_timestamp = first_token_timestamp or datetime.now()
+                    tool_input_json += event.delta.partial_json
+                    parser.feed(event.delta.partial_json)
+                    if partial_validation_fn:
+                        match partial_validation_fn(parser.snapshot()):
+                            case Err(err_msg):
+                                await stream.close()  # Stop paying for the rest of the generation.
+                                return _get_err(
+                                    LLMError.ErrType.LOGICAL_VALIDATION_FAILED,
+                                    f"Aborted streaming: {err_msg}",
+                                )
+                case "content_block_delta":
+                    await stream.close()
+                    return _get_err(
+                        LLMError.ErrType.UNEXPECTED_RESPONSE, f"Unexpected response: {event}"
+                    )
+    except IncrementalJSONError as e:
+        await stream.close()
+        return _get_err(
+            LLMError.ErrType.RESPONSE_SCHEMA_VALIDATION_FAILED, f"Aborted streaming: {e}"
+        )
+    except Exception as e:
+        return _get_usage(
+            Err(
+                get_llm_error_from_exception(
+                    (
+                        LLMError.ErrType.UNEXPECTED_RESPONSE
+                        if first_token_timestamp
+                        else LLMError.ErrType.NO_RESPONSE
+                    ),
+                    e,
+                )
+            )
+        )
+
+    if stop_reason == "max_tokens":
+        return _get_usage(Err(_get_output_truncated_error(max_tokens, truncated_output=None)))
+    try:
+        return _get_usage(Ok(response_type.model_validate(json.loads(tool_input_json))))
+    except Exception as e:
+        return _get_err(LLMError.ErrType.RESPONSE_SCHEMA_VALIDATION_FAILED, str(e))
+
+
+@route_llm_requests
+@hedge_llm_requests
 @log_llm_usage(provider=ANTHROPIC_PROVIDER_NAME, model=Model.DYNAMIC_MODEL_CHOICE)
+@cache_llm_response(provider=ANTHROPIC_PROVIDER_NAME)
+@enforce_llm_budget
+@rate_limit_llm_requests
 async def text_prompt(
     *,
     model: AnthropicModel,
     subtask_name: str,
     system_prompt: str,
     prompt: str | list[anthropic.types.MessageParam],
+    cacheable_prompt_prefix: str | None = None,
+) -> LLMUsage[str]:
+    messages = _get_messages(prompt, cacheable_prompt_prefix)
+    response = await _text_prompt(
+        model=model, system_prompt=system_prompt, messages=messages, max_tokens=_DEFAULT_MAX_TOKENS
+    )
+    continuations = 0
+    while _is_output_truncated(response) and continuations < _MAX_TEXT_CONTINUATIONS:
+        continuations += 1
+        # Prefill the response so far so that the model picks up right where it left off. Anthropic
+        # rejects prefills ending in whitespace, but the model just regenerates it anyway.
+        truncated_output = (response.response.unwrap_err().truncated_output or "").rstrip()
+        print(f"Continuing truncated response ({continuations}/{_MAX_TEXT_CONTINUATIONS}).")
+        continuation = await _text_prompt(
+            model=model,
+            system_prompt=system_prompt,
+            messages=[
+                *messages,
+                PromptCachingBetaMessageParam(role="assistant", content=truncated_output),
+            ],
+            max_tokens=_MAX_OUTPUT_TOKENS[model],
+        )
+        response = response.add_followup(_prepend_truncated_output(truncated_output, continuation))
+    return response
+
+
+async def _text_prompt(
+    model: AnthropicModel,
+    system_prompt: str,
+    messages: list[PromptCachingBetaMessageParam],
+    max_tokens: int,
 ) -> LLMUsage[str]:
     try:
-        raw_response = await _CLIENT.messages.create(
+        raw_response = await _CLIENT.beta.prompt_caching.messages.create(
             model=model.value,
-            max_tokens=2000,
-            system=system_prompt,
-            messages=[
-                anthropic.types.MessageParam(
-                    role="user", content=[anthropic.types.TextBlockParam(type="text", text=prompt)]
-                )
-            ]
-            if isinstance(prompt, str)
-            else prompt,
+            max_tokens=max_tokens,
+            system=_get_cacheable_system_prompt(system_prompt),
+            messages=messages,
         )
     except Exception as e:
         return LLMUsage(
             input_tokens=0,
             output_tokens=0,
-            response=Err(LLMError(err_type=LLMError.ErrType.NO_RESPONSE, msg=str(e))),
+            response=Err(get_llm_error_from_exception(LLMError.ErrType.NO_RESPONSE, e)),
         )
 
     response: Result[str, LLMError]
     input_tokens = raw_response.usage.input_tokens
     output_tokens = raw_response.usage.output_tokens
     if isinstance(raw_response.content[0], anthropic.types.TextBlock):
-        response = Ok(raw_response.content[0].text)
+        if raw_response.stop_reason == "max_tokens":
+            response = Err(
+                _get_output_truncated_error(
+                    max_tokens, truncated_output=raw_response.content[0].text
+                )
+            )
+        else:
+            response = Ok(raw_response.content[0].text)
     else:
         response = Err(
             LLMError(
@@ -114,4 +357,86 @@ async def text_prompt(
             )
         )
 
-    return LLMUsage(input_tokens=input_tokens, output_tokens=output_tokens, response=response)
+    return LLMUsage(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        response=response,
+        cache_read_input_tokens=raw_response.usage.cache_read_input_tokens or 0,
+        cache_write_input_tokens=raw_response.usage.cache_creation_input_tokens or 0,
+    )
+
+
+def _get_output_truncated_error(max_tokens: int, truncated_output: str | None) -> LLMError:
+    return LLMError(
+        err_type=LLMError.ErrType.OUTPUT_TRUNCATED,
+        msg=f"Response was cut off at max_tokens={max_tokens}.",
+        truncated_output=truncated_output,
+    )
+
+
+def _is_output_truncated(response: LLMUsage[Any]) -> bool:
+    return (
+        isinstance(response.response, Err)
+        and response.response.err_value.err_type == LLMError.ErrType.OUTPUT_TRUNCATED
+    )
+
+
+def _prepend_truncated_output(truncated_output: str, continuation: LLMUsage[str]) -> LLMUsage[str]:
+    match continuation.response:
+        case Ok(text):
+            return continuation.map(lambda _: truncated_output + text)
+        case Err(err) if err.truncated_output is not None:
+            return dataclasses.replace(
+                continuation,
+                response=Err(
+                    err.model_copy(
+                        update={"truncated_output": truncated_output + err.truncated_output}
+                    )
+                ),
+            )
+    return continuation
+
+
+@functools.cache
+def _get_response_type_tool(response_type: type[BaseModel]) -> PromptCachingBetaToolParam:
+    # Generating the JSON schema isn't free, and it never changes for a given response type.
+    response_type_json_schema = response_type.model_json_schema()
+    return PromptCachingBetaToolParam(
+        name=_JSON_RESPONSE_TYPE_TOOL_NAME,
+        description=response_type_json_schema.get(
+            "description",
+            "The json response format that your response MUST follow.",
+        ),
+        input_schema=response_type_json_schema,
+        cache_control=_EPHEMERAL_CACHE_CONTROL,
+    )
+
+
+def _get_cacheable_system_prompt(system_prompt: str) -> list[PromptCachingBetaTextBlockParam]:
+    return [
+        PromptCachingBetaTextBlockParam(
+            type="text", text=system_prompt, cache_control=_EPHEMERAL_CACHE_CONTROL
+        )
+    ]
+
+
+def _get_messages(
+    prompt: str | list[anthropic.types.MessageParam], cacheable_prompt_prefix: str | None
+) -> list[PromptCachingBetaMessageParam]:
+    if not isinstance(prompt, str):
+        assert cacheable_prompt_prefix is None, "Only str prompts support a cacheable prefix."
+        return prompt  # type: ignore
+
+    content: list[PromptCachingBetaTextBlockParam]
+    if cacheable_prompt_prefix:
+        assert prompt.startswith(cacheable_prompt_prefix), "Prefix must be the start of the prompt."
+        content = [
+            PromptCachingBetaTextBlockParam(
+                type="text", text=cacheable_prompt_prefix, cache_control=_EPHEMERAL_CACHE_CONTROL
+            )
+        ]
+        if rest := prompt.removeprefix(cacheable_prompt_prefix):
+            content.append(PromptCachingBetaTextBlockParam(type="text", text=rest))
+    else:
+        content = [PromptCachingBetaTextBlockParam(type="text", text=prompt)]
+    return [PromptCachingBetaMessageParam(role="user", content=content)]
@@ -0,0 +1,72 @@
+import asyncio
+import timeit
+from typing import Callable
+
+import asyncclick as click
+import google.generativeai as genai
+from google.generativeai.types.generation_types import to_generation_config_dict
+from pydantic import BaseModel
+
+from agent.adventofcode.generate_code.CodeEdits import CodeEdits
+from agent.adventofcode.generate_code.GeneratedImplementation import GeneratedImplementation
+from agent.adventofcode.generate_code.GeneratedUnitTests import GeneratedUnitTests
+from agent.llm.anthropic import prompt as anthropic_prompt
+from agent.llm.gemini import prompt as gemini_prompt
+from agent.llm.gemini.models import GeminiModel
+
+_SYSTEM_PROMPT = "You are an expert Python programmer. " * 50
+
+
+def _uncached_gemini_request_setup(response_type: type[BaseModel]) -> None:
+    # This is what every Gemini call used to do before sending the request.
+    genai.GenerativeModel(
+        GeminiModel.GEMINI_1_5_PRO,
+        safety_settings=gemini_prompt.SAFETY_SETTINGS,
+        system_instruction=_SYSTEM_PROMPT,
+    )
+    to_generation_config_dict(
+        genai.GenerationConfig(response_mime_type="application/json", response_schema=response_type)
+    )
+
+
+def _cached_gemini_request_setup(response_type: type[BaseModel]) -> None:
+    gemini_prompt._get_generative_model(GeminiModel.GEMINI_1_5_PRO, _SYSTEM_PROMPT)
+    gemini_prompt._get_json_generation_config(response_type)
+
+
+def _uncached_anthropic_request_setup(response_type: type[BaseModel]) -> None:
+    # This is what every Anthropic call used to do before sending the request.
+    response_type.model_json_schema().get("description", "")
+    response_type.model_json_schema()
+
+
+def _cached_anthropic_request_setup(response_type: type[BaseModel]) -> None:
+    anthropic_prompt._get_response_type_tool(response_type)
+
+
+def _time_per_call_us(fn: Callable[[type[BaseModel]], None], iterations: int) -> float:
+    response_types = [GeneratedImplementation, GeneratedUnitTests, CodeEdits]
+    total_seconds = timeit.timeit(
+        lambda: [fn(response_type) for response_type in response_types], number=iterations
+    )
+    return total_seconds / (iterations * len(response_types)) * 1e6
+
+
+@click.command()
+@click.option("--iterations", type=int, default=1000, show_default=True)
+async def _cmd(iterations: int) -> None:
+    """Measure the client-side overhead each LLM call pays before any request is sent."""
+    for provider, uncached, cached in [
+        ("Gemini", _uncached_gemini_request_setup, _cached_gemini_request_setup),
+        ("Anthropic", _uncached_anthropic_request_setup, _cached_anthropic_request_setup),
+    ]:
+        uncached_us = _time_per_call_us(uncached, iterations)
+        cached_us = _time_per_call_us(cached, iterations)
+        print(
+            f"{provider}: {uncached_us:.1f}us -> {cached_us:.1f}us per call "
+            f"({uncached_us / cached_us:.0f}x less overhead)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(_cmd())
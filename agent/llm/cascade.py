@@ -0,0 +1,53 @@
+from functools import wraps
+from typing import Awaitable, Callable, ParamSpec, TypeVar
+
+from result import Result
+
+from agent.llm.usage.LLMUsage import LLMError, llm_request_strategy
+
+# The calls to the cheaper models, and the call to the requested model once they've all failed.
+CASCADE_STRATEGY = "cascade"
+CASCADE_ESCALATED_STRATEGY = "cascade-escalated"
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def cascade_llm_requests(
+    func: Callable[P, Awaitable[Result[R, LLMError]]],
+) -> Callable[P, Awaitable[Result[R, LLMError]]]:
+    """Try the call's `cascade_models` first, in order, and only escalate to the requested model
+    once every one of them has failed. Since the schema and extra_validation_fn are checked within
+    the call itself, any response that comes back Ok is already known to be valid.
+
+    This must be applied *above* @hedge_llm_requests and @log_llm_usage(...) so that each step of
+    the cascade is hedged and logged on its own, tagged with strategy='cascade' or
+    'cascade-escalated'. It goes *under* @route_llm_requests, so the router picks the model to
+    escalate to.
+    """
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Result[R, LLMError]:
+        model = kwargs["model"]
+        cascade_models = [
+            cascade_model
+            for cascade_model in kwargs.pop("cascade_models", None) or ()  # type: ignore
+            if cascade_model != model
+        ]
+        if not cascade_models:
+            return await func(*args, **kwargs)
+
+        for cascade_model in cascade_models:
+            with llm_request_strategy(CASCADE_STRATEGY):
+                result = await func(*args, **{**kwargs, "model": cascade_model})
+            if result.is_ok():
+                return result
+            print(
+                f"Escalating {kwargs['subtask_name']} past {cascade_model}: "
+                f"{result.unwrap_err().msg}"
+            )
+
+        with llm_request_strategy(CASCADE_ESCALATED_STRATEGY):
+            return await func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,16 @@
+from typing import Any
+
+# A rough rule of thumb for English text across the providers' tokenizers. This is only used for
+# reporting and budgeting, so it's not worth the network round trip to count tokens exactly.
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def estimate_request_tokens(llm_request_kwargs: dict[str, Any]) -> int:
+    """Estimate the input tokens of a prompt(...)/text_prompt(...) call from its kwargs."""
+    return estimate_tokens(str(llm_request_kwargs.get("system_prompt", ""))) + estimate_tokens(
+        str(llm_request_kwargs.get("prompt", ""))
+    )
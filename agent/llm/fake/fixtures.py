@@ -0,0 +1,134 @@
+import json
+import random
+import re
+from pathlib import Path
+from typing import Any
+
+from pydantic import BaseModel
+
+from agent.llm.anthropic.models import ANTHROPIC_PROVIDER_NAME
+from agent.llm.gemini.models import GEMINI_PROVIDER_NAME
+
+_FAKE_TEXT = "This is a fake response from the fake LLM server."
+
+
+class FakeResponseFixture(BaseModel):
+    """A scripted response for the fake LLM server to reply with."""
+
+    # Either ANTHROPIC_PROVIDER_NAME or GEMINI_PROVIDER_NAME. Unset matches both.
+    provider: str | None = None
+    # Regex searched for in the request's system prompt and messages. Unset matches anything.
+    match: str | None = None
+    # The JSON response for structured requests, or the text for text requests.
+    response: dict[str, Any] | str
+
+
+class FakeResponses:
+    """Picks the response to each request: the first matching scripted fixture, otherwise a random
+    recorded response that fits the request, otherwise a response made up from the schema."""
+
+    def __init__(
+        self,
+        fixtures: list[FakeResponseFixture],
+        recordings: list[FakeResponseFixture],
+    ) -> None:
+        self._fixtures = fixtures
+        self._recordings = recordings
+
+    def get_response(
+        self, provider: str, request_text: str, response_json_schema: dict[str, Any] | None
+    ) -> dict[str, Any] | str:
+        for fixture in self._fixtures:
+            if (
+                fixture.provider in (None, provider)
+                and (fixture.match is None or re.search(fixture.match, request_text))
+                and _is_compatible(fixture.response, response_json_schema)
+            ):
+                return fixture.response
+
+        recordings = [
+            recording.response
+            for recording in self._recordings
+            if recording.provider in (None, provider)
+            and _is_compatible(recording.response, response_json_schema)
+        ]
+        if recordings:
+            return random.choice(recordings)
+
+        if response_json_schema is None:
+            return _FAKE_TEXT
+        return get_fake_value_for_schema(
+            response_json_schema, response_json_schema.get("$defs", {})
+        )
+
+
+def load_fixtures(fixtures_file: Path) -> list[FakeResponseFixture]:
+    return [FakeResponseFixture.model_validate(f) for f in json.loads(fixtures_file.read_text())]
+
+
+def load_recordings(llm_response_cache_dir: Path) -> list[FakeResponseFixture]:
+    """Load the responses recorded by the LLM response cache (see LLMResponseCache.py). The cache
+    is keyed by a hash of the request, so these can only be matched up by their shape."""
+    recordings = []
+    for cache_file in llm_response_cache_dir.glob("*/*.json"):
+        try:
+            cached = json.loads(cache_file.read_text())
+        except (OSError, json.JSONDecodeError):
+            continue  # Probably concurrently evicted.
+        response = cached["response"]
+        try:
+            response = json.loads(response)
+        except json.JSONDecodeError:
+            pass  # Just a text response.
+        if isinstance(response, (dict, str)) and cached.get("provider") in (
+            ANTHROPIC_PROVIDER_NAME,
+            GEMINI_PROVIDER_NAME,
+        ):
+            recordings.append(FakeResponseFixture(provider=cached["provider"], response=response))
+    return recordings
+
+
+def _is_compatible(
+    response: dict[str, Any] | str, response_json_schema: dict[str, Any] | None
+) -> bool:
+    if response_json_schema is None:
+        return isinstance(response, str)
+    if not isinstance(response, dict):
+        return False
+    # Good enough to tell the different response types apart, they won't be validated any further
+    # until they're back in prompt(...) anyways.
+    return (
+        set(response_json_schema.get("required", []))
+        <= set(response)
+        <= set(response_json_schema.get("properties", {}))
+    )
+
+
+def get_fake_value_for_schema(schema: dict[str, Any], defs: dict[str, Any]) -> Any:
+    """Make up the simplest value that satisfies the schema. This handles both pydantic's JSON
+    schemas and Gemini's response schemas (with their uppercase types)."""
+    if ref := schema.get("$ref"):
+        return get_fake_value_for_schema(defs[ref.rsplit("/", 1)[-1]], defs)
+    if any_of := schema.get("anyOf"):
+        return get_fake_value_for_schema(any_of[0], defs)
+    if enum := schema.get("enum"):
+        return enum[0]
+    match str(schema.get("type", "object")).lower():
+        case "object":
+            properties = schema.get("properties", {})
+            return {
+                name: get_fake_value_for_schema(properties[name], defs)
+                for name in schema.get("required", properties)
+            }
+        case "array":
+            # Empty arrays tend to get rejected by the logical validation, e.g. there must be at
+            # least one example extracted.
+            return [get_fake_value_for_schema(schema.get("items", {}), defs)]
+        case "string":
+            return "fake"
+        case "integer" | "number":
+            return 0
+        case "boolean":
+            return False
+        case _:
+            return None
@@ -0,0 +1,386 @@
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable
+
+import asyncclick as click
+from aiohttp import web
+
+from agent.llm.anthropic.models import ANTHROPIC_PROVIDER_NAME
+from agent.llm.estimate_tokens import estimate_tokens
+from agent.llm.fake.fixtures import FakeResponses, load_fixtures, load_recordings
+from agent.llm.gemini.models import GEMINI_PROVIDER_NAME
+
+# A valid 1x1 PNG, the agent never actually looks at the images.
+_FAKE_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+# Roughly how much output each streamed chunk carries.
+_STREAM_CHUNK_CHARS = 40
+
+
+@dataclass(frozen=True)
+class FakeLLMServerConfig:
+    # The latency to the first token is lognormally distributed around this median.
+    median_latency_seconds: float = 1.0
+    latency_sigma: float = 0.5
+    output_tokens_per_second: float = 100
+    # The fraction of requests that fail with a 5xx, or get rate limited with a 429.
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    rate_limit_retry_after_seconds: int = 1
+
+
+class _FakeLLMServer:
+    def __init__(self, config: FakeLLMServerConfig, responses: FakeResponses) -> None:
+        self._config = config
+        self._responses = responses
+
+    def get_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/messages", self._anthropic_messages)
+        app.router.add_post("/v1beta/models/{model}:generateContent", self._gemini_generate)
+        app.router.add_post("/v1beta/models/{model}:streamGenerateContent", self._gemini_generate)
+        app.router.add_post("/v1/images/generations", self._openai_images_generations)
+        app.router.add_get("/images/{image_id}", self._image)
+        return app
+
+    async def _anthropic_messages(self, request: web.Request) -> web.StreamResponse:
+        if (
+            error_response := self._get_error_response(
+                lambda error_type, msg: {
+                    "type": "error",
+                    "error": {"type": error_type, "message": msg},
+                },
+                overloaded_status=529,
+            )
+        ) is not None:
+            return error_response
+
+        body = await request.json()
+        tool = body["tools"][0] if body.get("tools") else None
+        response = self._responses.get_response(
+            ANTHROPIC_PROVIDER_NAME,
+            _get_anthropic_request_text(body),
+            tool["input_schema"] if tool else None,
+        )
+        output = json.dumps(response) if tool else str(response)
+        # Fake the truncation the same way the real API would, so that it can be tested too.
+        truncated = estimate_tokens(output) > body["max_tokens"]
+        if truncated:
+            output = output[: body["max_tokens"] * 4]
+        input_tokens = estimate_tokens(_get_anthropic_request_text(body))
+        output_tokens = estimate_tokens(output)
+        stop_reason = "max_tokens" if truncated else ("tool_use" if tool else "end_turn")
+        message = {
+            "id": f"msg_fake_{uuid.uuid4().hex}",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "cache_creation_input_tokens": 0,
+                "cache_read_input_tokens": 0,
+            },
+        }
+        content_block: dict[str, Any] = (
+            {
+                "type": "tool_use",
+                "id": f"toolu_fake_{uuid.uuid4().hex}",
+                "name": tool["name"],
+                "input": {},
+            }
+            if tool
+            else {"type": "text", "text": ""}
+        )
+
+        if not body.get("stream"):
+            await asyncio.sleep(self._get_latency_seconds(output_tokens))
+            if tool:
+                content_block["input"] = {} if truncated else response
+            else:
+                content_block["text"] = output
+            return web.json_response(
+                {**message, "content": [content_block], "stop_reason": stop_reason}
+            )
+
+        async def _events() -> AsyncIterator[tuple[str, dict[str, Any]]]:
+            yield (
+                "message_start",
+                {
+                    "type": "message_start",
+                    "message": {
+                        **message,
+                        "content": [],
+                        "stop_reason": None,
+                        "usage": {**message["usage"], "output_tokens": 1},
+                    },
+                },
+            )
+            yield (
+                "content_block_start",
+                {"type": "content_block_start", "index": 0, "content_block": content_block},
+            )
+            for chunk in _chunk(output):
+                await self._sleep_for_output(chunk)
+                yield (
+                    "content_block_delta",
+                    {
+                        "type": "content_block_delta",
+                        "index": 0,
+                        "delta": (
+                            {"type": "input_json_delta", "partial_json": chunk}
+                            if tool
+                            else {"type": "text_delta", "text": chunk}
+                        ),
+                    },
+                )
+            yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+            yield (
+                "message_delta",
+                {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                    "usage": {"output_tokens": output_tokens},
+                },
+            )
+            yield "message_stop", {"type": "message_stop"}
+
+        return await self._stream_sse(
+            request,
+            (
+                f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+                async for event_type, data in _events()
+            ),
+        )
+
+    async def _gemini_generate(self, request: web.Request) -> web.StreamResponse:
+        if (
+            error_response := self._get_error_response(
+                lambda status, msg: {"error": {"status": status, "message": msg}},
+                overloaded_status=503,
+                overloaded_error_type="UNAVAILABLE",
+                rate_limit_error_type="RESOURCE_EXHAUSTED",
+            )
+        ) is not None:
+            return error_response
+
+        body = await request.json()
+        generation_config = body.get("generationConfig", {})
+        response_json_schema = generation_config.get("responseSchema")
+        response = self._responses.get_response(
+            GEMINI_PROVIDER_NAME, _get_gemini_request_text(body), response_json_schema
+        )
+        output = json.dumps(response) if response_json_schema else str(response)
+        input_tokens = estimate_tokens(_get_gemini_request_text(body))
+        output_tokens = estimate_tokens(output)
+
+        def _get_chunk(text: str, finished: bool) -> dict[str, Any]:
+            return {
+                "candidates": [
+                    {
+                        "content": {"parts": [{"text": text}], "role": "model"},
+                        "index": 0,
+                        **({"finishReason": "STOP"} if finished else {}),
+                    }
+                ],
+                "usageMetadata": {
+                    "promptTokenCount": input_tokens,
+                    "candidatesTokenCount": output_tokens if finished else 0,
+                    "totalTokenCount": input_tokens + (output_tokens if finished else 0),
+                },
+            }
+
+        if not request.path.endswith(":streamGenerateContent"):
+            await asyncio.sleep(self._get_latency_seconds(output_tokens))
+            return web.json_response(_get_chunk(output, finished=True))
+
+        async def _events() -> AsyncIterator[str]:
+            chunks = list(_chunk(output))
+            for i, chunk in enumerate(chunks):
+                await self._sleep_for_output(chunk)
+                yield f"data: {json.dumps(_get_chunk(chunk, finished=i == len(chunks) - 1))}\n\n"
+
+        return await self._stream_sse(request, _events())
+
+    async def _openai_images_generations(self, request: web.Request) -> web.StreamResponse:
+        if (
+            error_response := self._get_error_response(
+                lambda error_type, msg: {"error": {"type": error_type, "message": msg}},
+                overloaded_status=500,
+            )
+        ) is not None:
+            return error_response
+
+        body = await request.json()
+        await asyncio.sleep(self._get_latency_seconds(0))
+        return web.json_response(
+            {
+                "created": int(time.time()),
+                "data": [
+                    {
+                        "url": f"{request.url.origin()}/images/{uuid.uuid4().hex}.png",
+                        "revised_prompt": body["prompt"],
+                    }
+                ],
+            }
+        )
+
+    async def _image(self, request: web.Request) -> web.StreamResponse:
+        return web.Response(body=_FAKE_PNG, content_type="image/png")
+
+    def _get_error_response(
+        self,
+        get_error_body: Callable[[str, str], dict[str, Any]],
+        overloaded_status: int,
+        overloaded_error_type: str = "overloaded_error",
+        rate_limit_error_type: str = "rate_limit_error",
+    ) -> web.Response | None:
+        roll = random.random()
+        if roll < self._config.rate_limit_rate:
+            return web.json_response(
+                get_error_body(rate_limit_error_type, "Fake rate limit exceeded."),
+                status=429,
+                headers={"retry-after": str(self._config.rate_limit_retry_after_seconds)},
+            )
+        if roll < self._config.rate_limit_rate + self._config.error_rate:
+            return web.json_response(
+                get_error_body(overloaded_error_type, "Fake server error."),
+                status=overloaded_status,
+            )
+        return None
+
+    def _get_latency_seconds(self, output_tokens: int) -> float:
+        return self._get_time_to_first_token_seconds() + (
+            output_tokens / self._config.output_tokens_per_second
+        )
+
+    def _get_time_to_first_token_seconds(self) -> float:
+        return random.lognormvariate(
+            math.log(self._config.median_latency_seconds), self._config.latency_sigma
+        )
+
+    async def _sleep_for_output(self, output: str) -> None:
+        await asyncio.sleep(estimate_tokens(output) / self._config.output_tokens_per_second)
+
+    async def _stream_sse(
+        self, request: web.Request, events: AsyncIterator[str]
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self._get_time_to_first_token_seconds())
+        async for event in events:
+            await response.write(event.encode())
+        await response.write_eof()
+        return response
+
+
+def _chunk(output: str) -> list[str]:
+    return [
+        output[i : i + _STREAM_CHUNK_CHARS] for i in range(0, len(output), _STREAM_CHUNK_CHARS)
+    ] or [""]
+
+
+def _get_anthropic_request_text(body: dict[str, Any]) -> str:
+    return "\n".join(
+        _get_anthropic_content_text(content)
+        for content in [body.get("system", ""), *(m["content"] for m in body["messages"])]
+    )
+
+
+def _get_anthropic_content_text(content: str | list[dict[str, Any]]) -> str:
+    if isinstance(content, str):
+        return content
+    return "\n".join(block.get("text", "") for block in content)
+
+
+def _get_gemini_request_text(body: dict[str, Any]) -> str:
+    return "\n".join(
+        part.get("text", "")
+        for content in [body.get("systemInstruction", {"parts": []}), *body["contents"]]
+        for part in content["parts"]
+    )
+
+
+def get_fake_llm_server_app(
+    config: FakeLLMServerConfig,
+    fixtures_file: Path | None = None,
+    recordings_dir: Path | None = None,
+) -> web.Application:
+    return _FakeLLMServer(
+        config,
+        FakeResponses(
+            fixtures=load_fixtures(fixtures_file) if fixtures_file else [],
+            recordings=load_recordings(recordings_dir) if recordings_dir else [],
+        ),
+    ).get_app()
+
+
+async def serve_fake_llm_server(app: web.Application, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+@click.command()
+@click.option("--host", default="localhost")
+@click.option("--port", default=8089, type=int)
+@click.option(
+    "--fixtures",
+    type=click.Path(exists=True, path_type=Path),
+    help="JSON list of FakeResponseFixture to script the responses to matching requests.",
+)
+@click.option(
+    "--recordings-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Replay the responses recorded by the LLM response cache, e.g. .llm_response_cache",
+)
+@click.option("--median-latency-seconds", default=1.0, type=float)
+@click.option("--latency-sigma", default=0.5, type=float)
+@click.option("--output-tokens-per-second", default=100.0, type=float)
+@click.option("--error-rate", default=0.0, type=float)
+@click.option("--rate-limit-rate", default=0.0, type=float)
+async def _cmd(
+    host: str,
+    port: int,
+    fixtures: Path | None,
+    recordings_dir: Path | None,
+    median_latency_seconds: float,
+    latency_sigma: float,
+    output_tokens_per_second: float,
+    error_rate: float,
+    rate_limit_rate: float,
+) -> None:
+    """Serve fake Anthropic, Gemini and OpenAI APIs so that the agent can be run (and load tested)
+    without spending anything. Point the agent at it with FAKE_LLM_SERVER_URL=http://host:port."""
+    app = get_fake_llm_server_app(
+        FakeLLMServerConfig(
+            median_latency_seconds=median_latency_seconds,
+            latency_sigma=latency_sigma,
+            output_tokens_per_second=output_tokens_per_second,
+            error_rate=error_rate,
+            rate_limit_rate=rate_limit_rate,
+        ),
+        fixtures_file=fixtures,
+        recordings_dir=recordings_dir,
+    )
+    runner = await serve_fake_llm_server(app, host, port)
+    print(f"Serving the fake LLM server on http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(_cmd())
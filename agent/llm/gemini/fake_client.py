@@ -0,0 +1,105 @@
+import json
+from typing import Any, AsyncIterator
+
+import aiohttp
+from google.api_core import exceptions as google_exceptions
+from google.generativeai import protos
+from google.generativeai.types import ContentDict, GenerationConfigDict
+from google.generativeai.types.generation_types import AsyncGenerateContentResponse
+
+from agent.llm.gemini.models import GeminiModel
+
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel, sending the requests to the fake LLM server (see
+    agent/llm/fake/server.py) over Gemini's REST API shape instead of to the real gRPC API."""
+
+    def __init__(self, fake_llm_server_url: str, model: GeminiModel, system_prompt: str) -> None:
+        self._url = f"{fake_llm_server_url.rstrip('/')}/v1beta/models/{model}"
+        self._system_prompt = system_prompt
+
+    async def generate_content_async(
+        self,
+        contents: str | list[ContentDict],
+        generation_config: GenerationConfigDict | None = None,
+        stream: bool = False,
+    ) -> AsyncGenerateContentResponse:
+        body = {
+            "contents": _get_rest_contents(contents),
+            "systemInstruction": {"parts": [{"text": self._system_prompt}]},
+            "generationConfig": _get_rest_generation_config(generation_config or {}),
+        }
+        if stream:
+            return await AsyncGenerateContentResponse.from_aiterator(self._stream(body))
+
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self._url}:generateContent", json=body) as res:
+                await _raise_for_status(res)
+                return AsyncGenerateContentResponse.from_response(
+                    protos.GenerateContentResponse.from_json(
+                        await res.text(), ignore_unknown_fields=True
+                    )
+                )
+
+    async def _stream(self, body: dict[str, Any]) -> AsyncIterator[protos.GenerateContentResponse]:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                f"{self._url}:streamGenerateContent", params={"alt": "sse"}, json=body
+            ) as res:
+                await _raise_for_status(res)
+                async for line in res.content:
+                    if line.startswith(b"data: "):
+                        yield protos.GenerateContentResponse.from_json(
+                            line.removeprefix(b"data: ").decode(), ignore_unknown_fields=True
+                        )
+
+
+def _get_rest_contents(contents: str | list[ContentDict]) -> list[dict[str, Any]]:
+    if isinstance(contents, str):
+        return [{"role": "user", "parts": [{"text": contents}]}]
+    return [
+        {"role": content["role"], "parts": [{"text": part} for part in content["parts"]]}
+        for content in contents
+    ]
+
+
+def _get_rest_generation_config(generation_config: GenerationConfigDict) -> dict[str, Any]:
+    rest_generation_config: dict[str, Any] = {}
+    if response_mime_type := generation_config.get("response_mime_type"):
+        rest_generation_config["responseMimeType"] = response_mime_type
+    match generation_config.get("response_schema"):
+        case protos.Schema() as response_schema:
+            rest_generation_config["responseSchema"] = _get_rest_schema(response_schema)
+        case dict() as response_schema:
+            rest_generation_config["responseSchema"] = response_schema
+    return rest_generation_config
+
+
+def _get_rest_schema(schema: protos.Schema) -> dict[str, Any]:
+    # Schema.to_dict(...) would use the proto field names (e.g. `type_`) and include every empty
+    # field, whereas the REST API (and so the fake server) expects the JSON schema style keys.
+    rest_schema: dict[str, Any] = {"type": protos.Type(schema.type_).name}
+    if schema.format_:
+        rest_schema["format"] = schema.format_
+    if schema.nullable:
+        rest_schema["nullable"] = True
+    if schema.enum:
+        rest_schema["enum"] = list(schema.enum)
+    if "items" in schema:
+        rest_schema["items"] = _get_rest_schema(schema.items)
+    if schema.properties:
+        rest_schema["properties"] = {
+            name: _get_rest_schema(property_schema)
+            for name, property_schema in schema.properties.items()
+        }
+    if schema.required:
+        rest_schema["required"] = list(schema.required)
+    return rest_schema
+
+
+async def _raise_for_status(res: aiohttp.ClientResponse) -> None:
+    if res.status >= 400:
+        # Raise the same errors as the real client so that the retries see no difference.
+        raise google_exceptions.from_http_status(
+            res.status, json.loads(await res.text())["error"]["message"], response=res
+        )
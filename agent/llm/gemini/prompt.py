@@ -1,14 +1,32 @@
+import dataclasses
+import functools
 import json
 from dataclasses import dataclass
+from datetime import datetime
 from typing import Any, Callable, Literal, Protocol
 
 import google.generativeai as genai
-from google.generativeai.types import ContentDict, HarmBlockThreshold, HarmCategory
+from google.generativeai.types import (
+    ContentDict,
+    GenerationConfigDict,
+    HarmBlockThreshold,
+    HarmCategory,
+)
+from google.generativeai.types.generation_types import to_generation_config_dict
 from pydantic import BaseModel
 from result import Err, Ok, Result
 
+from agent import settings
+from agent.llm.cascade import cascade_llm_requests
+from agent.llm.estimate_tokens import estimate_tokens
+from agent.llm.gemini.fake_client import FakeGenerativeModel
 from agent.llm.gemini.models import GeminiModel, GEMINI_PROVIDER_NAME
-from agent.llm.usage.LLMUsage import LLMError, log_llm_usage, Model, LLMUsage
+from agent.llm.hedge import hedge_llm_requests
+from agent.llm.incremental_json import IncrementalJSONError, IncrementalJSONParser
+from agent.llm.rate_limit import get_llm_error_from_exception, rate_limit_llm_requests
+from agent.llm.router import route_llm_requests
+from agent.llm.usage.LLMResponseCache import cache_llm_response
+from agent.llm.usage.LLMUsage import LLMError, enforce_llm_budget, log_llm_usage, Model, LLMUsage
 
 # Avoid being so dang conservative. Answer the questions!
 SAFETY_SETTINGS = {
@@ -18,6 +36,14 @@ SAFETY_SETTINGS = {
     HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
 }
 
+# The Gemini models already default to their full output limit, so unlike with Anthropic, there's no
+# bigger budget to retry a truncated response with. Text responses can still be continued though.
+_MAX_TOKENS_FINISH_REASON = genai.protos.Candidate.FinishReason.MAX_TOKENS
+_MAX_TEXT_CONTINUATIONS = 3
+_CONTINUE_TRUNCATED_OUTPUT_PROMPT = (
+    "You ran out of space. Continue EXACTLY where you left off, without repeating anything."
+)
+
 
 class ToContentDict(Protocol):
     def to_content_dict(self) -> ContentDict: ...
@@ -55,7 +81,13 @@ def _get_content_dict(msg: str, role: Literal["user", "model"]) -> ContentDict:
     }
 
 
+@route_llm_requests
+@cascade_llm_requests
+@hedge_llm_requests
 @log_llm_usage(provider=GEMINI_PROVIDER_NAME, model=Model.DYNAMIC_MODEL_CHOICE)
+@cache_llm_response(provider=GEMINI_PROVIDER_NAME)
+@enforce_llm_budget
+@rate_limit_llm_requests
 async def prompt[ResponseType: BaseModel](
     *,  # Require all args to be passed as kwargs.
     model: GeminiModel,
@@ -64,27 +96,41 @@ async def prompt[ResponseType: BaseModel](
     prompt: str | list[UserMessage | ModelMessage],
     response_type: type[ResponseType],
     extra_validation_fn: Callable[[ResponseType], Result[None, str]] | None = None,
+    # Stream the response, aborting as soon as it's certain to fail validation rather than paying
+    # for the whole generation. The partial validation fn gets the partially parsed JSON response.
+    stream: bool = False,
+    partial_validation_fn: Callable[[Any], Result[None, str]] | None = None,
+    # Cheaper models to try first, escalating to `model` only if they fail. Handled entirely by
+    # @cascade_llm_requests, see agent/llm/cascade.py.
+    cascade_models: list[GeminiModel] | None = None,
 ) -> LLMUsage[ResponseType]:
-    response = await _prompt(
-        model=model,
-        system_prompt=system_prompt,
-        prompt=prompt,
-        generation_config=genai.GenerationConfig(
-            response_mime_type="application/json",
-            response_schema=response_type,
-        ),
-    )
+    if stream:
+        response = await _stream_prompt(
+            model=model,
+            system_prompt=system_prompt,
+            prompt=prompt,
+            generation_config=_get_json_generation_config(response_type),
+            response_json_schema=_get_response_json_schema(response_type),
+            partial_validation_fn=partial_validation_fn,
+        )
+    else:
+        response = await _prompt(
+            model=model,
+            system_prompt=system_prompt,
+            prompt=prompt,
+            generation_config=_get_json_generation_config(response_type),
+        )
 
     try:
         # Try to parse the response.
         response = response.map(response_type.model_validate_json)
         # Validate the response.
-        if extra_validation_fn:
-            match extra_validation_fn(response.response.unwrap()):
+        # Don't let a failed request (e.g. a truncated response) get reported as a schema failure.
+        if extra_validation_fn and isinstance(response.response, Ok):
+            match extra_validation_fn(response.response.ok_value):
                 case Err(err_msg):
-                    response = LLMUsage(
-                        input_tokens=response.input_tokens,
-                        output_tokens=response.output_tokens,
+                    response = dataclasses.replace(
+                        response,
                         response=Err(
                             LLMError(
                                 err_type=LLMError.ErrType.LOGICAL_VALIDATION_FAILED,
@@ -94,16 +140,20 @@ async def prompt[ResponseType: BaseModel](
                     )
         return response
     except Exception as e:
-        return LLMUsage(
-            input_tokens=response.input_tokens,
-            output_tokens=response.output_tokens,
+        return dataclasses.replace(
+            response,
             response=Err(
                 LLMError(err_type=LLMError.ErrType.RESPONSE_SCHEMA_VALIDATION_FAILED, msg=str(e))
             ),
         )
 
 
+@route_llm_requests
+@hedge_llm_requests
 @log_llm_usage(provider=GEMINI_PROVIDER_NAME, model=Model.DYNAMIC_MODEL_CHOICE)
+@cache_llm_response(provider=GEMINI_PROVIDER_NAME)
+@enforce_llm_budget
+@rate_limit_llm_requests
 async def text_prompt(
     *,  # Require all args to be passed as kwargs.
     model: GeminiModel,
@@ -111,33 +161,62 @@ async def text_prompt(
     system_prompt: str,
     prompt: str | list[UserMessage | TextModelMessage],
 ) -> LLMUsage[str]:
-    return await _prompt(
+    response = await _prompt(
         model=model, system_prompt=system_prompt, prompt=prompt, generation_config=None
     )
+    output_so_far = ""
+    continuations = 0
+    while (
+        isinstance(response.response, Err)
+        and response.response.err_value.err_type == LLMError.ErrType.OUTPUT_TRUNCATED
+        and continuations < _MAX_TEXT_CONTINUATIONS
+    ):
+        continuations += 1
+        output_so_far += response.response.err_value.truncated_output or ""
+        print(f"Continuing truncated response ({continuations}/{_MAX_TEXT_CONTINUATIONS}).")
+        response = response.add_followup(
+            await _prompt(
+                model=model,
+                system_prompt=system_prompt,
+                prompt=[
+                    *([UserMessage(msg=prompt)] if isinstance(prompt, str) else prompt),
+                    TextModelMessage(msg=output_so_far),
+                    UserMessage(msg=_CONTINUE_TRUNCATED_OUTPUT_PROMPT),
+                ],
+                generation_config=None,
+            )
+        )
+    if continuations and isinstance(response.response, Ok):
+        response = response.map(lambda continuation: output_so_far + continuation)
+    return response
 
 
 async def _prompt(
     model: GeminiModel,
     system_prompt: str,
     prompt: str | list[UserMessage | ModelMessage] | list[UserMessage | TextModelMessage],
-    generation_config: genai.GenerationConfig | None,
+    generation_config: GenerationConfigDict | None,
 ) -> LLMUsage[str]:
     try:
-        res = await genai.GenerativeModel(
-            model, safety_settings=SAFETY_SETTINGS, system_instruction=system_prompt
-        ).generate_content_async(
-            prompt if isinstance(prompt, str) else [msg.to_content_dict() for msg in prompt],
+        res = await _get_generative_model(model, system_prompt).generate_content_async(
+            _get_contents(prompt),
             generation_config=generation_config,
         )
     except Exception as e:
         return LLMUsage(
             input_tokens=0,
             output_tokens=0,
-            response=Err(LLMError(err_type=LLMError.ErrType.NO_RESPONSE, msg=str(e))),
+            response=Err(get_llm_error_from_exception(LLMError.ErrType.NO_RESPONSE, e)),
         )
 
     output_tokens = res.usage_metadata.total_token_count - res.usage_metadata.prompt_token_count
     try:
+        if res.candidates and res.candidates[0].finish_reason == _MAX_TOKENS_FINISH_REASON:
+            return LLMUsage(
+                input_tokens=res.usage_metadata.prompt_token_count,
+                output_tokens=output_tokens,
+                response=Err(_get_output_truncated_error(truncated_output=res.text)),
+            )
         return LLMUsage(
             input_tokens=res.usage_metadata.prompt_token_count,
             output_tokens=output_tokens,
@@ -151,5 +230,127 @@ async def _prompt(
         )
 
 
+async def _stream_prompt(
+    model: GeminiModel,
+    system_prompt: str,
+    prompt: str | list[UserMessage | ModelMessage],
+    generation_config: GenerationConfigDict,
+    response_json_schema: dict[str, Any],
+    partial_validation_fn: Callable[[Any], Result[None, str]] | None,
+) -> LLMUsage[str]:
+    parser = IncrementalJSONParser(response_json_schema)
+    response_text = ""
+    first_token_timestamp: datetime | None = None
+    usage_metadata = None
+    finish_reason = None
+
+    def _get_usage(response: Result[str, LLMError]) -> LLMUsage[str]:
+        return LLMUsage(
+            input_tokens=usage_metadata.prompt_token_count if usage_metadata else 0,
+            # When aborted early, the last chunk's usage might lag behind what was generated.
+            output_tokens=max(
+                usage_metadata.candidates_token_count if usage_metadata else 0,
+                estimate_tokens(response_text),
+            ),
+            response=response,
+            first_token_timestamp=first_token_timestamp,
+        )
+
+    try:
+        res = await _get_generative_model(model, system_prompt).generate_content_async(
+            _get_contents(prompt),
+            generation_config=generation_config,
+            stream=True,
+        )
+        async for chunk in res:
+            first_token_timestamp = first_token_timestamp or datetime.now()
+            usage_metadata = chunk.usage_metadata or usage_metadata
+            if chunk.candidates:
+                finish_reason = chunk.candidates[0].finish_reason or finish_reason
+            chunk_text = chunk.text  # chunk.text may raise ValueError.
+            response_text += chunk_text
+            parser.feed(chunk_text)
+            if partial_validation_fn:
+                match partial_validation_fn(parser.snapshot()):
+                    case Err(err_msg):
+                        # Returning here drops the stream, which cancels the rest of the generation.
+                        return _get_usage(
+                            Err(
+                                LLMError(
+                                    err_type=LLMError.ErrType.LOGICAL_VALIDATION_FAILED,
+                                    msg=f"Aborted streaming: {err_msg}",
+                                )
+                            )
+                        )
+    except IncrementalJSONError as e:
+        return _get_usage(
+            Err(
+                LLMError(
+                    err_type=LLMError.ErrType.RESPONSE_SCHEMA_VALIDATION_FAILED,
+                    msg=f"Aborted streaming: {e}",
+                )
+            )
+        )
+    except Exception as e:
+        return _get_usage(
+            Err(
+                get_llm_error_from_exception(
+                    (
+                        LLMError.ErrType.UNEXPECTED_RESPONSE
+                        if first_token_timestamp
+                        else LLMError.ErrType.NO_RESPONSE
+                    ),
+                    e,
+                )
+            )
+        )
+
+    if finish_reason == _MAX_TOKENS_FINISH_REASON:
+        return _get_usage(Err(_get_output_truncated_error(truncated_output=response_text)))
+    return _get_usage(Ok(response_text))
+
+
+def _get_output_truncated_error(truncated_output: str) -> LLMError:
+    return LLMError(
+        err_type=LLMError.ErrType.OUTPUT_TRUNCATED,
+        msg="Response was cut off at the model's max output tokens.",
+        truncated_output=truncated_output,
+    )
+
+
+def _get_contents(
+    prompt: str | list[UserMessage | ModelMessage] | list[UserMessage | TextModelMessage],
+) -> str | list[ContentDict]:
+    return prompt if isinstance(prompt, str) else [msg.to_content_dict() for msg in prompt]
+
+
+# The system prompts are mostly static per subtask, so there's only ever a handful of these in use.
+# The safety settings are a module constant, so they don't need to be part of the key.
+@functools.lru_cache(maxsize=64)
+def _get_generative_model(model: GeminiModel, system_prompt: str) -> genai.GenerativeModel:
+    if settings.FAKE_LLM_SERVER_URL:
+        return FakeGenerativeModel(settings.FAKE_LLM_SERVER_URL, model, system_prompt)  # type: ignore
+    return genai.GenerativeModel(
+        model, safety_settings=SAFETY_SETTINGS, system_instruction=system_prompt
+    )
+
+
+@functools.cache
+def _get_json_generation_config(response_type: type[BaseModel]) -> GenerationConfigDict:
+    # Converting the pydantic model into the response schema proto is surprisingly expensive, so do
+    # it once per response type. The SDK copies this dict before using it, so sharing it is safe.
+    return to_generation_config_dict(
+        genai.GenerationConfig(
+            response_mime_type="application/json",
+            response_schema=response_type,
+        )
+    )
+
+
+@functools.cache
+def _get_response_json_schema(response_type: type[BaseModel]) -> dict[str, Any]:
+    return response_type.model_json_schema()
+
+
 class PromptHistory(BaseModel):
     prompt_history: list[UserMessage | ModelMessage]
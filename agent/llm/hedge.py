@@ -0,0 +1,126 @@
+import asyncio
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Awaitable, Callable, ParamSpec, TypeVar
+
+import duckdb
+from result import Result
+
+from agent import settings
+from agent.llm.usage.LLMUsage import LLMError, llm_request_strategy, query_llm_usage_stats
+
+HEDGE_STRATEGY = "hedge"
+
+
+@dataclass(frozen=True)
+class HedgingPolicy:
+    # Send the hedged request once the original has taken longer than this percentile of the
+    # historical latency of the same subtask on the same model.
+    latency_percentile: float
+    # Don't trust the percentile until there's enough history.
+    min_samples: int = 10
+    # Optionally send the hedged request to a different model of the same provider.
+    alternate_models: dict[str, str] = field(default_factory=dict)
+
+
+_HEDGING_POLICY: HedgingPolicy | None = (
+    HedgingPolicy(latency_percentile=settings.LLM_HEDGING_PERCENTILE)
+    if settings.LLM_HEDGING_PERCENTILE is not None
+    else None
+)
+
+
+def configure_llm_request_hedging(hedging_policy: HedgingPolicy | None) -> None:
+    global _HEDGING_POLICY
+    _HEDGING_POLICY = hedging_policy
+
+
+def _get_latency_percentile(
+    model: str, subtask_name: str, hedging_policy: HedgingPolicy
+) -> float | None:
+    def query(conn: duckdb.DuckDBPyConnection) -> float | None:
+        num_samples, latency_percentile = conn.execute(
+            """
+            SELECT
+                count(*),
+                quantile_cont(epoch(end_timestamp - start_timestamp), $3)
+            FROM llm_usage
+            WHERE model = $1 AND subtask_name = $2 AND error IS NULL AND NOT cache_hit;
+            """,
+            [model, subtask_name, hedging_policy.latency_percentile],
+        ).fetchall()[0]
+        return latency_percentile if num_samples >= hedging_policy.min_samples else None
+
+    return query_llm_usage_stats(
+        (
+            "latency_percentile",
+            model,
+            subtask_name,
+            hedging_policy.latency_percentile,
+            hedging_policy.min_samples,
+        ),
+        query,
+    )
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def hedge_llm_requests(
+    func: Callable[P, Awaitable[Result[R, LLMError]]],
+) -> Callable[P, Awaitable[Result[R, LLMError]]]:
+    """If a call is taking longer than the configured percentile of its historical latency, send a
+    duplicate request and take whichever valid response comes back first, cancelling the other.
+
+    This must be applied *above* @log_llm_usage(...) so that both requests get logged. The duplicate
+    is logged with strategy='hedge', and the loser is logged as CANCELLED.
+    """
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Result[R, LLMError]:
+        hedging_policy = _HEDGING_POLICY
+        if hedging_policy is None:
+            return await func(*args, **kwargs)
+        model = kwargs["model"]
+        hedge_delay = _get_latency_percentile(
+            str(model), str(kwargs["subtask_name"]), hedging_policy
+        )
+        if hedge_delay is None:
+            return await func(*args, **kwargs)
+
+        async def _hedge() -> Result[R, LLMError]:
+            alternate_model = hedging_policy.alternate_models.get(str(model))
+            with llm_request_strategy(HEDGE_STRATEGY):
+                return await func(
+                    *args,
+                    **{
+                        **kwargs,
+                        "model": type(model)(alternate_model) if alternate_model else model,
+                    },
+                )
+
+        pending: set[asyncio.Task[Result[R, LLMError]]] = {
+            asyncio.create_task(func(*args, **kwargs))  # type: ignore
+        }
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return done.pop().result()
+
+            print(f"Hedging {kwargs['subtask_name']} after {hedge_delay:.1f}s.")
+            pending.add(asyncio.create_task(_hedge()))
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                results = [task.result() for task in done]
+                if ok_result := next((result for result in results if result.is_ok()), None):
+                    return ok_result
+                if not pending:
+                    return results[-1]  # Both failed, so just go with either error.
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let the cancelled calls log themselves before moving on.
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    return wrapper
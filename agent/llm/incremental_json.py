@@ -0,0 +1,249 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, NoReturn
+
+_WHITESPACE = " \t\n\r"
+_SCALAR_CHARS = set("0123456789+-.eE" + "truefalsn")
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class IncrementalJSONError(ValueError):
+    """The JSON streamed so far is invalid, or provably can't validate against the schema."""
+
+
+@dataclass
+class _Frame:
+    container: dict[str, Any] | list[Any]
+    schema: dict[str, Any] | None
+    # One of "key_or_end", "key", "colon", "value", "value_or_end", "comma_or_end".
+    expecting: str
+    key: str | None = None
+
+
+@dataclass
+class _String:
+    is_key: bool
+    chars: list[str] = field(default_factory=list)
+    escaping: bool = False
+    unicode_escape: str | None = None
+    # Whether the partial string has already been set in its parent container.
+    exposed: bool = False
+
+
+class IncrementalJSONParser:
+    """Parses a JSON document as it's streamed in, so that a response can be rejected as soon as
+    it's certain to be invalid rather than only once the whole thing has been generated.
+
+    Given a JSON schema, the type of every value is checked against it as soon as the value starts,
+    allowing for pydantic's lax mode (e.g. "1" is a valid int, but 1 isn't a valid str).
+    """
+
+    def __init__(self, json_schema: dict[str, Any] | None = None) -> None:
+        self._root_schema = json_schema
+        self._root: Any = None
+        self._stack: list[_Frame] = []
+        self._string: _String | None = None
+        self._scalar: str | None = None
+        self._num_chars = 0
+        self.complete = False
+
+    def feed(self, chunk: str) -> None:
+        for c in chunk:
+            self._feed_char(c)
+            self._num_chars += 1
+        # Expose the string that's currently being streamed (e.g. a file's content) in its parent.
+        if self._string is not None and not self._string.is_key:
+            self._set_value("".join(self._string.chars), replace_last=self._string.exposed)
+            self._string.exposed = True
+
+    def snapshot(self) -> Any:
+        """The value parsed so far. Strings that are still being streamed are included as-is, but
+        numbers and literals are only included once they're complete. Don't mutate this."""
+        return self._root
+
+    def _feed_char(self, c: str) -> None:
+        if self._string is not None:
+            self._feed_string_char(c)
+            return
+        if self._scalar is not None:
+            if c in _SCALAR_CHARS:
+                self._scalar += c
+                return
+            self._end_scalar()
+
+        if c in _WHITESPACE:
+            return
+        if self.complete:
+            self._fail(f"unexpected {c!r} after the end of the document")
+        if not self._stack:
+            if self._root is not None:
+                self._fail(f"unexpected {c!r}")
+            self._start_value(c, self._root_schema)
+            return
+
+        frame = self._stack[-1]
+        match frame.expecting, c:
+            case ("key_or_end", "}") | ("value_or_end", "]") | ("comma_or_end", "}" | "]"):
+                if (c == "}") != isinstance(frame.container, dict):
+                    self._fail(f"mismatched {c!r}")
+                self._stack.pop()
+                self._end_value()
+            case ("key_or_end" | "key", '"'):
+                self._string = _String(is_key=True)
+            case ("colon", ":"):
+                frame.expecting = "value"
+            case ("comma_or_end", ","):
+                frame.expecting = "key" if isinstance(frame.container, dict) else "value"
+            case ("value" | "value_or_end", _):
+                self._start_value(c, self._get_child_schema(frame))
+            case _:
+                self._fail(f"unexpected {c!r} when expecting {frame.expecting.replace('_', ' ')}")
+
+    def _feed_string_char(self, c: str) -> None:
+        string = self._string
+        assert string is not None
+        if string.unicode_escape is not None:
+            string.unicode_escape += c
+            if len(string.unicode_escape) == 4:
+                try:
+                    string.chars.append(chr(int(string.unicode_escape, 16)))
+                except ValueError:
+                    self._fail(f"invalid unicode escape \\u{string.unicode_escape}")
+                string.unicode_escape = None
+        elif string.escaping:
+            string.escaping = False
+            if c == "u":
+                string.unicode_escape = ""
+            elif c in _ESCAPES:
+                string.chars.append(_ESCAPES[c])
+            else:
+                self._fail(f"invalid escape \\{c}")
+        elif c == "\\":
+            string.escaping = True
+        elif c == '"':
+            self._string = None
+            value = "".join(string.chars)
+            if string.is_key:
+                self._stack[-1].key = value
+                self._stack[-1].expecting = "colon"
+            else:
+                self._set_value(value, replace_last=string.exposed)
+                self._end_value()
+        elif c in "\n\r":
+            self._fail("unescaped newline in string")
+        else:
+            string.chars.append(c)
+
+    def _start_value(self, c: str, schema: dict[str, Any] | None) -> None:
+        match c:
+            case "{":
+                json_type, container = "object", {}
+            case "[":
+                json_type, container = "array", []
+            case '"':
+                json_type, container = "string", None
+            case "t" | "f":
+                json_type, container = "boolean", None
+            case "n":
+                json_type, container = "null", None
+            case _ if c == "-" or c.isdigit():
+                json_type, container = "number", None
+            case _:
+                self._fail(f"unexpected {c!r} when expecting a value")
+        self._check_type(json_type, schema)
+
+        if container is not None:
+            self._set_value(container)
+            self._stack.append(
+                _Frame(
+                    container=container,
+                    schema=schema,
+                    expecting="key_or_end" if json_type == "object" else "value_or_end",
+                )
+            )
+        elif json_type == "string":
+            self._string = _String(is_key=False)
+        else:
+            self._scalar = c
+
+    def _end_scalar(self) -> None:
+        assert self._scalar is not None
+        try:
+            value = json.loads(self._scalar)
+        except json.JSONDecodeError:
+            self._fail(f"invalid literal {self._scalar!r}")
+        self._scalar = None
+        self._set_value(value)
+        self._end_value()
+
+    def _set_value(self, value: Any, replace_last: bool = False) -> None:
+        if not self._stack:
+            self._root = value
+            return
+        frame = self._stack[-1]
+        if isinstance(frame.container, dict):
+            assert frame.key is not None
+            frame.container[frame.key] = value
+        elif replace_last:
+            frame.container[-1] = value
+        else:
+            frame.container.append(value)
+
+    def _end_value(self) -> None:
+        if not self._stack:
+            self.complete = True
+        else:
+            self._stack[-1].expecting = "comma_or_end"
+
+    def _get_child_schema(self, frame: _Frame) -> dict[str, Any] | None:
+        schema = self._resolve(frame.schema)
+        if schema is None:
+            return None
+        if isinstance(frame.container, dict):
+            # Unknown keys aren't an error since pydantic ignores extra fields by default.
+            return schema.get("properties", {}).get(frame.key)
+        return schema.get("items")
+
+    def _resolve(self, schema: dict[str, Any] | None) -> dict[str, Any] | None:
+        if schema is None or "$ref" not in schema or self._root_schema is None:
+            return schema
+        # Pydantic only generates local refs like "#/$defs/CodeEdit".
+        resolved: Any = self._root_schema
+        for part in schema["$ref"].removeprefix("#/").split("/"):
+            resolved = resolved.get(part, {})
+        return resolved
+
+    def _get_allowed_types(self, schema: dict[str, Any] | None) -> set[str] | None:
+        schema = self._resolve(schema)
+        if schema is None:
+            return None
+        if "anyOf" in schema:
+            allowed_types: set[str] = set()
+            for option in schema["anyOf"]:
+                option_types = self._get_allowed_types(option)
+                if option_types is None:
+                    return None
+                allowed_types |= option_types
+            return allowed_types
+        match schema.get("type"):
+            case str(json_type):
+                return {json_type}
+            case list(json_types):
+                return set(json_types)
+            case _:
+                return {"object"} if "properties" in schema else None
+
+    def _check_type(self, json_type: str, schema: dict[str, Any] | None) -> None:
+        allowed_types = self._get_allowed_types(schema)
+        if allowed_types is None:
+            return
+        # Pydantic's lax mode will parse numbers and bools out of strings, and bools out of 0/1.
+        if "integer" in allowed_types or "number" in allowed_types:
+            allowed_types |= {"number", "string"}
+        if "boolean" in allowed_types:
+            allowed_types |= {"number", "string"}
+        if json_type not in allowed_types:
+            self._fail(f"got {json_type} but expected {' or '.join(sorted(allowed_types))}")
+
+    def _fail(self, msg: str) -> NoReturn:
+        raise IncrementalJSONError(f"Invalid JSON at char {self._num_chars}: {msg}")
@@ -1,20 +1,49 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
 import asyncclick as click
 import aiohttp
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 from agent import settings
 from agent.llm.openai.models import DALL_E_Model
 
-_OPENAI_CLIENT = OpenAI(api_key=settings.OPENAI_API_KEY)
+_OPENAI_CLIENT = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    base_url=f"{settings.FAKE_LLM_SERVER_URL}/v1" if settings.FAKE_LLM_SERVER_URL else None,
+)
+
+_IMAGE_MODEL = DALL_E_Model.DALL_E_3
+_IMAGE_SIZE = "1024x1024"
+_IMAGE_QUALITY = "standard"
+
+# Big enough to keep the number of writes down, small enough to never hold the whole image at once.
+_DOWNLOAD_CHUNK_SIZE_BYTES = 64 * 1024
+
+
+async def generate_image(prompt: str, save_path: str) -> None:
+    """Generate an image for the prompt and save it to the given path, reusing the image previously
+    generated for the exact same prompt if there is one."""
+    cached_image = _get_cached_image_path(prompt)
+    if cached_image.exists():
+        print(f"Reusing cached image {cached_image}.")
+    else:
+        cached_image.parent.mkdir(parents=True, exist_ok=True)
+        await download_image(await generate_image_to_url(prompt), str(cached_image))
+    await asyncio.to_thread(_copy_atomically, cached_image, Path(save_path))
 
 
 async def generate_image_to_url(prompt: str) -> str:
-    response = _OPENAI_CLIENT.images.generate(
-        model=DALL_E_Model.DALL_E_3,
+    response = await _OPENAI_CLIENT.images.generate(
+        model=_IMAGE_MODEL,
         prompt=prompt,
         n=1,
-        size="1024x1024",
-        quality="standard",
+        size=_IMAGE_SIZE,
+        quality=_IMAGE_QUALITY,
         response_format="url",
     )
     match response.data[0].url:
@@ -29,17 +58,45 @@ async def download_image(url: str, save_path: str) -> None:
         async with session.get(url) as response:
             response.raise_for_status()  # Let me know if there was some issue.
 
-            data = await response.read()
-            with open(save_path, "wb") as f:
-                f.write(data)
+            # Write to a temp file first so that a failed download never leaves a partial image.
+            with tempfile.NamedTemporaryFile(
+                "wb", dir=Path(save_path).parent, suffix=".tmp", delete=False
+            ) as f:
+                try:
+                    async for chunk in response.content.iter_chunked(_DOWNLOAD_CHUNK_SIZE_BYTES):
+                        f.write(chunk)
+                except BaseException:
+                    f.close()
+                    os.remove(f.name)
+                    raise
+            os.replace(f.name, save_path)
+
+
+def _get_cached_image_path(prompt: str) -> Path:
+    # The generation settings are part of the key so that changing them doesn't reuse stale images.
+    key_material = f"{_IMAGE_MODEL}:{_IMAGE_SIZE}:{_IMAGE_QUALITY}:{prompt}"
+    if settings.FAKE_LLM_SERVER_URL:
+        key_material = f"{settings.FAKE_LLM_SERVER_URL}:{key_material}"  # Keep fake images apart.
+    key = hashlib.sha256(key_material.encode()).hexdigest()
+    return Path(settings.IMAGE_CACHE_DIR) / f"{key}.png"
+
+
+def _copy_atomically(src: Path, dst: Path) -> None:
+    with tempfile.NamedTemporaryFile(dir=dst.parent, suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
 
 
 @click.command()
 @click.option("--prompt", required=True)
 @click.option("--save-path", required=True)
 async def main(prompt: str, save_path: str) -> None:
-    url = await generate_image_to_url(prompt)
-    await download_image(url, save_path)
+    await generate_image(prompt, save_path)
 
 
 if __name__ == "__main__":
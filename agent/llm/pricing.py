@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+
+from agent.llm.anthropic.models import AnthropicModel
+from agent.llm.gemini.models import GeminiModel
+
+
+@dataclass(frozen=True)
+class ModelPricing:
+    # USD per million tokens.
+    input: float
+    output: float
+    # Only for providers with prompt caching.
+    cache_read_input: float = 0
+    cache_write_input: float = 0
+
+    def get_cost(
+        self,
+        input_tokens: float,
+        output_tokens: float,
+        cache_read_input_tokens: float = 0,
+        cache_write_input_tokens: float = 0,
+    ) -> float:
+        return (
+            input_tokens * self.input
+            + output_tokens * self.output
+            + cache_read_input_tokens * self.cache_read_input
+            + cache_write_input_tokens * self.cache_write_input
+        ) / 1_000_000
+
+
+# List prices for prompts up to 128k tokens. The experimental models are free while they last.
+MODEL_PRICING: dict[str, ModelPricing] = {
+    AnthropicModel.CLAUDE_SONNET_3_5_OCT_2024: ModelPricing(
+        input=3.0, output=15.0, cache_read_input=0.3, cache_write_input=3.75
+    ),
+    AnthropicModel.CLAUDE_HAIKU_3_5_OCT_2024: ModelPricing(
+        input=0.8, output=4.0, cache_read_input=0.08, cache_write_input=1.0
+    ),
+    GeminiModel.GEMINI_1_5_PRO: ModelPricing(input=1.25, output=5.0),
+    GeminiModel.GEMINI_1_5_FLASH: ModelPricing(input=0.075, output=0.3),
+    GeminiModel.GEMINI_1_5_FLASH_8B: ModelPricing(input=0.0375, output=0.15),
+    GeminiModel.GEMINI_2_0_FLASH_EXP: ModelPricing(input=0, output=0),
+    GeminiModel.GEMINI_EXP_1206: ModelPricing(input=0, output=0),
+}
+
+
+def get_model_pricing(model: str) -> ModelPricing:
+    # Err on the side of assuming that unknown models are expensive.
+    return MODEL_PRICING.get(model, MODEL_PRICING[AnthropicModel.CLAUDE_SONNET_3_5_OCT_2024])
@@ -0,0 +1,195 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from functools import wraps
+from typing import Awaitable, Callable, ParamSpec, TypeVar
+
+from agent.llm.anthropic.models import AnthropicModel
+from agent.llm.estimate_tokens import estimate_request_tokens
+from agent.llm.gemini.models import GeminiModel
+from agent.llm.usage.LLMUsage import LLMError, LLMUsage
+
+_MAX_RETRIES = 4
+_BASE_BACKOFF_SECONDS = 1.0
+_MAX_BACKOFF_SECONDS = 20.0
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    max_concurrent_requests: int
+    requests_per_minute: int
+    tokens_per_minute: int
+
+
+_DEFAULT_RATE_LIMITS = RateLimits(
+    max_concurrent_requests=8, requests_per_minute=60, tokens_per_minute=100_000
+)
+# These are just our current quotas, use configure_rate_limits(...) if they change.
+_RATE_LIMITS: dict[str, RateLimits] = {
+    AnthropicModel.CLAUDE_SONNET_3_5_OCT_2024: RateLimits(
+        max_concurrent_requests=8, requests_per_minute=1000, tokens_per_minute=80_000
+    ),
+    AnthropicModel.CLAUDE_HAIKU_3_5_OCT_2024: RateLimits(
+        max_concurrent_requests=8, requests_per_minute=1000, tokens_per_minute=100_000
+    ),
+    GeminiModel.GEMINI_1_5_PRO: RateLimits(
+        max_concurrent_requests=8, requests_per_minute=1000, tokens_per_minute=4_000_000
+    ),
+    GeminiModel.GEMINI_1_5_FLASH: RateLimits(
+        max_concurrent_requests=16, requests_per_minute=2000, tokens_per_minute=4_000_000
+    ),
+    GeminiModel.GEMINI_1_5_FLASH_8B: RateLimits(
+        max_concurrent_requests=16, requests_per_minute=4000, tokens_per_minute=4_000_000
+    ),
+    # The experimental models have much tighter limits.
+    GeminiModel.GEMINI_2_0_FLASH_EXP: RateLimits(
+        max_concurrent_requests=4, requests_per_minute=10, tokens_per_minute=4_000_000
+    ),
+    GeminiModel.GEMINI_EXP_1206: RateLimits(
+        max_concurrent_requests=2, requests_per_minute=10, tokens_per_minute=4_000_000
+    ),
+}
+
+
+def configure_rate_limits(model: str, rate_limits: RateLimits) -> None:
+    _RATE_LIMITS[model] = rate_limits
+    _LIMITERS.pop(model, None)
+
+
+class _TokenBucket:
+    """Continuously refilling bucket holding up to a minute's worth of budget."""
+
+    def __init__(self, per_minute: int) -> None:
+        self._capacity = float(per_minute)
+        self._available = float(per_minute)
+        self._last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._available = min(
+            self._capacity, self._available + (now - self._last_refill) * self._capacity / 60
+        )
+        self._last_refill = now
+
+    async def acquire(self, amount: int) -> None:
+        # Anything bigger than the whole bucket would otherwise wait forever.
+        amount = min(amount, int(self._capacity))
+        while True:
+            self._refill()
+            if self._available >= amount:
+                self._available -= amount
+                return
+            await asyncio.sleep((amount - self._available) * 60 / self._capacity)
+
+    def adjust(self, amount: int) -> None:
+        """Correct an earlier estimate now that the real usage is known. May go into debt."""
+        self._refill()
+        self._available = min(self._capacity, self._available - amount)
+
+
+class _Limiter:
+    def __init__(self, rate_limits: RateLimits) -> None:
+        self.semaphore = asyncio.Semaphore(rate_limits.max_concurrent_requests)
+        self.requests = _TokenBucket(rate_limits.requests_per_minute)
+        self.tokens = _TokenBucket(rate_limits.tokens_per_minute)
+        # Shared by every request to this model so that a 429 backs off all of them at once, rather
+        # than each request independently hammering the API until it gets its own 429.
+        self.cooldown_until = 0.0
+
+    async def wait_for_cooldown(self) -> None:
+        while (remaining := self.cooldown_until - time.monotonic()) > 0:
+            await asyncio.sleep(remaining)
+
+
+_LIMITERS: dict[str, _Limiter] = {}
+
+
+def _get_limiter(model: str) -> _Limiter:
+    if model not in _LIMITERS:
+        _LIMITERS[model] = _Limiter(_RATE_LIMITS.get(model, _DEFAULT_RATE_LIMITS))
+    return _LIMITERS[model]
+
+
+def is_retryable_exception(e: BaseException) -> bool:
+    """Rate limits (429), server errors (5xx) and timeouts are worth retrying, anything else (e.g. a
+    bad request) will just fail again."""
+    status_code = _get_status_code(e)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(e, (TimeoutError, ConnectionError)) or type(e).__name__ in (
+        "APITimeoutError",
+        "APIConnectionError",
+    )
+
+
+def _get_status_code(e: BaseException) -> int | None:
+    # Anthropic's errors have a status_code, and google.api_core's errors have an HTTP code.
+    status_code = getattr(e, "status_code", None) or getattr(e, "code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def get_llm_error_from_exception(err_type: LLMError.ErrType, e: BaseException) -> LLMError:
+    retry_after_seconds = None
+    if headers := getattr(getattr(e, "response", None), "headers", None):
+        try:
+            retry_after_seconds = float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    return LLMError(
+        err_type=err_type,
+        msg=str(e),
+        retryable=is_retryable_exception(e),
+        rate_limited=_get_status_code(e) == 429,
+        retry_after_seconds=retry_after_seconds,
+    )
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def rate_limit_llm_requests(func: Callable[P, Awaitable[LLMUsage[R]]]):
+    """Limit the concurrency, requests per minute and tokens per minute of requests to each model,
+    shared across everything running in this process, and retry retryable errors with jittered
+    exponential backoff.
+
+    This must be applied *under* @cache_llm_response(...) so that cache hits don't count against the
+    limits, and so that every retry is within a single logged LLM call.
+    """
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> LLMUsage[R]:
+        limiter = _get_limiter(str(kwargs["model"]))
+        # Only the input can be estimated up front, the difference gets corrected afterwards.
+        estimated_tokens = estimate_request_tokens(kwargs)
+        attempt = 0
+        while True:
+            await limiter.wait_for_cooldown()
+            await limiter.requests.acquire(1)
+            await limiter.tokens.acquire(estimated_tokens)
+            async with limiter.semaphore:
+                result = await func(*args, **kwargs)
+            limiter.tokens.adjust(result.input_tokens + result.output_tokens - estimated_tokens)
+
+            if result.response.is_ok() or not result.response.unwrap_err().retryable:
+                return result
+            attempt += 1
+            if attempt > _MAX_RETRIES:
+                return result
+
+            err = result.response.unwrap_err()
+            backoff_seconds = err.retry_after_seconds or random.uniform(
+                0, min(_MAX_BACKOFF_SECONDS, _BASE_BACKOFF_SECONDS * 2**attempt)
+            )
+            if err.rate_limited:
+                limiter.cooldown_until = max(
+                    limiter.cooldown_until, time.monotonic() + backoff_seconds
+                )
+            print(
+                f"Retrying {kwargs['model']} request in {backoff_seconds:.1f}s "
+                f"(attempt {attempt}/{_MAX_RETRIES}): {err.msg}"
+            )
+            await asyncio.sleep(backoff_seconds)
+
+    return wrapper
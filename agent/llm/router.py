@@ -0,0 +1,227 @@
+import contextlib
+import contextvars
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Awaitable, Callable, ParamSpec, TypeVar
+
+import duckdb
+from result import Result
+
+from agent.llm.anthropic.models import AnthropicModel
+from agent.llm.gemini.models import GeminiModel
+from agent.llm.pricing import get_model_pricing
+from agent.llm.usage.LLMUsage import LLMError, is_llm_budget_low, query_llm_usage_stats
+
+# The models that a subtask may be routed to, for each provider. Each subtask's hard-coded model
+# choice is always a candidate too. The tiny models aren't trusted with anything by default.
+_CANDIDATE_MODELS: dict[type, list[str]] = {
+    GeminiModel: [
+        GeminiModel.GEMINI_1_5_PRO,
+        GeminiModel.GEMINI_1_5_FLASH,
+        GeminiModel.GEMINI_2_0_FLASH_EXP,
+    ],
+    AnthropicModel: [AnthropicModel.CLAUDE_SONNET_3_5_OCT_2024],
+}
+
+# What to fall back to once the LLM budget is running low (see LLMBudget), for each provider.
+_BUDGET_FALLBACK_MODELS: dict[type, str] = {
+    GeminiModel: GeminiModel.GEMINI_1_5_FLASH,
+    AnthropicModel: AnthropicModel.CLAUDE_HAIKU_3_5_OCT_2024,
+}
+
+
+@dataclass(frozen=True)
+class RoutingPolicy:
+    min_success_rate: float = 0.9
+    # Don't route to a model based on just a handful of calls.
+    min_samples: int = 10
+    # Only the most recent calls of each subtask to each model count.
+    window: int = 50
+    max_cost_per_call: float | None = None
+
+
+@dataclass(frozen=True)
+class ModelStats:
+    num_calls: int
+    success_rate: float
+    p50_latency_seconds: float
+    p95_latency_seconds: float
+    avg_cost: float
+
+
+@dataclass
+class ModelRoutingConfig:
+    enabled: bool = True
+    policy: RoutingPolicy = field(default_factory=RoutingPolicy)
+    # Always use this model for the given subtask name, regardless of the stats.
+    overrides: dict[str, str] = field(default_factory=dict)
+
+
+_CONFIGS: dict[str | None, ModelRoutingConfig] = {None: ModelRoutingConfig()}
+
+_MODEL_ROUTING_SCOPE: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "model_routing_scope", default=None
+)
+
+
+@contextlib.contextmanager
+def model_routing_scope(scope: str):
+    """Route the LLM calls made within this context according to the given scope's config, e.g. each
+    workflow's activities run in a scope of their own so that they don't share overrides."""
+    token = _MODEL_ROUTING_SCOPE.set(scope)
+    try:
+        yield
+    finally:
+        _MODEL_ROUTING_SCOPE.reset(token)
+
+
+def configure_model_routing(
+    enabled: bool = True,
+    policy: RoutingPolicy | None = None,
+    overrides: dict[str, str] | None = None,
+    scope: str | None = None,
+) -> None:
+    _CONFIGS[scope] = ModelRoutingConfig(
+        enabled=enabled, policy=policy or RoutingPolicy(), overrides=overrides or {}
+    )
+
+
+def clear_model_routing(scope: str) -> None:
+    """Forget the scope's config once it's done making LLM calls."""
+    _CONFIGS.pop(scope, None)
+
+
+def _get_config() -> ModelRoutingConfig:
+    # Scopes that were never configured get the process-wide default.
+    return _CONFIGS.get(_MODEL_ROUTING_SCOPE.get()) or _CONFIGS[None]
+
+
+def get_model_stats(subtask_name: str, window: int) -> dict[str, ModelStats]:
+    """The rolling stats of each model that's been used for the subtask, from the llm_usage logs."""
+
+    def query(conn: duckdb.DuckDBPyConnection) -> dict[str, ModelStats]:
+        rows = conn.execute(
+            """
+            WITH recent_calls AS (
+                SELECT
+                    *,
+                    row_number() OVER (PARTITION BY model ORDER BY start_timestamp DESC) AS recency
+                FROM llm_usage
+                WHERE subtask_name = $1
+                    AND NOT cache_hit
+                    -- The cheap first tries of a cascade are expected to fail some of the time.
+                    AND (strategy IS NULL OR strategy != 'cascade')
+                    -- These say nothing about the model itself.
+                    AND (
+                        error IS NULL
+                        OR error NOT IN ('CANCELLED', 'CACHE_MISS', 'BUDGET_EXHAUSTED')
+                    )
+            )
+            SELECT
+                model,
+                count(*),
+                avg(CASE WHEN error IS NULL THEN 1 ELSE 0 END),
+                quantile_cont(epoch(end_timestamp - start_timestamp), 0.5),
+                quantile_cont(epoch(end_timestamp - start_timestamp), 0.95),
+                avg(input_tokens),
+                avg(coalesce(output_tokens, 0)),
+                avg(cache_read_input_tokens),
+                avg(cache_write_input_tokens)
+            FROM recent_calls
+            WHERE recency <= $2
+            GROUP BY model;
+            """,
+            [subtask_name, window],
+        ).fetchall()
+        return {
+            model: ModelStats(
+                num_calls=num_calls,
+                success_rate=success_rate,
+                p50_latency_seconds=p50_latency,
+                p95_latency_seconds=p95_latency,
+                avg_cost=get_model_pricing(model).get_cost(*avg_tokens),
+            )
+            for model, num_calls, success_rate, p50_latency, p95_latency, *avg_tokens in rows
+        }
+
+    return query_llm_usage_stats(("model_stats", subtask_name, window), query) or {}
+
+
+def choose_model[M: str](subtask_name: str, default_model: M) -> M:
+    """Pick the fastest model that has been reliable enough for this subtask so far, falling back to
+    the subtask's hard-coded default model when there's not enough history to go off of. Once the
+    LLM budget is running low, this picks the provider's cheap fallback model instead."""
+    config = _get_config()
+    model = _choose_model(subtask_name, default_model, config)
+    fallback_model = _BUDGET_FALLBACK_MODELS.get(type(default_model))
+    if (
+        fallback_model
+        and is_llm_budget_low()
+        # An explicit override still wins.
+        and subtask_name not in config.overrides
+        and get_model_pricing(fallback_model).output < get_model_pricing(model).output
+    ):
+        return type(default_model)(fallback_model)  # type: ignore
+    return model
+
+
+def _choose_model[M: str](subtask_name: str, default_model: M, config: ModelRoutingConfig) -> M:
+    model_type = type(default_model)
+    if override := config.overrides.get(subtask_name):
+        try:
+            return model_type(override)  # type: ignore
+        except ValueError:
+            print(f"Ignoring {subtask_name} model override {override}, it's not a {model_type}.")
+    if not config.enabled:
+        return default_model
+
+    policy = config.policy
+    model_stats = get_model_stats(subtask_name, policy.window)
+    eligible_models = [
+        model
+        for model in {default_model, *_CANDIDATE_MODELS.get(model_type, [])}
+        if (stats := model_stats.get(model))
+        and stats.num_calls >= policy.min_samples
+        and stats.success_rate >= policy.min_success_rate
+        and (policy.max_cost_per_call is None or stats.avg_cost <= policy.max_cost_per_call)
+    ]
+    if not eligible_models:
+        return default_model
+    return model_type(
+        min(
+            eligible_models,
+            key=lambda model: (
+                model_stats[model].p50_latency_seconds,
+                model_stats[model].p95_latency_seconds,
+                model_stats[model].avg_cost,
+            ),
+        )
+    )  # type: ignore
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def route_llm_requests(
+    func: Callable[P, Awaitable[Result[R, LLMError]]],
+) -> Callable[P, Awaitable[Result[R, LLMError]]]:
+    """Swap out the requested model for whichever model the router picks for the subtask. The model
+    passed in by the caller is used as the default.
+
+    This must be the outermost decorator so that everything under it sees the routed model.
+    """
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> Result[R, LLMError]:
+        requested_model = kwargs["model"]
+        routed_model = choose_model(str(kwargs["subtask_name"]), requested_model)  # type: ignore
+        # With a cascade, the routed model is only what the cascade escalates to, so it must never
+        # be one of the cheaper models that were already tried (see agent/llm/cascade.py).
+        if routed_model in (kwargs.get("cascade_models") or ()):  # type: ignore
+            routed_model = requested_model
+        if routed_model != requested_model:
+            print(f"Routing {kwargs['subtask_name']} from {requested_model} to {routed_model}.")
+        return await func(*args, **{**kwargs, "model": routed_model})
+
+    return wrapper
@@ -0,0 +1,254 @@
+import asyncio
+import dataclasses
+import enum
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import wraps
+from pathlib import Path
+from typing import Any, Awaitable, Callable, ParamSpec, TypeVar
+
+from pydantic import BaseModel, ValidationError
+from result import Err, Ok
+
+from agent import settings
+from agent.llm.usage.LLMUsage import LLMError, LLMUsage
+
+
+class LLMResponseCacheMode(enum.StrEnum):
+    # Always hit the network.
+    DISABLED = "disabled"
+    # Serve from the cache when possible, otherwise hit the network and cache the response.
+    READ_THROUGH = "read-through"
+    # Always hit the network, but cache the responses for replaying later.
+    RECORD_ONLY = "record-only"
+    # NEVER hit the network. Cache misses are errors. Useful for deterministic reruns.
+    STRICT_REPLAY = "strict-replay"
+
+
+@dataclass
+class LLMResponseCacheConfig:
+    mode: LLMResponseCacheMode
+    cache_dir: Path
+    max_size_bytes: int
+    max_age: timedelta
+
+
+_CACHE_CONFIG = LLMResponseCacheConfig(
+    mode=LLMResponseCacheMode(settings.LLM_RESPONSE_CACHE_MODE),
+    cache_dir=Path(settings.LLM_RESPONSE_CACHE_DIR),
+    max_size_bytes=settings.LLM_RESPONSE_CACHE_MAX_SIZE_MB * 1024 * 1024,
+    max_age=timedelta(days=settings.LLM_RESPONSE_CACHE_MAX_AGE_DAYS),
+)
+
+
+def configure_llm_response_cache(
+    mode: LLMResponseCacheMode,
+    cache_dir: os.PathLike | None = None,
+    max_size_bytes: int | None = None,
+    max_age: timedelta | None = None,
+) -> None:
+    """Configure LLM response caching. Anything left unset keeps its default from settings."""
+    global _CACHE_CONFIG
+    _CACHE_CONFIG = LLMResponseCacheConfig(
+        mode=mode,
+        cache_dir=Path(cache_dir) if cache_dir else _CACHE_CONFIG.cache_dir,
+        max_size_bytes=max_size_bytes or _CACHE_CONFIG.max_size_bytes,
+        max_age=max_age or _CACHE_CONFIG.max_age,
+    )
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def cache_llm_response(provider: str):
+    """Content-addressed cache of successful LLM responses keyed on the provider, model, system
+    prompt, messages and response schema (i.e. every kwarg other than the subtask name, whether the
+    response is streamed, and any validation fns).
+
+    This must be applied *under* @log_llm_usage(...) so that cache hits still get logged, e.g.:
+
+        @log_llm_usage(provider=..., model=...)
+        @cache_llm_response(provider=...)
+        async def prompt(...) -> LLMUsage[...]: ...
+
+    Note that concurrent identical requests (e.g. sampling for a vote) all map to the same cache
+    entry, so replays will be fully deterministic.
+    """
+
+    def decorator(
+        func: Callable[P, Awaitable[LLMUsage[R]]],
+    ) -> Callable[P, Awaitable[LLMUsage[R]]]:
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> LLMUsage[R]:
+            mode = _CACHE_CONFIG.mode
+            if mode == LLMResponseCacheMode.DISABLED:
+                return await func(*args, **kwargs)
+
+            key = _get_cache_key(provider, kwargs)
+            if mode in (LLMResponseCacheMode.READ_THROUGH, LLMResponseCacheMode.STRICT_REPLAY):
+                if (cached := _read_cached_response(key, kwargs)) is not None:
+                    return cached
+                if mode == LLMResponseCacheMode.STRICT_REPLAY:
+                    return LLMUsage(
+                        input_tokens=0,
+                        output_tokens=0,
+                        response=Err(
+                            LLMError(
+                                err_type=LLMError.ErrType.CACHE_MISS,
+                                msg=f"No cached response for {key} in strict replay mode.",
+                            )
+                        ),
+                    )
+
+            result = await func(*args, **kwargs)
+            if result.response.is_ok():
+                _write_cached_response(key, provider, result)
+                _schedule_eviction()
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# These don't change what the response would be.
+_NON_KEY_KWARGS = {"subtask_name", "stream"}
+
+
+def _get_cache_key(provider: str, kwargs: dict[str, Any]) -> str:
+    key_material = {
+        "provider": provider,
+        # Never mix up the fake LLM server's responses with the real ones.
+        **(
+            {"fake_llm_server_url": settings.FAKE_LLM_SERVER_URL}
+            if settings.FAKE_LLM_SERVER_URL
+            else {}
+        ),
+        **{
+            name: _to_key_material(value)
+            for name, value in kwargs.items()
+            if name not in _NON_KEY_KWARGS and (not callable(value) or isinstance(value, type))
+        },
+    }
+    return hashlib.sha256(
+        json.dumps(key_material, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def _to_key_material(value: Any) -> Any:
+    match value:
+        case type() if issubclass(value, BaseModel):
+            # The response type only matters as far as the schema that's sent to the LLM.
+            return value.model_json_schema()
+        case BaseModel():
+            return value.model_dump(mode="json")
+        case enum.Enum():
+            return value.value
+        case dict():
+            return {str(k): _to_key_material(v) for k, v in value.items()}
+        case list() | tuple():
+            return [_to_key_material(v) for v in value]
+        case _ if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            return _to_key_material(dataclasses.asdict(value))
+        case str() | int() | float() | bool() | None:
+            return value
+        case _:
+            return repr(value)
+
+
+def _get_cache_file(key: str) -> Path:
+    return _CACHE_CONFIG.cache_dir / key[:2] / f"{key}.json"
+
+
+def _read_cached_response(key: str, kwargs: dict[str, Any]) -> LLMUsage | None:
+    cache_file = _get_cache_file(key)
+    try:
+        if time.time() - cache_file.stat().st_mtime > _CACHE_CONFIG.max_age.total_seconds():
+            cache_file.unlink(missing_ok=True)
+            return None
+        cached = json.loads(cache_file.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    try:
+        response: Any = cached["response"]
+        if (response_type := kwargs.get("response_type")) is not None:
+            response = response_type.model_validate_json(response)
+    except (KeyError, TypeError, ValidationError):
+        # A truncated or hand-edited entry, just treat it as a miss and overwrite it.
+        return None
+    # The validation may depend on more than just the request itself, so make sure the cached
+    # response would still be accepted.
+    if (extra_validation_fn := kwargs.get("extra_validation_fn")) is not None:
+        if isinstance(extra_validation_fn(response), Err):
+            return None
+
+    # Cache hits are free, so don't count the original tokens again.
+    return LLMUsage(input_tokens=0, output_tokens=0, response=Ok(response), cache_hit=True)
+
+
+def _write_cached_response(key: str, provider: str, result: LLMUsage) -> None:
+    response = result.response.unwrap()
+    cache_file = _get_cache_file(key)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Write atomically so that concurrent readers never see a partially written entry.
+    tmp_cache_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+    tmp_cache_file.write_text(
+        json.dumps(
+            {
+                "provider": provider,
+                "input_tokens": result.input_tokens,
+                "output_tokens": result.output_tokens,
+                "response": (
+                    response.model_dump_json() if isinstance(response, BaseModel) else response
+                ),
+            }
+        )
+    )
+    os.replace(tmp_cache_file, cache_file)
+
+
+# Scanning the whole cache dir isn't free, so only evict once every this many writes.
+_EVICT_EVERY_N_WRITES = 50
+
+_num_writes_since_eviction = 0
+_eviction_task: asyncio.Task | None = None
+
+
+def _schedule_eviction() -> None:
+    global _num_writes_since_eviction, _eviction_task
+    _num_writes_since_eviction += 1
+    if _num_writes_since_eviction < _EVICT_EVERY_N_WRITES or (
+        _eviction_task is not None and not _eviction_task.done()
+    ):
+        return
+    _num_writes_since_eviction = 0
+    # Keep the event loop free for the LLM calls while the cache dir is scanned.
+    _eviction_task = asyncio.create_task(asyncio.to_thread(_evict))
+
+
+def _evict() -> None:
+    """Drop expired entries, then the least recently written entries until under the size limit."""
+    now = time.time()
+    entries: list[tuple[float, int, Path]] = []
+    for cache_file in _CACHE_CONFIG.cache_dir.glob("*/*.json"):
+        try:
+            stat = cache_file.stat()
+        except OSError:
+            continue  # Concurrently evicted.
+        if now - stat.st_mtime > _CACHE_CONFIG.max_age.total_seconds():
+            cache_file.unlink(missing_ok=True)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, cache_file))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, cache_file in sorted(entries):
+        if total_size <= _CACHE_CONFIG.max_size_bytes:
+            break
+        cache_file.unlink(missing_ok=True)
+        total_size -= size
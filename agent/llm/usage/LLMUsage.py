@@ -1,15 +1,62 @@
+import asyncio
 import atexit
+import contextlib
+import contextvars
+import dataclasses
 from dataclasses import dataclass
 from datetime import datetime
 import enum
 import duckdb
 import os
 from pathlib import Path
+import time
 from pydantic import BaseModel
 from result import Err, Ok, Result
-from typing import Awaitable, Callable, Literal, ParamSpec, TypeVar, cast
+from typing import Awaitable, Callable, Hashable, Literal, ParamSpec, TypeVar, cast
 from functools import wraps
 
+from agent.llm.estimate_tokens import estimate_request_tokens
+from agent.llm.pricing import ModelPricing, get_model_pricing
+
+
+class LLMBudget(BaseModel):
+    """Limits on the LLM spend within a single scope (see llm_spend_scope). Calls are refused once
+    either limit has been reached."""
+
+    max_tokens: int | None = None
+    # USD, see agent/llm/pricing.py.
+    max_cost: float | None = None
+    # The budget counts as running low once this fraction of either limit has been spent, at which
+    # point the router falls back to cheaper models (see agent/llm/router.py).
+    low_budget_fraction: float = 0.8
+
+
+class LLMSpend(BaseModel):
+    """The running LLM spend within a single scope. Cache hits are free."""
+
+    num_calls: int = 0
+    tokens: int = 0
+    cost: float = 0
+    budget: LLMBudget | None = None
+
+    def is_low(self) -> bool:
+        return self.budget is not None and self._exceeds(self.budget.low_budget_fraction)
+
+    def is_exhausted(self, additional_tokens: int = 0, additional_cost: float = 0) -> bool:
+        return self.budget is not None and self._exceeds(1, additional_tokens, additional_cost)
+
+    def _exceeds(
+        self, fraction: float, additional_tokens: int = 0, additional_cost: float = 0
+    ) -> bool:
+        assert self.budget is not None
+        return (
+            self.budget.max_tokens is not None
+            and self.tokens + additional_tokens >= fraction * self.budget.max_tokens
+        ) or (
+            self.budget.max_cost is not None
+            and self.cost + additional_cost >= fraction * self.budget.max_cost
+        )
+
 
 @dataclass
 class LLMUsageLoggingConfig:
@@ -20,8 +67,6 @@ class LLMUsageLoggingConfig:
 
     execution_name: str
     persisted_logs_config: LoggingEnabledConfig | None
-    # TODO(steving) Add support for a max cost threshold. Could be useful to have a max threshold
-    # for a single program execution, or also for a single overall task.
 
 
 _CONFIG: LLMUsageLoggingConfig = None  # type: ignore
@@ -72,10 +117,26 @@ def configure_llm_usage_logging(execution_name: str, log_dir: os.PathLike | None
                 -- If the LLM encountered an error, then error and error_msg will be set.
                 error VARCHAR DEFAULT NULL,
                 error_msg VARCHAR DEFAULT NULL,
+                -- Set if the response was served from the LLM response cache rather than the network.
+                cache_hit BOOLEAN NOT NULL DEFAULT FALSE,
+                -- Provider-side prompt caching. These are in addition to input_tokens.
+                cache_read_input_tokens INTEGER NOT NULL DEFAULT 0,
+                cache_write_input_tokens INTEGER NOT NULL DEFAULT 0,
+                -- Only recorded for streamed responses.
+                first_token_timestamp TIMESTAMP DEFAULT NULL,
+                -- How the request was made if not just a single plain request, e.g. 'hedge'.
+                strategy VARCHAR DEFAULT NULL,
 
                 PRIMARY KEY(execution_id, subtask_id),
                 CHECK (error IS NULL or error_msg IS NOT NULL)
             );
+
+            -- Migrate logs from before these columns existed.
+            ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT FALSE;
+            ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS cache_read_input_tokens INTEGER DEFAULT 0;
+            ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS cache_write_input_tokens INTEGER DEFAULT 0;
+            ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS first_token_timestamp TIMESTAMP DEFAULT NULL;
+            ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS strategy VARCHAR DEFAULT NULL;
             """  # noqa: E501
         )
 
@@ -97,6 +158,111 @@ def configure_llm_usage_logging(execution_name: str, log_dir: os.PathLike | None
     atexit.register(_show_usage_summary)
 
 
+def get_llm_usage_log_file() -> Path | None:
+    if _CONFIG is None or _CONFIG.persisted_logs_config is None:
+        return None
+    return _CONFIG.persisted_logs_config.log_file
+
+
+# Recomputing stats from the llm_usage logs for every single call would be a waste, they don't move
+# that fast.
+_LLM_USAGE_STATS_TTL_SECONDS = 300
+_LLM_USAGE_STATS: dict[Hashable, tuple[float, object]] = {}
+
+
+def query_llm_usage_stats[T](
+    key: Hashable, query: Callable[[duckdb.DuckDBPyConnection], T]
+) -> T | None:
+    """Run the query against the persisted llm_usage logs, reusing its result for the same key for a
+    few minutes. None if the logs aren't persisted, i.e. there's no history to go off of."""
+    log_file = get_llm_usage_log_file()
+    if log_file is None:
+        return None
+
+    if (cached := _LLM_USAGE_STATS.get(key)) and cached[0] > time.monotonic():
+        return cast(T, cached[1])
+
+    with duckdb.connect(log_file) as conn:
+        stats = query(conn)
+    _LLM_USAGE_STATS[key] = (time.monotonic() + _LLM_USAGE_STATS_TTL_SECONDS, stats)
+    return stats
+
+
+_LLM_REQUEST_STRATEGY: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "llm_request_strategy", default=None
+)
+
+
+@contextlib.contextmanager
+def llm_request_strategy(strategy: str):
+    """Tag the LLM calls made within this context in the llm_usage logs."""
+    token = _LLM_REQUEST_STRATEGY.set(strategy)
+    try:
+        yield
+    finally:
+        _LLM_REQUEST_STRATEGY.reset(token)
+
+
+@dataclass
+class _LLMSpendTracker:
+    spend: LLMSpend
+    # Called with the updated spend after every LLM call, e.g. to report it back to the workflow.
+    on_spend: Callable[[LLMSpend], None] | None = None
+
+
+# Scope -> its spend. The None scope covers any LLM calls made outside of an llm_spend_scope(...).
+_LLM_SPEND_TRACKERS: dict[str | None, _LLMSpendTracker] = {}
+
+_LLM_SPEND_SCOPE: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "llm_spend_scope", default=None
+)
+
+
+@contextlib.contextmanager
+def llm_spend_scope(scope: str):
+    """Count the LLM calls made within this context against the given scope's budget, e.g. each
+    workflow's activities run in a scope of their own so that they don't share a budget."""
+    token = _LLM_SPEND_SCOPE.set(scope)
+    try:
+        yield
+    finally:
+        _LLM_SPEND_SCOPE.reset(token)
+
+
+def configure_llm_budget(
+    budget: LLMBudget | None,
+    on_spend: Callable[[LLMSpend], None] | None = None,
+    scope: str | None = None,
+) -> None:
+    """Start tracking the LLM spend of the scope from scratch, refusing any further LLM calls within
+    it once the budget is exhausted. on_spend is called with the updated spend after every call."""
+    _LLM_SPEND_TRACKERS[scope] = _LLMSpendTracker(spend=LLMSpend(budget=budget), on_spend=on_spend)
+
+
+def clear_llm_budget(scope: str) -> LLMSpend | None:
+    """Stop tracking the LLM spend of the scope once it's done making LLM calls, returning its final
+    spend if it was tracked at all."""
+    tracker = _LLM_SPEND_TRACKERS.pop(scope, None)
+    return tracker.spend.model_copy() if tracker else None
+
+
+def _get_llm_spend_tracker() -> _LLMSpendTracker:
+    # Scopes that were never configured (or were already cleared) share the process-wide tracker, so
+    # that they can't pile up.
+    return _LLM_SPEND_TRACKERS.get(_LLM_SPEND_SCOPE.get()) or _LLM_SPEND_TRACKERS.setdefault(
+        None, _LLMSpendTracker(spend=LLMSpend())
+    )
+
+
+def get_llm_spend() -> LLMSpend:
+    """The LLM spend of the current scope so far."""
+    return _get_llm_spend_tracker().spend.model_copy()
+
+
+def is_llm_budget_low() -> bool:
+    return _get_llm_spend_tracker().spend.is_low()
+
+
 def _show_usage_summary():
     """Show a summary of LLM usage."""
     if _CONFIG.persisted_logs_config is None:
@@ -120,11 +286,27 @@ class LLMError(BaseModel):
         UNEXPECTED_RESPONSE = "UNEXPECTED_RESPONSE"
         RESPONSE_SCHEMA_VALIDATION_FAILED = "RESPONSE_SCHEMA_VALIDATION_FAILED"
         LOGICAL_VALIDATION_FAILED = "LOGICAL_VALIDATION_FAILED"
+        # Only in strict replay mode, see LLMResponseCache.py.
+        CACHE_MISS = "CACHE_MISS"
+        # E.g. the losing side of a hedged request.
+        CANCELLED = "CANCELLED"
+        # The response hit the max output tokens before it was complete.
+        OUTPUT_TRUNCATED = "OUTPUT_TRUNCATED"
+        # Refused without making the call, see LLMBudget.
+        BUDGET_EXHAUSTED = "BUDGET_EXHAUSTED"
 
     err_type: ErrType
 
     msg: str
 
+    # Set for transient errors (rate limits, server errors, timeouts), see agent/llm/rate_limit.py.
+    retryable: bool = False
+    rate_limited: bool = False
+    retry_after_seconds: float | None = None
+
+    # The raw output generated before an OUTPUT_TRUNCATED error, so that it can be continued.
+    truncated_output: str | None = None
+
 
 class Model(enum.StrEnum):
     DYNAMIC_MODEL_CHOICE = "**DYNAMIC_MODEL_CHOICE**"
@@ -135,11 +317,15 @@ class LLMUsage[T]:
     input_tokens: int
     output_tokens: int
     response: Result[T, LLMError]
+    cache_hit: bool = False
+    # Only for providers that support prompt caching.
+    cache_read_input_tokens: int = 0
+    cache_write_input_tokens: int = 0
+    first_token_timestamp: datetime | None = None
 
     def map[U](self, func: Callable[[T], U]) -> "LLMUsage[U]":
-        return LLMUsage[U](
-            input_tokens=self.input_tokens,
-            output_tokens=self.output_tokens,
+        return dataclasses.replace(
+            self,  # type: ignore
             response=(
                 Ok(func(self.response.unwrap()))
                 if self.response.is_ok()
@@ -147,6 +333,20 @@ class LLMUsage[T]:
             ),
         )
 
+    def add_followup[U](self, followup: "LLMUsage[U]") -> "LLMUsage[U]":
+        """Combine this with a followup request made within the same LLM call (e.g. to continue a
+        truncated response), keeping the followup's response."""
+        return LLMUsage(
+            input_tokens=self.input_tokens + followup.input_tokens,
+            output_tokens=self.output_tokens + followup.output_tokens,
+            response=followup.response,
+            cache_read_input_tokens=self.cache_read_input_tokens + followup.cache_read_input_tokens,
+            cache_write_input_tokens=(
+                self.cache_write_input_tokens + followup.cache_write_input_tokens
+            ),
+            first_token_timestamp=self.first_token_timestamp or followup.first_token_timestamp,
+        )
+
 
 def _has_required_str_kwarg(argname: str, func: Callable) -> bool:
     return argname in func.__annotations__ and (
@@ -158,10 +358,79 @@ def _has_required_str_kwarg(argname: str, func: Callable) -> bool:
     )
 
 
+def _add_llm_spend(usage: LLMUsage, pricing: ModelPricing) -> None:
+    if usage.cache_hit or (
+        usage.response.is_err()
+        and usage.response.unwrap_err().err_type == LLMError.ErrType.BUDGET_EXHAUSTED
+    ):
+        return  # Neither of these actually made a call.
+    tracker = _get_llm_spend_tracker()
+    spend = tracker.spend
+    was_low = spend.is_low()
+    spend.num_calls += 1
+    spend.tokens += (
+        usage.input_tokens
+        + usage.output_tokens
+        + usage.cache_read_input_tokens
+        + usage.cache_write_input_tokens
+    )
+    spend.cost += pricing.get_cost(
+        usage.input_tokens,
+        usage.output_tokens,
+        usage.cache_read_input_tokens,
+        usage.cache_write_input_tokens,
+    )
+    if spend.is_low() and not was_low:
+        print(f"LLM budget is running low, falling back to cheaper models: {spend}")
+    if tracker.on_spend:
+        tracker.on_spend(spend.model_copy())
+
+
 P = ParamSpec("P")
 R = TypeVar("R")
 
 
+def enforce_llm_budget(
+    func: Callable[P, Awaitable[LLMUsage[R]]],
+) -> Callable[P, Awaitable[LLMUsage[R]]]:
+    """Admission control: refuse the call without making it once the current scope's budget can't
+    fit even the request's input (see configure_llm_budget(...)). The spend itself is counted by
+    @log_llm_usage(...).
+
+    This must be applied *under* @cache_llm_response(...) so that cache hits are still served for
+    free once the budget is exhausted, e.g.:
+
+        @log_llm_usage(provider=..., model=...)
+        @cache_llm_response(provider=...)
+        @enforce_llm_budget
+        async def prompt(...) -> LLMUsage[...]: ...
+    """
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> LLMUsage[R]:
+        spend = _get_llm_spend_tracker().spend
+        estimated_input_tokens = estimate_request_tokens(kwargs)
+        if spend.is_exhausted(
+            additional_tokens=estimated_input_tokens,
+            additional_cost=get_model_pricing(str(kwargs["model"])).get_cost(
+                estimated_input_tokens, 0
+            ),
+        ):
+            return LLMUsage(
+                input_tokens=0,
+                output_tokens=0,
+                response=Err(
+                    LLMError(
+                        err_type=LLMError.ErrType.BUDGET_EXHAUSTED,
+                        msg=f"Refusing the call, the LLM budget is exhausted: {spend}",
+                    )
+                ),
+            )
+        return await func(*args, **kwargs)
+
+    return wrapper
+
+
 def log_llm_usage(provider: str, model: str | Literal[Model.DYNAMIC_MODEL_CHOICE]):
     def decorator(
         func: Callable[P, Awaitable[LLMUsage[R]]],
@@ -184,10 +453,6 @@ def log_llm_usage(provider: str, model: str | Literal[Model.DYNAMIC_MODEL_CHOICE
                     f"Must call {configure_llm_usage_logging.__name__}(...) to configure LLM usage tracking."  # noqa: E501
                 )
 
-            start_timestamp = datetime.now()
-            result = await func(*args, **kwargs)
-            end_timestamp = datetime.now()
-
             # If the model is dynamic, then we need to extract it from the arguments.
             curr_model: str
             match model:
@@ -196,6 +461,26 @@ def log_llm_usage(provider: str, model: str | Literal[Model.DYNAMIC_MODEL_CHOICE
                 case _:
                     curr_model = model
 
+            start_timestamp = datetime.now()
+            cancelled_error: asyncio.CancelledError | None = None
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError as e:
+                # Still log cancelled calls so that their cost is visible. The provider bills the
+                # input tokens regardless, but the output so far is unknown.
+                cancelled_error = e
+                result = LLMUsage(
+                    input_tokens=estimate_request_tokens(kwargs),
+                    output_tokens=0,
+                    response=Err(
+                        LLMError(
+                            err_type=LLMError.ErrType.CANCELLED, msg="Cancelled before completing."
+                        )
+                    ),
+                )
+            end_timestamp = datetime.now()
+            _add_llm_spend(result, get_model_pricing(curr_model))
+
             # Get the subtask name.
             subtask_name = cast(str, kwargs["subtask_name"])
 
@@ -214,9 +499,16 @@ def log_llm_usage(provider: str, model: str | Literal[Model.DYNAMIC_MODEL_CHOICE
                             input_tokens, 
                             output_tokens,
                             error,
-                            error_msg
+                            error_msg,
+                            cache_hit,
+                            cache_read_input_tokens,
+                            cache_write_input_tokens,
+                            first_token_timestamp,
+                            strategy
                         )
-                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11);
+                        VALUES (
+                            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16
+                        );
                         """,
                         (
                             _CONFIG.persisted_logs_config.execution_id,
@@ -234,9 +526,16 @@ def log_llm_usage(provider: str, model: str | Literal[Model.DYNAMIC_MODEL_CHOICE
                                 else result.response.unwrap_err().err_type
                             ),
                             None if result.response.is_ok() else result.response.unwrap_err().msg,
+                            result.cache_hit,
+                            result.cache_read_input_tokens,
+                            result.cache_write_input_tokens,
+                            result.first_token_timestamp,
+                            _LLM_REQUEST_STRATEGY.get(),
                         ),
                     )
 
+            if cancelled_error:
+                raise cancelled_error
             return result.response
 
         return wrapper
@@ -58,6 +58,27 @@ match environ.get("OPENAI_API_KEY"):
         else:
             raise RuntimeError("Must set OPENAI_API_KEY env variable!")
 
+# See agent/llm/usage/LLMResponseCache.py for the supported modes.
+LLM_RESPONSE_CACHE_MODE: str = environ.get("LLM_RESPONSE_CACHE_MODE", "disabled")
+LLM_RESPONSE_CACHE_DIR: str = environ.get("LLM_RESPONSE_CACHE_DIR", ".llm_response_cache")
+LLM_RESPONSE_CACHE_MAX_SIZE_MB = int(environ.get("LLM_RESPONSE_CACHE_MAX_SIZE_MB", "500"))
+LLM_RESPONSE_CACHE_MAX_AGE_DAYS = int(environ.get("LLM_RESPONSE_CACHE_MAX_AGE_DAYS", "30"))
+
+# E.g. http://localhost:8090 to scrape and submit against agent/adventofcode/fake_aoc_server.py.
+AOC_BASE_URL: str = environ.get("AOC_BASE_URL", "https://adventofcode.com").rstrip("/")
+
+# E.g. http://localhost:8089 to send all the LLM requests to agent/llm/fake/server.py instead.
+FAKE_LLM_SERVER_URL: str | None = environ.get("FAKE_LLM_SERVER_URL")
+
+# Generated images, keyed by the hash of their image generation prompt.
+IMAGE_CACHE_DIR: str = environ.get("IMAGE_CACHE_DIR", ".image_cache")
+
+# E.g. 0.9 to hedge LLM requests that are slower than 90% of their history. Unset disables hedging.
+LLM_HEDGING_PERCENTILE: float | None = None
+match environ.get("LLM_HEDGING_PERCENTILE"):
+    case str(percentile):
+        LLM_HEDGING_PERCENTILE = float(percentile)
+
 TEMPORAL_HOST = "localhost"  # TODO: Need different val for dev/prod.
 TEMPORAL_PORT = "7233"
 TEMPORAL_NAMESPACE = "default"  # TODO: Need different val for dev/prod.
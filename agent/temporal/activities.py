@@ -1,24 +1,44 @@
 from pathlib import Path
 import aiohttp
+import asyncio
 import os
+import time
 from pydantic import BaseModel
 from result import Err, Ok
 from temporalio import activity
+from temporalio.client import Client
+from temporalio.service import RPCError
+from temporalio.worker import (
+    ActivityInboundInterceptor,
+    ExecuteActivityInput,
+    Interceptor,
+)
+from typing import Any, Callable
 
 from agent.adventofcode import (
     AoCProblem,
     AoCProblemExtractedExamples,
     ExamplesContext,
+    ExtractedExamplesWithContext,
     FileToCommit,
+    InputProfile,
     contextualize_examples,
     execute_generated_solution,
     execute_tests,
     extract_examples_from_problem_html,
+    extract_examples_with_context,
     generate_implementation,
+    get_cached_problem_digest,
+    profile_input,
     write_and_commit_changes,
 )
 from agent.adventofcode.debug.RefactoringPlan import RefactoringPlan
-from agent.adventofcode.debug.debug_errors import theorize_solution, get_refactoring_plan
+from agent.adventofcode.debug.debug_errors import (
+    DirectDebugFixOutput,
+    get_direct_debug_fix,
+    get_refactoring_plan,
+    theorize_solution,
+)
 from agent.adventofcode.debug.DebuggingPrompt import DebuggingPrompt
 from agent.adventofcode.debug.TheorizedSolution import TheorizedSolution
 from agent.adventofcode.execute_generated_code import TestResults
@@ -29,6 +49,8 @@ from agent.adventofcode.generate_aoc_story_images import (
 )
 from agent.adventofcode.generate_code.generate_implementation import (
     GenerateImplementationOutput,
+    generate_incremental_part_2_implementation,
+    reconcile_speculative_implementation,
 )
 from agent.adventofcode.generate_code.generate_unit_tests import (
     GenerateUnitTestsOutput,
@@ -38,23 +60,135 @@ from agent.adventofcode.generate_code.GeneratedImplementation import (
     GeneratedImplementation,
 )
 from agent.adventofcode.generate_code.GeneratedUnitTests import GeneratedUnitTests
+from agent.adventofcode.generate_code.part_1_regression_tests import (
+    get_part_1_regression_tests_file_content,
+)
+from agent.adventofcode.load_existing_artifacts import ExistingArtifacts, load_existing_artifacts
 from agent.adventofcode.scrape_problems import fetch_input, scrape_aoc
 from agent.adventofcode.submit_solution import submit
-from agent.llm.openai.generate_image import download_image, generate_image_to_url
-from agent.llm.usage.LLMUsage import configure_llm_usage_logging
+from agent.llm.openai.generate_image import generate_image
+from agent.llm.router import clear_model_routing, configure_model_routing, model_routing_scope
+from agent.llm.usage.LLMUsage import (
+    LLMBudget,
+    LLMSpend,
+    clear_llm_budget,
+    configure_llm_budget,
+    configure_llm_usage_logging,
+    llm_spend_scope,
+)
 
 
 class ConfigureLLMUsageLoggingArgs(BaseModel):
     year: int
     day: int
     log_dir: str
+    # Pick each subtask's model based on the llm_usage history rather than always the default.
+    llm_routing: bool = True
+    # Subtask name -> model to always use for it in this run.
+    llm_overrides: dict[str, str] = {}
+    # Refuse any further LLM calls once either of these has been spent, see LLMBudget.
+    max_llm_tokens: int | None = None
+    max_llm_cost: float | None = None
+
+
+# The workflow receives the LLM spend on this signal as soon as it crosses the low or exhausted
+# budget threshold, and otherwise at most every _LLM_SPEND_REPORT_INTERVAL_SECONDS.
+REPORT_LLM_SPEND_SIGNAL = "report_llm_spend"
+_LLM_SPEND_REPORT_INTERVAL_SECONDS = 30
+
+# The worker's own client, which the LLM spend reports get sent with.
+_TEMPORAL_CLIENT: Client | None = None
+
+# Keep references to the in-flight reports so that they don't get garbage collected.
+_LLM_SPEND_REPORTS: set[asyncio.Task] = set()
+
+
+def configure_llm_spend_reports(client: Client) -> None:
+    global _TEMPORAL_CLIENT
+    _TEMPORAL_CLIENT = client
 
 
 @activity.defn
 async def configure_llm_usage_logging_for_workflow(args: ConfigureLLMUsageLoggingArgs) -> None:
+    budget = (
+        LLMBudget(max_tokens=args.max_llm_tokens, max_cost=args.max_llm_cost)
+        if args.max_llm_tokens is not None or args.max_llm_cost is not None
+        else None
+    )
     configure_llm_usage_logging(
         execution_name=f"AgentOfCode-{args.year}-{args.day}", log_dir=Path(args.log_dir)
     )
+    # Each workflow gets a budget and routing config of its own, see LLMScopeInterceptor.
+    workflow_id = activity.info().workflow_id
+    configure_llm_budget(
+        budget,
+        on_spend=(
+            _get_llm_spend_reporter(_TEMPORAL_CLIENT, workflow_id=workflow_id)
+            if _TEMPORAL_CLIENT
+            else None
+        ),
+        scope=workflow_id,
+    )
+    # The routing is driven by the usage logs, so it's configured along with them.
+    configure_model_routing(
+        enabled=args.llm_routing, overrides=args.llm_overrides, scope=workflow_id
+    )
+
+
+@activity.defn
+async def clear_llm_config_for_workflow() -> LLMSpend | None:
+    # The workflow is done making LLM calls, so there's no need to hang onto its config anymore. Its
+    # final spend is returned since the last report may well predate it.
+    workflow_id = activity.info().workflow_id
+    clear_model_routing(workflow_id)
+    return clear_llm_budget(workflow_id)
+
+
+def _get_llm_spend_reporter(client: Client, workflow_id: str) -> Callable[[LLMSpend], None]:
+    # The workflow has no other way to see what the LLM calls within its activities cost.
+    async def report(spend: LLMSpend) -> None:
+        try:
+            await client.get_workflow_handle(workflow_id).signal(REPORT_LLM_SPEND_SIGNAL, spend)
+        except RPCError as e:
+            print(f"Failed to report the LLM spend to workflow {workflow_id}: {e}")
+
+    last_report: tuple[float, LLMSpend] | None = None
+
+    def on_spend(spend: LLMSpend) -> None:
+        nonlocal last_report
+        # A signal per LLM call would flood the workflow's history, and the workflow only really
+        # needs to know once the budget runs low or out.
+        if last_report is not None:
+            last_report_time, last_spend = last_report
+            if (
+                spend.is_low() == last_spend.is_low()
+                and spend.is_exhausted() == last_spend.is_exhausted()
+                and time.monotonic() - last_report_time < _LLM_SPEND_REPORT_INTERVAL_SECONDS
+            ):
+                return
+        last_report = (time.monotonic(), spend)
+        # Don't hold up the LLM call on the report.
+        task = asyncio.create_task(report(spend))
+        _LLM_SPEND_REPORTS.add(task)
+        task.add_done_callback(_LLM_SPEND_REPORTS.discard)
+
+    return on_spend
+
+
+class LLMScopeInterceptor(Interceptor):
+    """Count the LLM calls made by each activity against its workflow's own budget, and route them
+    by its workflow's own config, since the concurrent workflows on a worker would otherwise all
+    share one."""
+
+    def intercept_activity(self, next: ActivityInboundInterceptor) -> ActivityInboundInterceptor:
+        return _LLMScopeActivityInboundInterceptor(next)
+
+
+class _LLMScopeActivityInboundInterceptor(ActivityInboundInterceptor):
+    async def execute_activity(self, input: ExecuteActivityInput) -> Any:
+        workflow_id = activity.info().workflow_id
+        with llm_spend_scope(workflow_id), model_routing_scope(workflow_id):
+            return await super().execute_activity(input)
 
 
 class ExtractProblemPartArgs(BaseModel):
@@ -64,7 +198,10 @@ class ExtractProblemPartArgs(BaseModel):
 
 class ExtractedProblemPart(BaseModel):
     problem_html: str
+    # A compact Markdown rendering of the problem HTML that all prompts should use instead.
+    problem_digest: str
     problem_input: str
+    input_profile: InputProfile
 
 
 @activity.defn
@@ -74,36 +211,57 @@ async def extract_problem_part(args: ExtractProblemPartArgs) -> ExtractedProblem
     os.makedirs(part_solutions_dir, exist_ok=True)
 
     async with aiohttp.ClientSession() as session:
+        problem_html = await scrape_aoc(
+            session=session,
+            year=args.aoc_problem.year,
+            day=args.aoc_problem.day,
+            part=args.aoc_problem.part,
+            # Cache to `advent_of_code/year*/day*/part*/` dir, since this will NOT be shared
+            # between part1 and part2.
+            solutions_dir=part_solutions_dir,
+        )
+        problem_input = await fetch_input(
+            session=session,
+            year=args.aoc_problem.year,
+            day=args.aoc_problem.day,
+            # Intentionally cache to top level `advent_of_code/year*/day*/` dir, since this will
+            # be shared between part1 and part2.
+            solutions_dir=args.solutions_dir,
+        )
         return ExtractedProblemPart(
-            problem_html=await scrape_aoc(
-                session=session,
-                year=args.aoc_problem.year,
-                day=args.aoc_problem.day,
-                part=args.aoc_problem.part,
-                # Cache to `advent_of_code/year*/day*/part*/` dir, since this will NOT be shared
-                # between part1 and part2.
-                solutions_dir=part_solutions_dir,
-            ),
-            problem_input=await fetch_input(
-                session=session,
-                year=args.aoc_problem.year,
-                day=args.aoc_problem.day,
-                # Intentionally cache to top level `advent_of_code/year*/day*/` dir, since this will
-                # be shared between part1 and part2.
-                solutions_dir=args.solutions_dir,
+            problem_html=problem_html,
+            problem_digest=get_cached_problem_digest(
+                problem_html=problem_html, part_solutions_dir=part_solutions_dir
             ),
+            problem_input=problem_input,
+            input_profile=profile_input(problem_input),
         )
 
 
 class ExtractExamplesArgs(BaseModel):
     extracted_problem_part: ExtractedProblemPart
     solve_part_2: bool
+    # Number of concurrent extractions to vote over.
+    num_samples: int = 1
 
 
 @activity.defn
 async def extract_examples(args: ExtractExamplesArgs) -> AoCProblemExtractedExamples:
     return await extract_examples_from_problem_html(
-        problem_html=args.extracted_problem_part.problem_html, solve_part_2=args.solve_part_2
+        problem_html=args.extracted_problem_part.problem_digest,
+        solve_part_2=args.solve_part_2,
+        num_samples=args.num_samples,
+    )
+
+
+@activity.defn
+async def get_examples_with_context(
+    args: ExtractExamplesArgs,
+) -> ExtractedExamplesWithContext:
+    return await extract_examples_with_context(
+        problem_html=args.extracted_problem_part.problem_digest,
+        solve_part_2=args.solve_part_2,
+        num_samples=args.num_samples,
     )
 
 
@@ -116,7 +274,7 @@ class GetExamplesContextArgs(BaseModel):
 @activity.defn
 async def get_examples_context(args: GetExamplesContextArgs) -> ExamplesContext:
     return await contextualize_examples(
-        problem_html=args.extracted_problem_part.problem_html,
+        problem_html=args.extracted_problem_part.problem_digest,
         examples=args.extracted_examples,
         solve_part_2=args.solve_part_2,
     )
@@ -126,6 +284,7 @@ class GetGeneratedUnitTestsArgs(BaseModel):
     examples: AoCProblemExtractedExamples
     examples_context: ExamplesContext
     debugging_prompt: DebuggingPrompt | None = None
+    resumed_unit_tests: GeneratedUnitTests | None = None
 
 
 @activity.defn
@@ -134,15 +293,19 @@ async def get_generated_unit_tests(args: GetGeneratedUnitTestsArgs) -> GenerateU
         examples=args.examples,
         examples_context=args.examples_context,
         debugging_prompt=args.debugging_prompt,
+        resumed_unit_tests=args.resumed_unit_tests,
     )
 
 
 class GetGeneratedImplementationArgs(BaseModel):
     extracted_problem_part: ExtractedProblemPart
-    examples_context: ExamplesContext
+    # Left unset to speculatively generate a draft implementation before the examples context is
+    # available.
+    examples_context: ExamplesContext | None
     solve_part_2: bool
     part_1_generated_implementation: GenerateImplementationOutput | None = None
     debugging_prompt: DebuggingPrompt | None = None
+    resumed_implementation: GeneratedImplementation | None = None
 
 
 @activity.defn
@@ -150,14 +313,77 @@ async def get_generated_implementation(
     args: GetGeneratedImplementationArgs,
 ) -> GenerateImplementationOutput:
     return await generate_implementation(
-        problem_html=args.extracted_problem_part.problem_html,
+        problem_html=args.extracted_problem_part.problem_digest,
         examples_context=args.examples_context,
         solve_part_2=args.solve_part_2,
         part_1_generated_implementation=args.part_1_generated_implementation,
         debugging_prompt=args.debugging_prompt,
+        input_profile=args.extracted_problem_part.input_profile,
+        resumed_implementation=args.resumed_implementation,
     )
 
 
+class ReconcileSpeculativeImplementationArgs(BaseModel):
+    extracted_problem_part: ExtractedProblemPart
+    speculative_implementation: GenerateImplementationOutput
+    examples_context: ExamplesContext
+    solve_part_2: bool
+    part_1_generated_implementation: GenerateImplementationOutput | None = None
+
+
+@activity.defn
+async def reconcile_speculative_impl(
+    args: ReconcileSpeculativeImplementationArgs,
+) -> GenerateImplementationOutput:
+    return await reconcile_speculative_implementation(
+        speculative_implementation=args.speculative_implementation,
+        problem_html=args.extracted_problem_part.problem_digest,
+        examples_context=args.examples_context,
+        solve_part_2=args.solve_part_2,
+        part_1_generated_implementation=args.part_1_generated_implementation,
+        input_profile=args.extracted_problem_part.input_profile,
+    )
+
+
+class GetIncrementalPart2ImplementationArgs(BaseModel):
+    extracted_problem_part: ExtractedProblemPart
+    examples_with_context: ExtractedExamplesWithContext
+    part_1_examples_with_context: ExtractedExamplesWithContext | None
+    part_1_unit_tests: GeneratedUnitTests
+    part_1_generated_implementation: GenerateImplementationOutput
+
+
+class IncrementalPart2Implementation(BaseModel):
+    implementation: GenerateImplementationOutput
+    part_1_regression_tests_file_content: str
+
+
+@activity.defn
+async def get_incremental_part_2_impl(
+    args: GetIncrementalPart2ImplementationArgs,
+) -> IncrementalPart2Implementation:
+    implementation = await generate_incremental_part_2_implementation(
+        problem_html=args.extracted_problem_part.problem_digest,
+        examples_context=args.examples_with_context.examples_context,
+        part_1_generated_implementation=args.part_1_generated_implementation,
+        input_profile=args.extracted_problem_part.input_profile,
+    )
+    return IncrementalPart2Implementation(
+        implementation=implementation,
+        part_1_regression_tests_file_content=get_part_1_regression_tests_file_content(
+            part_1_examples_with_context=args.part_1_examples_with_context,
+            part_1_unit_tests=args.part_1_unit_tests,
+            part_2_examples_with_context=args.examples_with_context,
+            part_2_implementation=implementation.generated_implementation,
+        ),
+    )
+
+
+@activity.defn
+async def load_existing_part_artifacts(part_solutions_dir: str) -> ExistingArtifacts:
+    return load_existing_artifacts(part_solutions_dir)
+
+
 class CommitChangesArgs(BaseModel):
     aoc_problem: AoCProblem
     files: list[FileToCommit]
@@ -179,14 +405,27 @@ async def commit_changes(
     )
 
 
+class RunGeneratedCodeArgs(BaseModel):
+    aoc_problem: AoCProblem
+    # The problem part's dir that the generated tests and implementation were committed to.
+    solutions_dir: str
+
+
 @activity.defn
-async def run_generated_tests(aoc_problem: AoCProblem) -> TestResults:
-    return execute_tests(year=aoc_problem.year, day=aoc_problem.day, part=aoc_problem.part)
+async def run_generated_tests(args: RunGeneratedCodeArgs) -> TestResults:
+    return execute_tests(
+        year=args.aoc_problem.year,
+        day=args.aoc_problem.day,
+        part=args.aoc_problem.part,
+        part_solutions_dir=args.solutions_dir,
+    )
 
 
 class GeneratedSolutionRes(BaseModel):
     class Success(BaseModel):
         output: str
+        # Whether AoC accepted the output, which is only known once the workflow has submitted it.
+        accepted: bool = False
 
     class Failure(BaseModel):
         exit_code: int
@@ -197,10 +436,13 @@ class GeneratedSolutionRes(BaseModel):
 
 @activity.defn
 async def run_generated_solution(
-    aoc_problem: AoCProblem,
+    args: RunGeneratedCodeArgs,
 ) -> GeneratedSolutionRes:
     match execute_generated_solution(
-        year=aoc_problem.year, day=aoc_problem.day, part=aoc_problem.part
+        year=args.aoc_problem.year,
+        day=args.aoc_problem.day,
+        part=args.aoc_problem.part,
+        part_solutions_dir=args.solutions_dir,
     ):
         case Ok(output):
             return GeneratedSolutionRes(result=GeneratedSolutionRes.Success(output=output))
@@ -231,6 +473,27 @@ async def debug_unit_test_failures(args: DebugUnitTestFailuresArgs) -> Theorized
     )
 
 
+class DirectFixUnitTestFailuresArgs(BaseModel):
+    problem_html: str
+    examples_context: ExamplesContext
+    unit_tests: GenerateUnitTestsOutput
+    implementation: GenerateImplementationOutput
+    error_msg: str
+
+
+@activity.defn
+async def direct_fix_unit_test_failures(
+    args: DirectFixUnitTestFailuresArgs,
+) -> DirectDebugFixOutput:
+    return await get_direct_debug_fix(
+        problem_html=args.problem_html,
+        examples_context=args.examples_context,
+        unit_tests=args.unit_tests,
+        implementation=args.implementation,
+        error_msg=args.error_msg,
+    )
+
+
 class PlanImplRefactoringArgs(BaseModel):
     examples: AoCProblemExtractedExamples
     examples_context: ExamplesContext
@@ -286,7 +549,7 @@ class GenerateCelebratoryImageArgs(BaseModel):
 
 @activity.defn
 async def generate_celebratory_image(args: GenerateCelebratoryImageArgs) -> None:
-    await download_image(
-        await generate_image_to_url(args.image_generation_prompt),
+    await generate_image(
+        args.image_generation_prompt,
         os.path.join(args.solutions_dir, "generated_aoc_story_image.png"),
     )
@@ -13,14 +13,74 @@ from agent.temporal.workflow import (
 )
 
 
+def _parse_model_overrides(
+    ctx: click.Context, param: click.Parameter, model_overrides: tuple[str, ...]
+) -> dict[str, str]:
+    llm_overrides = {}
+    for model_override in model_overrides:
+        subtask_name, sep, model = model_override.partition("=")
+        if not sep or not subtask_name or not model:
+            raise click.BadParameter(
+                f"Expected SUBTASK=MODEL, e.g. extract-examples=gemini-1.5-flash, got {model_override!r}."  # noqa: E501
+            )
+        llm_overrides[subtask_name] = model
+    return llm_overrides
+
+
 @click.command()
 @click.option("--year", required=True)
 @click.option("--day", required=True)
 @click.option("--dry-run", default=False, is_flag=True)
+@click.option(
+    "--speculative-implementation/--no-speculative-implementation",
+    default=True,
+    help="Start drafting the implementation before the examples have been contextualized.",
+)
+@click.option(
+    "--incremental-part-2/--no-incremental-part-2",
+    default=True,
+    help="Solve part 2 by editing the passing part 1 implementation instead of from scratch.",
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    help="Pick up from the tests and implementation already committed by a previous run.",
+)
+@click.option(
+    "--model-routing/--no-model-routing",
+    default=True,
+    help="Pick each subtask's model based on how the models have fared for it historically.",
+)
+@click.option(
+    "--model-override",
+    "model_overrides",
+    multiple=True,
+    callback=_parse_model_overrides,
+    help="Always use the given model for a subtask in this run, e.g. extract-examples=gemini-1.5-flash.",  # noqa: E501
+)
+@click.option(
+    "--max-llm-tokens",
+    type=int,
+    default=None,
+    help="Refuse any further LLM calls once this many tokens have been spent.",
+)
+@click.option(
+    "--max-llm-cost",
+    type=float,
+    default=None,
+    help="Refuse any further LLM calls once this many USD have been spent.",
+)
 async def main(
     year: int,
     day: int,
     dry_run: bool,
+    speculative_implementation: bool,
+    incremental_part_2: bool,
+    resume: bool,
+    model_routing: bool,
+    model_overrides: dict[str, str],
+    max_llm_tokens: int | None,
+    max_llm_cost: float | None,
 ) -> None:
     # Need to get the path to the dir where solutions should be written. Implementing this to work
     # on various machines.
@@ -41,8 +101,9 @@ async def main(
     # Create a client.
     client = await get_temporal_client()
 
-    # Start the workflow.
-    result = await client.execute_workflow(
+    # Start the workflow. While it runs, its LLM spend as of the last report can be checked with:
+    #   temporal workflow query --workflow-id solve-aoc-problem-{year}-{day} --type get_llm_spend
+    handle = await client.start_workflow(
         SolveAoCProblemWorkflow.run,
         SolveAoCProblemWorkflowArgs(
             year=year,
@@ -50,10 +111,19 @@ async def main(
             solutions_dir=aoc_solutions_dir,
             log_dir=llm_usage_log_dir,
             dry_run=dry_run,
+            speculative_implementation=speculative_implementation,
+            incremental_part_2=incremental_part_2,
+            resume=resume,
+            llm_routing=model_routing,
+            llm_overrides=model_overrides,
+            max_llm_tokens=max_llm_tokens,
+            max_llm_cost=max_llm_cost,
         ),
         id=f"solve-aoc-problem-{year}-{day}",
         task_queue=settings.TEMPORAL_TASK_QUEUE_NAME,
     )
+    result = await handle.result()
+    click.echo(f"LLM spend: {await handle.query(SolveAoCProblemWorkflow.get_llm_spend)}")
 
     # Generate a celebratory image to remember the problem by!
     if result.celebratory_image_generation_context:
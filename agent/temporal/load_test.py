@@ -0,0 +1,423 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import asyncclick as click
+import duckdb
+from aiohttp import web
+from temporalio.client import Client
+
+from agent import settings
+from agent.adventofcode.fake_aoc_server import FakeAoCServerConfig, get_fake_aoc_server_app
+from agent.llm.fake.server import FakeLLMServerConfig, get_fake_llm_server_app
+from agent.temporal.activities import GeneratedSolutionRes
+from agent.temporal.client import get_temporal_client
+from agent.temporal.workflow import SolveAoCProblemWorkflow, SolveAoCProblemWorkflowArgs
+
+_RESOURCE_SAMPLE_INTERVAL_SECONDS = 0.5
+
+
+@dataclass
+class _ResourceUsage:
+    cpu_seconds: float = 0.0
+    peak_rss_bytes: int = 0
+
+
+def _read_proc_resource_usage(pid: int) -> _ResourceUsage:
+    """The CPU time (including reaped child processes, e.g. the generated code being run) and the
+    current RSS of the process, straight from /proc."""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces, so only split after it.
+        stat = f.read().rsplit(")", 1)[1].split()
+    # utime, stime, cutime and cstime are the 14th-17th fields, counting the pid and command name.
+    cpu_ticks = sum(int(ticks) for ticks in stat[11:15])
+    with open(f"/proc/{pid}/status") as f:
+        rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    return _ResourceUsage(
+        cpu_seconds=cpu_ticks / os.sysconf("SC_CLK_TCK"), peak_rss_bytes=rss_kb * 1024
+    )
+
+
+@dataclass
+class _ResourceSampler:
+    pid: int
+    usage: _ResourceUsage = field(default_factory=_ResourceUsage)
+
+    async def sample_until_cancelled(self) -> None:
+        start_cpu_seconds = _read_proc_resource_usage(self.pid).cpu_seconds
+        while True:
+            current = _read_proc_resource_usage(self.pid)
+            self.usage = _ResourceUsage(
+                cpu_seconds=current.cpu_seconds - start_cpu_seconds,
+                peak_rss_bytes=max(self.usage.peak_rss_bytes, current.peak_rss_bytes),
+            )
+            await asyncio.sleep(_RESOURCE_SAMPLE_INTERVAL_SECONDS)
+
+
+@dataclass(frozen=True)
+class _ActivityLatency:
+    workflow_id: str
+    activity_type: str
+    # Measured from scheduling to completion so that time spent queued behind a saturated worker
+    # counts too. This includes any retries.
+    latency_seconds: float
+
+
+async def _get_activity_latencies(client: Client, workflow_id: str) -> list[_ActivityLatency]:
+    scheduled: dict[int, tuple[str, datetime]] = {}
+    latencies = []
+    async for event in client.get_workflow_handle(workflow_id).fetch_history_events():
+        if event.HasField("activity_task_scheduled_event_attributes"):
+            scheduled[event.event_id] = (
+                event.activity_task_scheduled_event_attributes.activity_type.name,
+                event.event_time.ToDatetime(),
+            )
+        elif event.HasField("activity_task_completed_event_attributes"):
+            activity_type, scheduled_time = scheduled[
+                event.activity_task_completed_event_attributes.scheduled_event_id
+            ]
+            latencies.append(
+                _ActivityLatency(
+                    workflow_id=workflow_id,
+                    activity_type=activity_type,
+                    latency_seconds=(
+                        event.event_time.ToDatetime() - scheduled_time
+                    ).total_seconds(),
+                )
+            )
+    return latencies
+
+
+async def _run_workflow(
+    client: Client,
+    workflow_id: str,
+    year: int,
+    day: int,
+    log_dir: str,
+    workflow_timeout: timedelta,
+) -> bool:
+    """Whether AoC (i.e. the fake AoC server) accepted the workflow's answers to both parts."""
+    try:
+        result = await client.execute_workflow(
+            SolveAoCProblemWorkflow.run,
+            SolveAoCProblemWorkflowArgs(
+                year=year,
+                day=day,
+                # Every workflow gets its own dir, which its generated tests and solution are also
+                # run from, so that they don't resume from or clobber each other's work.
+                solutions_dir=tempfile.mkdtemp(prefix=f"{workflow_id}-"),
+                log_dir=log_dir,
+                # Never commit anything.
+                dry_run=True,
+            ),
+            id=workflow_id,
+            task_queue=settings.TEMPORAL_TASK_QUEUE_NAME,
+            execution_timeout=workflow_timeout,
+        )
+    except Exception as e:
+        print(f"Workflow {workflow_id} failed: {e}")
+        return False
+    # The workflow gives up on a part without failing outright, returning the last answer it tried.
+    if not all(
+        solution is not None
+        and isinstance(solution.result, GeneratedSolutionRes.Success)
+        and solution.result.accepted
+        for solution in (result.part_1_solution, result.part_2_solution)
+    ):
+        print(f"Workflow {workflow_id} didn't solve the problem: {result}")
+        return False
+    return True
+
+
+def _configure_results_db(results_db: str) -> None:
+    with duckdb.connect(results_db) as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS load_test_runs (
+                run_id VARCHAR NOT NULL,
+                label VARCHAR NOT NULL,
+                worker_args VARCHAR NOT NULL,
+                concurrency INTEGER NOT NULL,
+                start_timestamp TIMESTAMP NOT NULL,
+                wall_seconds DOUBLE NOT NULL,
+                num_succeeded INTEGER NOT NULL,
+                num_failed INTEGER NOT NULL,
+                workflows_per_minute DOUBLE NOT NULL,
+                -- Averaged over the whole step, so 100% is one core fully busy.
+                worker_cpu_percent DOUBLE NOT NULL,
+                worker_peak_rss_mb DOUBLE NOT NULL,
+                PRIMARY KEY (run_id, concurrency)
+            );
+            CREATE TABLE IF NOT EXISTS load_test_activity_latencies (
+                run_id VARCHAR NOT NULL,
+                concurrency INTEGER NOT NULL,
+                workflow_id VARCHAR NOT NULL,
+                activity_type VARCHAR NOT NULL,
+                latency_seconds DOUBLE NOT NULL
+            );
+            """
+        )
+
+
+async def _run_load_test_step(
+    client: Client,
+    run_id: str,
+    concurrency: int,
+    year: int,
+    day: int,
+    worker_pid: int,
+    workflow_timeout: timedelta,
+) -> tuple[float, list[bool], _ResourceUsage, list[_ActivityLatency]]:
+    # All the workflows share the usage logs, since DuckDB logging is one of the suspects.
+    log_dir = tempfile.mkdtemp(prefix=f"load-test-{run_id}-{concurrency}-logs-")
+    workflow_ids = [f"load-test-{run_id}-{concurrency}-{i}" for i in range(concurrency)]
+
+    sampler = _ResourceSampler(pid=worker_pid)
+    sampler_task = asyncio.create_task(sampler.sample_until_cancelled())
+    start = time.monotonic()
+    try:
+        succeeded = await asyncio.gather(
+            *(
+                _run_workflow(client, workflow_id, year, day, log_dir, workflow_timeout)
+                for workflow_id in workflow_ids
+            )
+        )
+    finally:
+        sampler_task.cancel()
+    wall_seconds = time.monotonic() - start
+
+    activity_latencies = [
+        latency
+        for workflow_latencies in await asyncio.gather(
+            *(_get_activity_latencies(client, workflow_id) for workflow_id in workflow_ids)
+        )
+        for latency in workflow_latencies
+    ]
+    return wall_seconds, succeeded, sampler.usage, activity_latencies
+
+
+def _show_report(results_db: str, run_id: str) -> None:
+    with duckdb.connect(results_db) as conn:
+        print("\nWorkflow throughput and worker resource usage:")
+        conn.sql(
+            """
+            SELECT
+                concurrency,
+                num_succeeded,
+                num_failed,
+                round(wall_seconds, 1) AS wall_seconds,
+                round(workflows_per_minute, 2) AS workflows_per_minute,
+                round(worker_cpu_percent, 1) AS worker_cpu_percent,
+                round(worker_peak_rss_mb, 1) AS worker_peak_rss_mb
+            FROM load_test_runs
+            WHERE run_id = $1
+            ORDER BY concurrency;
+            """,
+            params=[run_id],
+        ).show()
+        print("Activity latency percentiles (seconds, scheduled to completed):")
+        conn.sql(
+            """
+            SELECT
+                activity_type,
+                concurrency,
+                count(*) AS n,
+                round(quantile_cont(latency_seconds, 0.5), 2) AS p50,
+                round(quantile_cont(latency_seconds, 0.95), 2) AS p95,
+                round(quantile_cont(latency_seconds, 0.99), 2) AS p99
+            FROM load_test_activity_latencies
+            WHERE run_id = $1
+            GROUP BY activity_type, concurrency
+            ORDER BY activity_type, concurrency;
+            """,
+            params=[run_id],
+        ).show(max_rows=1000)
+
+
+async def _start_fake_server(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "localhost", port).start()
+    return runner
+
+
+@click.command()
+@click.option("--year", required=True, type=int)
+@click.option(
+    "--day",
+    required=True,
+    type=int,
+    help="Every workflow solves this day, so it must be in the AoC fixtures dir.",
+)
+@click.option(
+    "--concurrency",
+    "concurrencies",
+    multiple=True,
+    type=int,
+    default=[1, 2, 4, 8],
+    show_default=True,
+    help="The numbers of concurrent workflows to sweep over.",
+)
+@click.option(
+    "--label",
+    default="default",
+    help="Name for the worker configuration under test, to compare runs by.",
+)
+@click.option(
+    "--worker-arg",
+    "worker_args",
+    multiple=True,
+    help="Extra args to start the worker with, e.g. --worker-arg=--llm-hedge-percentile=0.9",
+)
+@click.option("--results-db", default="load_test_results.db", show_default=True)
+@click.option("--aoc-fixtures-dir", default="advent_of_code", show_default=True)
+@click.option(
+    "--llm-fixtures",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="JSON list of FakeResponseFixture to script the fake LLM server's responses with.",
+)
+@click.option(
+    "--llm-recordings-dir",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    help="Replay the responses recorded by the LLM response cache, e.g. .llm_response_cache",
+)
+@click.option("--fake-llm-port", default=8089, type=int)
+@click.option("--fake-aoc-port", default=8090, type=int)
+@click.option("--llm-median-latency-seconds", default=1.0, type=float)
+@click.option("--llm-output-tokens-per-second", default=100.0, type=float)
+@click.option("--llm-error-rate", default=0.0, type=float)
+@click.option("--workflow-timeout-minutes", default=30, type=int)
+async def _cmd(
+    year: int,
+    day: int,
+    concurrencies: tuple[int, ...],
+    label: str,
+    worker_args: tuple[str, ...],
+    results_db: str,
+    aoc_fixtures_dir: str,
+    llm_fixtures: Path | None,
+    llm_recordings_dir: Path | None,
+    fake_llm_port: int,
+    fake_aoc_port: int,
+    llm_median_latency_seconds: float,
+    llm_output_tokens_per_second: float,
+    llm_error_rate: float,
+    workflow_timeout_minutes: int,
+) -> None:
+    """Sweep over numbers of concurrent SolveAoCProblemWorkflow runs against a single worker, with
+    the LLM providers and AoC served by local fakes, and report how the worker holds up.
+
+    This expects a local Temporal dev server to already be running (`temporal server start-dev`).
+    The worker is started as a subprocess so that its own CPU and RSS can be measured.
+
+    Without --llm-fixtures or --llm-recordings-dir, the fake LLM server can only make up responses,
+    which won't actually solve anything. If none of the workflows at some concurrency solve the
+    problem then the load test fails, since its numbers would only measure the failure path.
+    """
+    run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+    _configure_results_db(results_db)
+
+    fake_servers = [
+        await _start_fake_server(
+            get_fake_llm_server_app(
+                FakeLLMServerConfig(
+                    median_latency_seconds=llm_median_latency_seconds,
+                    output_tokens_per_second=llm_output_tokens_per_second,
+                    error_rate=llm_error_rate,
+                ),
+                fixtures_file=llm_fixtures,
+                recordings_dir=llm_recordings_dir,
+            ),
+            fake_llm_port,
+        ),
+        await _start_fake_server(
+            get_fake_aoc_server_app(
+                # The concurrent workflows all submit answers for the same day, so don't have them
+                # lock each other out after every wrong answer.
+                FakeAoCServerConfig(fixtures_dir=aoc_fixtures_dir, wrong_answer_timeout_seconds=0)
+            ),
+            fake_aoc_port,
+        ),
+    ]
+    worker = subprocess.Popen(
+        [sys.executable, "-m", "agent.temporal.worker", *worker_args],
+        env={
+            **os.environ,
+            "FAKE_LLM_SERVER_URL": f"http://localhost:{fake_llm_port}",
+            "AOC_BASE_URL": f"http://localhost:{fake_aoc_port}",
+            # Every request should actually go through to the fake servers.
+            "LLM_RESPONSE_CACHE_MODE": "disabled",
+            "IMAGE_CACHE_DIR": tempfile.mkdtemp(prefix="load-test-images-"),
+        },
+    )
+    try:
+        client = await get_temporal_client()
+        for concurrency in sorted(concurrencies):
+            print(f"Running {concurrency} concurrent workflows...")
+            start_timestamp = datetime.now()
+            wall_seconds, succeeded, usage, activity_latencies = await _run_load_test_step(
+                client,
+                run_id,
+                concurrency,
+                year,
+                day,
+                worker.pid,
+                timedelta(minutes=workflow_timeout_minutes),
+            )
+            if not any(succeeded):
+                raise click.ClickException(
+                    f"None of the {concurrency} concurrent workflows solved the problem, so "
+                    "there's nothing worth reporting. Check the worker's logs, and the fake LLM "
+                    "responses (--llm-fixtures / --llm-recordings-dir)."
+                )
+            with duckdb.connect(results_db) as conn:
+                conn.execute(
+                    "INSERT INTO load_test_runs VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11);",  # noqa: E501
+                    [
+                        run_id,
+                        label,
+                        json.dumps(worker_args),
+                        concurrency,
+                        start_timestamp,
+                        wall_seconds,
+                        sum(succeeded),
+                        len(succeeded) - sum(succeeded),
+                        len(succeeded) / wall_seconds * 60,
+                        usage.cpu_seconds / wall_seconds * 100,
+                        usage.peak_rss_bytes / 1024 / 1024,
+                    ],
+                )
+                if activity_latencies:
+                    conn.executemany(
+                        "INSERT INTO load_test_activity_latencies VALUES ($1, $2, $3, $4, $5);",
+                        [
+                            [
+                                run_id,
+                                concurrency,
+                                latency.workflow_id,
+                                latency.activity_type,
+                                latency.latency_seconds,
+                            ]
+                            for latency in activity_latencies
+                        ],
+                    )
+    finally:
+        worker.terminate()
+        worker.wait()
+        for fake_server in fake_servers:
+            await fake_server.cleanup()
+
+    print(f"\nLoad test {run_id} ({label}), stored in {Path(results_db).resolve()}")
+    _show_report(results_db, run_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(_cmd())
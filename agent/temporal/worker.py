@@ -5,36 +5,73 @@ from temporalio.worker import Worker
 
 from agent import settings
 from agent.llm.gemini.configure_genai import configure_genai
+from agent.llm.hedge import HedgingPolicy, configure_llm_request_hedging
+from agent.llm.usage.LLMResponseCache import LLMResponseCacheMode, configure_llm_response_cache
 from agent.temporal import activities
 from agent.temporal.client import get_temporal_client
 from agent.temporal.workflow import GenerateCelebratoryImageWorkflow, SolveAoCProblemWorkflow
 
 
 @click.command()
-async def main() -> None:
+@click.option(
+    "--llm-cache-mode",
+    type=click.Choice([mode.value for mode in LLMResponseCacheMode]),
+    default=settings.LLM_RESPONSE_CACHE_MODE,
+    show_default=True,
+    help="Whether to serve/record LLM responses from/to the on-disk response cache.",
+)
+@click.option(
+    "--llm-cache-dir",
+    type=click.Path(file_okay=False),
+    default=settings.LLM_RESPONSE_CACHE_DIR,
+    show_default=True,
+)
+@click.option(
+    "--llm-hedge-percentile",
+    type=click.FloatRange(0, 1, min_open=True, max_open=True),
+    default=settings.LLM_HEDGING_PERCENTILE,
+    help="Hedge LLM requests that are slower than this percentile of their history. Unset disables hedging.",  # noqa: E501
+)
+async def main(llm_cache_mode: str, llm_cache_dir: str, llm_hedge_percentile: float | None) -> None:
     # Just for the sake of this demo worker, let's see info logs.
     logging.basicConfig(level=logging.INFO)
 
     # Configuring this here ensures all activities in this worker are automatically configured.
     configure_genai()
+    configure_llm_response_cache(mode=LLMResponseCacheMode(llm_cache_mode), cache_dir=llm_cache_dir)
+    configure_llm_request_hedging(
+        HedgingPolicy(latency_percentile=llm_hedge_percentile)
+        if llm_hedge_percentile is not None
+        else None
+    )
+
+    client = await get_temporal_client()
+    activities.configure_llm_spend_reports(client)
 
     # Create a worker for the workflow
     worker = Worker(
-        await get_temporal_client(),
+        client,
         # TODO(steving) Generalize this to enable running locally or against prod Temporal Cloud.
         task_queue=settings.TEMPORAL_TASK_QUEUE_NAME,
         workflows=[SolveAoCProblemWorkflow, GenerateCelebratoryImageWorkflow],
+        interceptors=[activities.LLMScopeInterceptor()],
         activities=[
             activities.configure_llm_usage_logging_for_workflow,
+            activities.clear_llm_config_for_workflow,
             activities.extract_problem_part,
             activities.extract_examples,
             activities.get_examples_context,
+            activities.get_examples_with_context,
             activities.get_generated_unit_tests,
             activities.get_generated_implementation,
+            activities.reconcile_speculative_impl,
+            activities.get_incremental_part_2_impl,
+            activities.load_existing_part_artifacts,
             activities.commit_changes,
             activities.run_generated_tests,
             activities.run_generated_solution,
             activities.debug_unit_test_failures,
+            activities.direct_fix_unit_test_failures,
             activities.plan_impl_refactoring,
             activities.submit_solution,
             activities.extract_story_summary,
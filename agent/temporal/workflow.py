@@ -4,49 +4,68 @@ from datetime import timedelta
 from pydantic import BaseModel
 from temporalio import workflow
 from temporalio.common import RetryPolicy
-from temporalio.exceptions import ApplicationError
+from temporalio.exceptions import ActivityError, ApplicationError
+from temporalio.workflow import ActivityHandle
 
 
 # Imports passed through Temporal's sandbox without overriding stdlib.
 with workflow.unsafe.imports_passed_through():
     from agent.adventofcode.contextualize_examples import ExamplesContext
     from agent.adventofcode.debug.DebuggingPrompt import DebuggingPrompt
+    from agent.adventofcode.debug.debug_errors import DirectDebugFixOutput
+    from agent.adventofcode.debug.RefactoringPlan import RefactoringPlan
+    from agent.adventofcode.execute_generated_code import PART_1_REGRESSION_TESTS_FILENAME
     from agent.adventofcode.extract_examples import AoCProblemExtractedExamples
+    from agent.adventofcode.extract_examples_with_context import ExtractedExamplesWithContext
+    from agent.adventofcode.generate_code.GeneratedUnitTests import GeneratedUnitTests
+    from agent.adventofcode.generate_code.part_1_regression_tests import (
+        get_no_part_1_regression_tests_file_content,
+    )
+    from agent.adventofcode.load_existing_artifacts import ExistingArtifacts
     from agent.adventofcode.generate_code.generate_implementation import (
         GenerateImplementationOutput,
     )
     from agent.adventofcode.generate_code.generate_unit_tests import (
         GenerateUnitTestsOutput,
     )
+    from agent.llm.usage.LLMUsage import LLMSpend
     from agent.temporal.activities import (
+        REPORT_LLM_SPEND_SIGNAL,
         AoCProblem,
         CommitChangesArgs,
         ConfigureLLMUsageLoggingArgs,
         DebugUnitTestFailuresArgs,
+        DirectFixUnitTestFailuresArgs,
         ExtractExamplesArgs,
         ExtractProblemPartArgs,
         ExtractedProblemPart,
         FileToCommit,
         GenerateCelebratoryImageArgs,
         GeneratedSolutionRes,
-        GetExamplesContextArgs,
         GetGeneratedImplementationArgs,
         GetGeneratedUnitTestsArgs,
+        GetIncrementalPart2ImplementationArgs,
         PlanImplRefactoringArgs,
+        ReconcileSpeculativeImplementationArgs,
+        RunGeneratedCodeArgs,
         SubmitSolutionArgs,
         TestResults,
+        clear_llm_config_for_workflow,
         commit_changes,
         configure_llm_usage_logging_for_workflow,
         debug_unit_test_failures,
-        extract_examples,
+        direct_fix_unit_test_failures,
         extract_problem_part,
-        get_examples_context,
+        get_examples_with_context,
         extract_story_summary,
         meta_get_image_generation_prompt,
         generate_celebratory_image,
         get_generated_implementation,
         get_generated_unit_tests,
+        get_incremental_part_2_impl,
+        load_existing_part_artifacts,
         plan_impl_refactoring,
+        reconcile_speculative_impl,
         run_generated_solution,
         run_generated_tests,
         submit_solution,
@@ -55,7 +74,8 @@ with workflow.unsafe.imports_passed_through():
 
 # Independent attempts starting from scratch.
 _MAX_PROBLEM_PART_ATTEMPTS = 3
-# Really make sure that the extracted examples are legit.
+# Really make sure that the extracted examples are legit by voting across this many concurrent
+# extractions.
 _MAX_EXTRACT_EXAMPLES_ATTEMPTS = 3
 # Debugging loop iterations.
 _MAX_UNIT_TEST_FIX_ITERATIONS = 6
@@ -67,6 +87,32 @@ class SolveAoCProblemWorkflowArgs(BaseModel):
     solutions_dir: str
     log_dir: str
     dry_run: bool
+    # Start drafting the implementation from the problem HTML alone while the examples are still
+    # being extracted, and reconcile it with the examples context once that's available.
+    speculative_implementation: bool = True
+    # Solve part 2 by editing the passing part 1 implementation rather than starting from scratch,
+    # carrying over the part 1 tests as regression tests where they still apply.
+    incremental_part_2: bool = True
+    # Pick up from the tests and implementation committed by a previous run, if any, rather than
+    # regenerating them. If the committed solution already reproduces the accepted answer, the part
+    # is skipped entirely.
+    resume: bool = True
+    # See agent/llm/router.py.
+    llm_routing: bool = True
+    llm_overrides: dict[str, str] = {}
+    # Per-execution LLM budget. Once it's running low the agent falls back to cheaper models, and
+    # once it's exhausted any further LLM calls are refused.
+    max_llm_tokens: int | None = None
+    max_llm_cost: float | None = None
+
+
+class ProblemPartArtifacts(BaseModel):
+    """The artifacts of a solved problem part that part 2 can build on."""
+
+    # Unknown if the part was skipped because a previous run had already solved it.
+    examples_with_context: ExtractedExamplesWithContext | None
+    unit_tests: GeneratedUnitTests
+    implementation: GenerateImplementationOutput
 
 
 class SolveAoCProblemWorkflowResult(BaseModel):
@@ -83,13 +129,53 @@ class SolveAoCProblemWorkflowResult(BaseModel):
 
 @workflow.defn
 class SolveAoCProblemWorkflow:
+    def __init__(self) -> None:
+        # Reported by the activities whenever the budget runs low or out, periodically otherwise,
+        # and once more when the workflow is done.
+        self._llm_spend: LLMSpend | None = None
+
+    @workflow.signal(name=REPORT_LLM_SPEND_SIGNAL)
+    def report_llm_spend(self, spend: LLMSpend) -> None:
+        # Signals can arrive out of order since they're sent concurrently.
+        if self._llm_spend is not None and spend.num_calls <= self._llm_spend.num_calls:
+            return
+        if spend.is_low() and not (self._llm_spend and self._llm_spend.is_low()):
+            workflow.logger.warning(f"LLM budget is running low: {spend}")
+        self._llm_spend = spend
+
+    @workflow.query
+    def get_llm_spend(self) -> LLMSpend | None:
+        return self._llm_spend
+
     @workflow.run
     async def run(self, args: SolveAoCProblemWorkflowArgs) -> SolveAoCProblemWorkflowResult:
+        try:
+            return await self._solve(args)
+        finally:
+            final_llm_spend = await workflow.execute_activity(
+                clear_llm_config_for_workflow,
+                start_to_close_timeout=timedelta(seconds=15),
+                retry_policy=RetryPolicy(
+                    maximum_attempts=1,
+                ),
+            )
+            if final_llm_spend is not None:
+                self.report_llm_spend(final_llm_spend)
+
+    async def _solve(self, args: SolveAoCProblemWorkflowArgs) -> SolveAoCProblemWorkflowResult:
         # Configure logging LLM usage statistics. Note that this technique only works if 100% of
         # activities run on the same worker & thread.
         await workflow.execute_activity(
             configure_llm_usage_logging_for_workflow,
-            ConfigureLLMUsageLoggingArgs(year=args.year, day=args.day, log_dir=args.log_dir),
+            ConfigureLLMUsageLoggingArgs(
+                year=args.year,
+                day=args.day,
+                log_dir=args.log_dir,
+                llm_routing=args.llm_routing,
+                llm_overrides=args.llm_overrides,
+                max_llm_tokens=args.max_llm_tokens,
+                max_llm_cost=args.max_llm_cost,
+            ),
             start_to_close_timeout=timedelta(seconds=15),
             retry_policy=RetryPolicy(
                 maximum_attempts=1,
@@ -102,12 +188,20 @@ class SolveAoCProblemWorkflow:
         )
 
         # Start by solving part 1.
-        part_1_solution, part_1_implementation = await self._solve_part(
-            solve_aoc_part_1_problem_req,
-            problem_part,
-            solutions_dir=path_join(args.solutions_dir, "part1"),
-            dry_run=args.dry_run,
-        )
+        try:
+            part_1_solution, part_1_artifacts = await self._solve_part(
+                solve_aoc_part_1_problem_req,
+                problem_part,
+                solutions_dir=path_join(args.solutions_dir, "part1"),
+                dry_run=args.dry_run,
+                speculative_implementation=args.speculative_implementation,
+                resume=args.resume,
+            )
+        except (ActivityError, ApplicationError):
+            # The activities fail once their LLM calls start getting refused.
+            if not self._is_llm_budget_exhausted():
+                raise
+            part_1_solution, part_1_artifacts = self._get_llm_budget_exhausted_result(), None
         if isinstance(part_1_solution.result, GeneratedSolutionRes.Failure):
             # If we weren't even able to solve part 1, we can't move on to part 2.
             return SolveAoCProblemWorkflowResult(
@@ -119,24 +213,47 @@ class SolveAoCProblemWorkflow:
         problem_part = await self._scrape_problem_part(
             problem_req=solve_aoc_part_2_problem_req, solutions_dir=args.solutions_dir
         )
-        part_2_solution, _ = await self._solve_part(
-            solve_aoc_part_2_problem_req,
-            problem_part,
-            solutions_dir=path_join(args.solutions_dir, "part2"),
-            dry_run=args.dry_run,
-            part_1_generated_implementation=part_1_implementation,
-        )
+        try:
+            part_2_solution, _ = await self._solve_part(
+                solve_aoc_part_2_problem_req,
+                problem_part,
+                solutions_dir=path_join(args.solutions_dir, "part2"),
+                dry_run=args.dry_run,
+                speculative_implementation=args.speculative_implementation,
+                part_1_artifacts=part_1_artifacts,
+                incremental_part_2=args.incremental_part_2,
+                resume=args.resume,
+            )
+        except (ActivityError, ApplicationError):
+            # Still report part 1's solution.
+            if not self._is_llm_budget_exhausted():
+                raise
+            part_2_solution = self._get_llm_budget_exhausted_result()
 
         # Return the solutions we were able to get.
         return SolveAoCProblemWorkflowResult(
             part_1_solution=part_1_solution,
             part_2_solution=part_2_solution,
-            celebratory_image_generation_context=SolveAoCProblemWorkflowResult.CelebratoryImageGenerationContext(
-                problem_req=solve_aoc_part_2_problem_req,
-                problem_part=problem_part,
+            celebratory_image_generation_context=(
+                SolveAoCProblemWorkflowResult.CelebratoryImageGenerationContext(
+                    problem_req=solve_aoc_part_2_problem_req,
+                    problem_part=problem_part,
+                )
+                if isinstance(part_2_solution.result, GeneratedSolutionRes.Success)
+                else None
             ),
         )
 
+    def _is_llm_budget_exhausted(self) -> bool:
+        return self._llm_spend is not None and self._llm_spend.is_exhausted()
+
+    def _get_llm_budget_exhausted_result(self) -> GeneratedSolutionRes:
+        return GeneratedSolutionRes(
+            result=GeneratedSolutionRes.Failure(
+                exit_code=1, std_err=f"LLM budget exhausted: {self._llm_spend}"
+            )
+        )
+
     async def _scrape_problem_part(
         self, problem_req: AoCProblem, solutions_dir: str
     ) -> ExtractedProblemPart:
@@ -161,54 +278,154 @@ class SolveAoCProblemWorkflow:
         problem_part: ExtractedProblemPart,
         solutions_dir: str,
         dry_run: bool,
-        part_1_generated_implementation: GenerateImplementationOutput | None = None,
-    ) -> tuple[GeneratedSolutionRes, GenerateImplementationOutput]:
+        speculative_implementation: bool,
+        part_1_artifacts: ProblemPartArtifacts | None = None,
+        incremental_part_2: bool = False,
+        resume: bool = False,
+    ) -> tuple[GeneratedSolutionRes, ProblemPartArtifacts | None]:
         # Some of the prompts get modified to extract solutions to part 2.
         solve_part_2 = solve_aoc_problem_req.part == 2
+        part_1_generated_implementation = (
+            part_1_artifacts.implementation if part_1_artifacts else None
+        )
+        # Editing the part 1 implementation needs the examples context to know what to implement,
+        # so there's nothing to speculate on.
+        incremental_part_2 = incremental_part_2 and part_1_artifacts is not None
+
+        existing_artifacts = (
+            await workflow.execute_activity(
+                load_existing_part_artifacts,
+                solutions_dir,
+                start_to_close_timeout=timedelta(seconds=15),
+                retry_policy=RetryPolicy(maximum_attempts=3),
+            )
+            if resume
+            else ExistingArtifacts(unit_tests=None, implementation=None, cached_solution=None)
+        )
+        if solved_part := await self._reproduce_cached_solution(
+            solve_aoc_problem_req,
+            problem_part,
+            solutions_dir=solutions_dir,
+            existing_artifacts=existing_artifacts,
+            solve_part_2=solve_part_2,
+            part_1_generated_implementation=part_1_generated_implementation,
+        ):
+            return solved_part
 
         for i in range(_MAX_PROBLEM_PART_ATTEMPTS):
-            extracted_examples = await workflow.execute_activity(
-                extract_examples,
-                ExtractExamplesArgs(extracted_problem_part=problem_part, solve_part_2=solve_part_2),
-                start_to_close_timeout=timedelta(seconds=60),
-                retry_policy=RetryPolicy(maximum_attempts=5),
+            # Every LLM call of another attempt would just be refused.
+            if self._is_llm_budget_exhausted():
+                workflow.logger.warning(
+                    f"Giving up on part {solve_aoc_problem_req.part}, the LLM budget is exhausted."
+                )
+                return self._get_llm_budget_exhausted_result(), None
+            # Only the first attempt resumes from the previous run's tests and implementation, any
+            # further attempts start from scratch as usual.
+            resumed_unit_tests = existing_artifacts.unit_tests if i == 0 else None
+            resumed_implementation = existing_artifacts.implementation if i == 0 else None
+            resuming = resumed_unit_tests is not None and resumed_implementation is not None
+
+            # The implementation prompt mostly just depends on the problem HTML, so optionally get a
+            # head start on drafting it while the examples are still being worked out.
+            speculative_implementation_handle = (
+                workflow.start_activity(
+                    get_generated_implementation,
+                    GetGeneratedImplementationArgs(
+                        extracted_problem_part=problem_part,
+                        examples_context=None,
+                        solve_part_2=solve_part_2,
+                        part_1_generated_implementation=part_1_generated_implementation,
+                    ),
+                    start_to_close_timeout=timedelta(seconds=60),
+                    retry_policy=RetryPolicy(maximum_attempts=5),
+                )
+                if speculative_implementation and not incremental_part_2 and not resuming
+                else None
             )
 
-            examples_context = await workflow.execute_activity(
-                get_examples_context,
-                GetExamplesContextArgs(
+            # Extract and contextualize the examples in a single LLM call. This falls back to the
+            # separate extraction and contextualization calls internally if the fused response is
+            # invalid, so the timeout needs to leave room for both.
+            examples_with_context = await workflow.execute_activity(
+                get_examples_with_context,
+                ExtractExamplesArgs(
                     extracted_problem_part=problem_part,
-                    extracted_examples=extracted_examples,
                     solve_part_2=solve_part_2,
+                    num_samples=_MAX_EXTRACT_EXAMPLES_ATTEMPTS,
                 ),
-                start_to_close_timeout=timedelta(seconds=60),
+                start_to_close_timeout=timedelta(seconds=120),
                 retry_policy=RetryPolicy(maximum_attempts=5),
             )
+            extracted_examples = examples_with_context.extracted_examples
+            examples_context = examples_with_context.examples_context
 
             # Since I don't think I should show the unit tests to the LLM when asking it to generate
             # the implementation, I can just go ahead and generate the initial implementation
             # concurrently.
-            unit_tests, implementation = await asyncio.gather(
-                workflow.execute_activity(
-                    get_generated_unit_tests,
-                    GetGeneratedUnitTestsArgs(
-                        examples=extracted_examples, examples_context=examples_context
-                    ),
-                    start_to_close_timeout=timedelta(seconds=60),
-                    retry_policy=RetryPolicy(maximum_attempts=5),
+            get_unit_tests = workflow.execute_activity(
+                get_generated_unit_tests,
+                GetGeneratedUnitTestsArgs(
+                    examples=extracted_examples,
+                    examples_context=examples_context,
+                    resumed_unit_tests=resumed_unit_tests if resuming else None,
                 ),
-                workflow.execute_activity(
-                    get_generated_implementation,
-                    GetGeneratedImplementationArgs(
-                        extracted_problem_part=problem_part,
+                start_to_close_timeout=timedelta(seconds=60),
+                retry_policy=RetryPolicy(maximum_attempts=5),
+            )
+            # Always (re)write this file for part 2, so that the part 1 regression tests of an
+            # earlier incremental attempt never go stale.
+            part_1_regression_tests_file_content = get_no_part_1_regression_tests_file_content(
+                "part 2 wasn't derived from the part 1 implementation."
+            )
+            if resuming:
+                unit_tests, implementation = await asyncio.gather(
+                    get_unit_tests,
+                    workflow.execute_activity(
+                        get_generated_implementation,
+                        GetGeneratedImplementationArgs(
+                            extracted_problem_part=problem_part,
+                            examples_context=examples_context,
+                            solve_part_2=solve_part_2,
+                            part_1_generated_implementation=part_1_generated_implementation,
+                            resumed_implementation=resumed_implementation,
+                        ),
+                        start_to_close_timeout=timedelta(seconds=60),
+                        retry_policy=RetryPolicy(maximum_attempts=5),
+                    ),
+                )
+            elif incremental_part_2:
+                assert part_1_artifacts, "Incremental part 2 requires the part 1 artifacts."
+                unit_tests, incremental_implementation = await asyncio.gather(
+                    get_unit_tests,
+                    workflow.execute_activity(
+                        get_incremental_part_2_impl,
+                        GetIncrementalPart2ImplementationArgs(
+                            extracted_problem_part=problem_part,
+                            examples_with_context=examples_with_context,
+                            part_1_examples_with_context=part_1_artifacts.examples_with_context,
+                            part_1_unit_tests=part_1_artifacts.unit_tests,
+                            part_1_generated_implementation=part_1_artifacts.implementation,
+                        ),
+                        # Leave room for falling back to generating the implementation from scratch.
+                        start_to_close_timeout=timedelta(seconds=120),
+                        retry_policy=RetryPolicy(maximum_attempts=5),
+                    ),
+                )
+                implementation = incremental_implementation.implementation
+                part_1_regression_tests_file_content = (
+                    incremental_implementation.part_1_regression_tests_file_content
+                )
+            else:
+                unit_tests, implementation = await asyncio.gather(
+                    get_unit_tests,
+                    self._get_initial_implementation(
+                        problem_part=problem_part,
                         examples_context=examples_context,
                         solve_part_2=solve_part_2,
                         part_1_generated_implementation=part_1_generated_implementation,
+                        speculative_implementation_handle=speculative_implementation_handle,
                     ),
-                    start_to_close_timeout=timedelta(seconds=60),
-                    retry_policy=RetryPolicy(maximum_attempts=5),
-                ),
-            )
+                )
 
             # Commit these initial tests and implementation files right away before executing any
             # tests. At this point, we're just ensuring that we can actually track the progress that
@@ -227,6 +444,16 @@ class SolveAoCProblemWorkflow:
                             filename="solution.py",
                             content=implementation.generated_implementation.generated_implementation_file_content,
                         ),
+                        *(
+                            [
+                                FileToCommit(
+                                    filename=PART_1_REGRESSION_TESTS_FILENAME,
+                                    content=part_1_regression_tests_file_content,
+                                )
+                            ]
+                            if solve_part_2
+                            else []
+                        ),
                     ],
                     solutions_dir=solutions_dir,
                     commit_message="Initial Attempt",
@@ -259,16 +486,20 @@ class SolveAoCProblemWorkflow:
 
             problem_solution_result = await workflow.execute_activity(
                 run_generated_solution,
-                solve_aoc_problem_req,
+                RunGeneratedCodeArgs(
+                    aoc_problem=solve_aoc_problem_req, solutions_dir=solutions_dir
+                ),
                 start_to_close_timeout=timedelta(minutes=4),
                 # Don't allow any retries for execution of the actual problem solution.
                 retry_policy=RetryPolicy(maximum_attempts=1),
             )
 
             match problem_solution_result.result:
-                case GeneratedSolutionRes.Failure:
-                    raise ApplicationError(
-                        "Problem solution threw an exception! Need to figure out how to correct it."
+                case GeneratedSolutionRes.Failure(exit_code=exit_code, std_err=std_err):
+                    # The tests passed, so there's nothing for the debugging loop to go off of.
+                    # Just try again from scratch like for a wrong answer.
+                    workflow.logger.warning(
+                        f"Problem solution exited with {exit_code}:\n{std_err}\n...Retrying..."
                     )
                 case GeneratedSolutionRes.Success(output=output):
                     # Check if the solution is actually valid.
@@ -289,12 +520,116 @@ class SolveAoCProblemWorkflow:
                     )
                     if is_correct_solution:
                         # If the solution is correct, then we're done!
+                        problem_solution_result = GeneratedSolutionRes(
+                            result=GeneratedSolutionRes.Success(output=output, accepted=True)
+                        )
                         break
                     # Otherwise, potentially try again.
                 case _:
                     raise ValueError("Unexpected result type!")
 
-        return problem_solution_result, implementation
+        return problem_solution_result, ProblemPartArtifacts(
+            examples_with_context=examples_with_context,
+            unit_tests=unit_tests.generated_unit_tests,
+            implementation=implementation,
+        )
+
+    async def _reproduce_cached_solution(
+        self,
+        solve_aoc_problem_req: AoCProblem,
+        problem_part: ExtractedProblemPart,
+        solutions_dir: str,
+        existing_artifacts: ExistingArtifacts,
+        solve_part_2: bool,
+        part_1_generated_implementation: GenerateImplementationOutput | None,
+    ) -> tuple[GeneratedSolutionRes, ProblemPartArtifacts] | None:
+        """If a previous run already committed a solution that AoC accepted, then just make sure
+        that it still reproduces the accepted answer and skip the whole part."""
+        if not (
+            existing_artifacts.unit_tests
+            and existing_artifacts.implementation
+            and existing_artifacts.cached_solution
+        ):
+            return None
+
+        problem_solution_result = await workflow.execute_activity(
+            run_generated_solution,
+            RunGeneratedCodeArgs(aoc_problem=solve_aoc_problem_req, solutions_dir=solutions_dir),
+            start_to_close_timeout=timedelta(minutes=4),
+            retry_policy=RetryPolicy(maximum_attempts=1),
+        )
+        match problem_solution_result.result:
+            case GeneratedSolutionRes.Success(output=output) if (
+                output.strip() == existing_artifacts.cached_solution
+            ):
+                workflow.logger.info(
+                    f"Part {solve_aoc_problem_req.part} was already solved by a previous run."
+                )
+                problem_solution_result = GeneratedSolutionRes(
+                    result=GeneratedSolutionRes.Success(output=output, accepted=True)
+                )
+            case _:
+                return None
+
+        # Just records the existing implementation in the usual prompt history, no LLM involved.
+        implementation = await workflow.execute_activity(
+            get_generated_implementation,
+            GetGeneratedImplementationArgs(
+                extracted_problem_part=problem_part,
+                examples_context=None,
+                solve_part_2=solve_part_2,
+                part_1_generated_implementation=part_1_generated_implementation,
+                resumed_implementation=existing_artifacts.implementation,
+            ),
+            start_to_close_timeout=timedelta(seconds=15),
+            retry_policy=RetryPolicy(maximum_attempts=3),
+        )
+        return problem_solution_result, ProblemPartArtifacts(
+            examples_with_context=None,
+            unit_tests=existing_artifacts.unit_tests,
+            implementation=implementation,
+        )
+
+    async def _get_initial_implementation(
+        self,
+        problem_part: ExtractedProblemPart,
+        examples_context: ExamplesContext,
+        solve_part_2: bool,
+        part_1_generated_implementation: GenerateImplementationOutput | None,
+        speculative_implementation_handle: ActivityHandle[GenerateImplementationOutput] | None,
+    ) -> GenerateImplementationOutput:
+        if speculative_implementation_handle:
+            try:
+                speculative_implementation = await speculative_implementation_handle
+            except ActivityError as e:
+                workflow.logger.warning(f"Speculative implementation failed: {e}...Regenerating...")
+            else:
+                # Keep the draft if it already fits the tested function signature, or patch it.
+                return await workflow.execute_activity(
+                    reconcile_speculative_impl,
+                    ReconcileSpeculativeImplementationArgs(
+                        extracted_problem_part=problem_part,
+                        speculative_implementation=speculative_implementation,
+                        examples_context=examples_context,
+                        solve_part_2=solve_part_2,
+                        part_1_generated_implementation=part_1_generated_implementation,
+                    ),
+                    # May need to fall back to generating from scratch.
+                    start_to_close_timeout=timedelta(seconds=120),
+                    retry_policy=RetryPolicy(maximum_attempts=5),
+                )
+
+        return await workflow.execute_activity(
+            get_generated_implementation,
+            GetGeneratedImplementationArgs(
+                extracted_problem_part=problem_part,
+                examples_context=examples_context,
+                solve_part_2=solve_part_2,
+                part_1_generated_implementation=part_1_generated_implementation,
+            ),
+            start_to_close_timeout=timedelta(seconds=60),
+            retry_policy=RetryPolicy(maximum_attempts=5),
+        )
 
 
 async def iteratively_make_unit_tests_pass(
@@ -308,8 +643,11 @@ async def iteratively_make_unit_tests_pass(
     implementation: GenerateImplementationOutput,
 ) -> tuple[GenerateUnitTestsOutput, GenerateImplementationOutput]:
     # Run an initial test to see where we're at. Maybe we get lucky and it works first try.
-    unit_test_results = await _run_unit_tests(solve_aoc_problem_req)
+    unit_test_results = await _run_unit_tests(solve_aoc_problem_req, solutions_dir)
 
+    # Start out debugging with the single-call direct fix fast path, and only escalate to the slower
+    # theorize -> plan -> fix chain once the fast path fails.
+    use_direct_fix = True
     attempt = 0
     while True:
         attempt += 1
@@ -318,88 +656,100 @@ async def iteratively_make_unit_tests_pass(
                 if attempt >= _MAX_UNIT_TEST_FIX_ITERATIONS:
                     break  # Failed too many times, fallthrough to throwing exception.
 
-                theorized_solution = await workflow.execute_activity(
-                    debug_unit_test_failures,
-                    DebugUnitTestFailuresArgs(
-                        problem_html=problem_part.problem_html,
+                direct_fix = (
+                    await _get_direct_fix(
+                        problem_part=problem_part,
                         examples_context=examples_context,
-                        unit_tests_src=unit_tests.generated_unit_tests,
-                        generated_impl_src=implementation.generated_implementation,
+                        unit_tests=unit_tests,
+                        implementation=implementation,
                         error_msg=test_failure.err_msg,
-                    ),
-                    start_to_close_timeout=timedelta(seconds=120),
-                    retry_policy=RetryPolicy(maximum_attempts=3),
+                    )
+                    if use_direct_fix
+                    else None
                 )
-                if theorized_solution.optional_theorized_implementation_fix:
-                    # Use the theorized solution to plan a refactoring.
-                    impl_refactoring_plan = await workflow.execute_activity(
-                        plan_impl_refactoring,
-                        PlanImplRefactoringArgs(
-                            examples=extracted_examples,
+                impl_refactoring_plan: RefactoringPlan | None = None
+                if direct_fix:
+                    theorized_solution = direct_fix.theorized_solution
+                    impl_refactoring_plan = direct_fix.impl_refactoring_plan
+                    unit_tests = direct_fix.unit_tests
+                    implementation = direct_fix.implementation
+                else:
+                    use_direct_fix = False
+                    theorized_solution = await workflow.execute_activity(
+                        debug_unit_test_failures,
+                        DebugUnitTestFailuresArgs(
+                            problem_html=problem_part.problem_digest,
                             examples_context=examples_context,
+                            unit_tests_src=unit_tests.generated_unit_tests,
                             generated_impl_src=implementation.generated_implementation,
-                            theorized_solution=theorized_solution,
+                            error_msg=test_failure.err_msg,
                         ),
-                        start_to_close_timeout=timedelta(seconds=60),
+                        start_to_close_timeout=timedelta(seconds=120),
                         retry_policy=RetryPolicy(maximum_attempts=3),
                     )
-
-                async def fix_unit_tests() -> GenerateUnitTestsOutput:
-                    return await workflow.execute_activity(
-                        get_generated_unit_tests,
-                        GetGeneratedUnitTestsArgs(
-                            examples=extracted_examples,
-                            examples_context=examples_context,
-                            debugging_prompt=DebuggingPrompt(
-                                prior_msg_history=unit_tests.prompt_history,
-                                error_msg=test_failure.err_msg,
+                    if theorized_solution.optional_theorized_implementation_fix:
+                        # Use the theorized solution to plan a refactoring.
+                        impl_refactoring_plan = await workflow.execute_activity(
+                            plan_impl_refactoring,
+                            PlanImplRefactoringArgs(
+                                examples=extracted_examples,
+                                examples_context=examples_context,
+                                generated_impl_src=implementation.generated_implementation,
                                 theorized_solution=theorized_solution,
-                                impl_refactoring_plan=None,
                             ),
-                        ),
-                        start_to_close_timeout=timedelta(seconds=60),
-                        retry_policy=RetryPolicy(maximum_attempts=5),
-                    )
-
-                async def fix_implementation() -> GenerateImplementationOutput:
-                    return await workflow.execute_activity(
-                        get_generated_implementation,
-                        GetGeneratedImplementationArgs(
-                            extracted_problem_part=problem_part,
-                            examples_context=examples_context,
-                            solve_part_2=solve_aoc_problem_req.part == 2,
-                            debugging_prompt=DebuggingPrompt(
-                                prior_msg_history=implementation.prompt_history,
-                                error_msg=test_failure.err_msg,
-                                theorized_solution=theorized_solution,
-                                impl_refactoring_plan=impl_refactoring_plan,
+                            start_to_close_timeout=timedelta(seconds=60),
+                            retry_policy=RetryPolicy(maximum_attempts=3),
+                        )
+
+                    async def fix_unit_tests() -> GenerateUnitTestsOutput:
+                        return await workflow.execute_activity(
+                            get_generated_unit_tests,
+                            GetGeneratedUnitTestsArgs(
+                                examples=extracted_examples,
+                                examples_context=examples_context,
+                                debugging_prompt=DebuggingPrompt(
+                                    prior_msg_history=unit_tests.prompt_history,
+                                    error_msg=test_failure.err_msg,
+                                    theorized_solution=theorized_solution,
+                                    impl_refactoring_plan=None,
+                                ),
                             ),
-                        ),
-                        start_to_close_timeout=timedelta(seconds=120),
-                        retry_policy=RetryPolicy(maximum_attempts=5),
-                    )
-                    # TODO(steving) Reconsider if this may be helpful.
-                    # return GenerateImplementationOutput(
-                    #     # Let's just keep the context short for now and only include the original
-                    #     # prompt and the latest implementation.
-                    #     prompt_history=[res.prompt_history[0], res.prompt_history[-1]],
-                    #     generated_implementation=res.generated_implementation,
-                    # )
-
-                # Determine which source files the LLM wants to make changes to. Separate cases
-                # for now literally just to execute these in parallel if LLM decides it needs to
-                # update BOTH files at the same time.
-                if (
-                    theorized_solution.optional_theorized_unit_test_fix
-                    and theorized_solution.optional_theorized_implementation_fix
-                ):
-                    unit_tests, implementation = await asyncio.gather(
-                        fix_unit_tests(), fix_implementation()
-                    )
-                if theorized_solution.optional_theorized_unit_test_fix:
-                    unit_tests = await fix_unit_tests()
-                if theorized_solution.optional_theorized_implementation_fix:
-                    implementation = await fix_implementation()
+                            start_to_close_timeout=timedelta(seconds=60),
+                            retry_policy=RetryPolicy(maximum_attempts=5),
+                        )
+
+                    async def fix_implementation() -> GenerateImplementationOutput:
+                        return await workflow.execute_activity(
+                            get_generated_implementation,
+                            GetGeneratedImplementationArgs(
+                                extracted_problem_part=problem_part,
+                                examples_context=examples_context,
+                                solve_part_2=solve_aoc_problem_req.part == 2,
+                                debugging_prompt=DebuggingPrompt(
+                                    prior_msg_history=implementation.prompt_history,
+                                    error_msg=test_failure.err_msg,
+                                    theorized_solution=theorized_solution,
+                                    impl_refactoring_plan=impl_refactoring_plan,
+                                ),
+                            ),
+                            start_to_close_timeout=timedelta(seconds=120),
+                            retry_policy=RetryPolicy(maximum_attempts=5),
+                        )
+
+                    # Determine which source files the LLM wants to make changes to. Separate cases
+                    # for now literally just to execute these in parallel if LLM decides it needs to
+                    # update BOTH files at the same time.
+                    if (
+                        theorized_solution.optional_theorized_unit_test_fix
+                        and theorized_solution.optional_theorized_implementation_fix
+                    ):
+                        unit_tests, implementation = await asyncio.gather(
+                            fix_unit_tests(), fix_implementation()
+                        )
+                    if theorized_solution.optional_theorized_unit_test_fix:
+                        unit_tests = await fix_unit_tests()
+                    if theorized_solution.optional_theorized_implementation_fix:
+                        implementation = await fix_implementation()
 
                 await workflow.execute_activity(
                     commit_changes,
@@ -426,10 +776,14 @@ async def iteratively_make_unit_tests_pass(
 ### Theorized solution:
 ```json
 {theorized_solution.model_dump_json(indent=4)}
-```{f"""
+```{
+                            f'''
 ### Implementation refactoring plan:
 {impl_refactoring_plan.model_dump_json(indent=4)}
-""" if theorized_solution.optional_theorized_implementation_fix else ""}
+'''
+                            if impl_refactoring_plan
+                            else ""
+                        }
 """,
                         dry_run=dry_run,
                     ),
@@ -438,7 +792,15 @@ async def iteratively_make_unit_tests_pass(
                 )
 
                 # Finally, rerun the tests against the latest changes.
-                unit_test_results = await _run_unit_tests(solve_aoc_problem_req)
+                unit_test_results = await _run_unit_tests(solve_aoc_problem_req, solutions_dir)
+                if (
+                    direct_fix
+                    and isinstance(unit_test_results.result, TestResults.Failure)
+                    and unit_test_results.result.err_msg == test_failure.err_msg
+                ):
+                    # The direct fix made no progress at all, so escalate to the full chain for the
+                    # remaining attempts.
+                    use_direct_fix = False
             case _:
                 # The tests passed! Return the latest updated source code.
                 return unit_tests, implementation
@@ -448,10 +810,36 @@ async def iteratively_make_unit_tests_pass(
     )
 
 
-async def _run_unit_tests(solve_aoc_problem_req: AoCProblem) -> TestResults:
+async def _get_direct_fix(
+    problem_part: ExtractedProblemPart,
+    examples_context: ExamplesContext,
+    unit_tests: GenerateUnitTestsOutput,
+    implementation: GenerateImplementationOutput,
+    error_msg: str,
+) -> DirectDebugFixOutput | None:
+    try:
+        return await workflow.execute_activity(
+            direct_fix_unit_test_failures,
+            DirectFixUnitTestFailuresArgs(
+                problem_html=problem_part.problem_digest,
+                examples_context=examples_context,
+                unit_tests=unit_tests,
+                implementation=implementation,
+                error_msg=error_msg,
+            ),
+            start_to_close_timeout=timedelta(seconds=120),
+            # Don't bother retrying, the full debugging chain is right there as a fallback.
+            retry_policy=RetryPolicy(maximum_attempts=1),
+        )
+    except ActivityError as e:
+        workflow.logger.warning(f"Direct debug fix failed, escalating to the full chain: {e}")
+        return None
+
+
+async def _run_unit_tests(solve_aoc_problem_req: AoCProblem, solutions_dir: str) -> TestResults:
     return await workflow.execute_activity(
         run_generated_tests,
-        solve_aoc_problem_req,
+        RunGeneratedCodeArgs(aoc_problem=solve_aoc_problem_req, solutions_dir=solutions_dir),
         # The implementation times out pytest execution at 60 seconds so this should be longer just
         # so the timeouts can also be signaled to the agent.
         start_to_close_timeout=timedelta(minutes=4),
@@ -479,7 +867,7 @@ class GenerateCelebratoryImageWorkflow:
         """Generates a problem story image using DALL-E."""
         problem_story_summary = await workflow.execute_activity(
             extract_story_summary,
-            args.problem_part.problem_html,
+            args.problem_part.problem_digest,
             start_to_close_timeout=timedelta(seconds=20),
             retry_policy=RetryPolicy(maximum_attempts=3),
         )